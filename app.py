@@ -1,12 +1,29 @@
 #!/usr/bin/env python3
 import os
 import re
+import json
 import uuid
-import threading
 import time
-from flask import Flask, render_template, request, jsonify, send_from_directory, url_for
+import threading
+import mimetypes
+from urllib.parse import quote
+from flask import (Flask, Response, render_template, request, jsonify, send_file,
+                   stream_with_context, url_for)
 from werkzeug.utils import secure_filename
-from video_utils import VideoProcessor
+from video_utils import VIDEO_EXTENSIONS, VideoProcessor
+from media_probe import status_video_info
+from job_queue import QueueFullError, SQLiteJobQueue
+from job_store import FINISHED_STATUSES, create_job_store
+from conversion_cache import ConversionCache, ContentHasher
+from chunked_upload import ChunkedUploadManager, UploadError
+from partial_probe import PartialProbe
+from pipelined_upload import GrowingFile
+from encoder_profiles import PROFILES, EncoderProfileSelector, ffmpeg_capabilities
+from worker import ConversionJobRunner
+from cost_model import CostModel
+from storage_manager import Janitor, OutputStorage, reclaim_upload_orphans, remove_path
+from cpu_partition import CPUPartitioner, available_cpus, default_worker_count
+import metrics
 import logging
 
 # Настройка логирования
@@ -23,27 +40,166 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['RENDER_FOLDER'] = 'Render'
-app.config['MAX_CONTENT_LENGTH'] = 1024 * 1024 * 1024  # 1GB макс. размер файла
+app.config['MAX_CONTENT_LENGTH'] = 1024 * 1024 * 1024  # 1GB макс. размер запроса
+app.config['MAX_UPLOAD_SIZE'] = 10 * 1024 * 1024 * 1024  # 10GB макс. размер файла при загрузке частями
 app.config['CLEANUP_TEMP_FILES'] = True  # Очищать временные файлы после обработки
+app.config['CONVERSION_WORKERS'] = default_worker_count()  # Обработчиков очереди в веб-процессе (0 - только отдельные worker.py)
+app.config['CONVERSION_QUEUE_SIZE'] = 100  # Максимальное количество задач в очереди
+app.config['BATCH_MAX_FILES'] = 100  # Максимальное количество файлов в одном пакете /batch
+app.config['BATCH_SOURCE_ROOT'] = None  # Директория файлов сервера для /batch по путям (None - только загрузка файлов)
+app.config['BATCH_QUEUE_SIZE'] = 1000  # Лимит очереди для пакетов по путям: файлы не занимают uploads/
+app.config['QUEUE_LEASE_SECONDS'] = 60  # Срок аренды задачи обработчиком; продлевается, пока задача выполняется
+app.config['QUEUE_HEARTBEAT_INTERVAL'] = 10  # Период продления аренды (в секундах)
+app.config['QUEUE_MAX_ATTEMPTS'] = 3  # Попыток до перевода задачи в dead-letter
+app.config['QUEUE_RETRY_DELAY'] = 30  # Задержка перед повторной попыткой (умножается на номер попытки)
+app.config['QUEUE_AGING_RATE'] = 1.0  # Секунд оценки, на которые задача продвигается за секунду ожидания (0 - без старения)
+app.config['JOB_STORE_BACKEND'] = 'sqlite'  # Хранилище задач: 'sqlite' или 'memory'
+app.config['DATABASE_PATH'] = 'video_converter.db'  # Общая база для всех веб-процессов
+app.config['JOB_RETENTION_SECONDS'] = 24 * 60 * 60  # Срок хранения записей о задачах
+app.config['OUTPUT_RETENTION_SECONDS'] = 24 * 60 * 60  # Срок хранения результатов в RENDER_FOLDER (None - без срока)
+app.config['OUTPUT_QUOTA_BYTES'] = 100 * 1024 * 1024 * 1024  # Лимит объема RENDER_FOLDER, сверх него удаляются старые (None - без лимита)
+app.config['UPLOAD_ORPHAN_SECONDS'] = 6 * 60 * 60  # Загрузки без задачи старше этого удаляются при запуске
+app.config['OUTPUT_ADOPT_MIN_AGE'] = 60 * 60  # Результаты без записи в индексе учитываются при запуске, если не менялись столько секунд
+app.config['CHUNKED_UPLOAD_STALE_SECONDS'] = 24 * 60 * 60  # Незавершенные загрузки частями без новых частей удаляются
+app.config['JANITOR_INTERVAL'] = 5 * 60  # Период очистки устаревших записей и файлов (в секундах)
+app.config['CACHE_ENABLED'] = True  # Повторно использовать результаты для одинаковых файлов
+app.config['CACHE_FOLDER'] = 'cache'  # Должна находиться на том же разделе, что и RENDER_FOLDER
+app.config['CACHE_MAX_BYTES'] = 20 * 1024 * 1024 * 1024  # Лимит объема кеша (20 ГБ)
+app.config['SEGMENT_DURATION_THRESHOLD'] = 600  # Видео длиннее 10 минут кодируются по сегментам (0 - отключить)
+app.config['SEGMENT_WORKERS'] = None  # Параллельных сегментов на задачу (None - по числу ядер)
+app.config['REMUX_FAST_PATH'] = True  # Копировать видеопоток, если он уже соответствует выходным параметрам
+app.config['CPU_PARTITIONING'] = True  # Делить процессоры между одновременными задачами и привязывать к ним FFmpeg
+app.config['CPU_SET'] = None  # Процессоры для кодирования в формате cpuset, например '2-15' (None - все доступные)
+app.config['CPU_RESERVED_FOR_WEB'] = 1  # Процессоров, на которых FFmpeg не запускается (остаются веб-запросам)
+app.config['ENCODER_NICE'] = 10  # Приращение nice процессов FFmpeg (0 - не менять)
+app.config['ENCODER_IO_PRIORITY'] = 7  # Приоритет ввода-вывода FFmpeg: best-effort 0-7, 7 - низший (None - не менять)
+app.config['PREVIEWS_ENABLED'] = True  # Постер, листы миниатюр и облегченная копия тем же проходом FFmpeg, что и MP4
+app.config['ENCODER_PROFILE'] = 'auto'  # Профиль кодирования: 'auto' (по нагрузке) или имя из encoder_profiles.PROFILES
+app.config['ENCODER_PROFILE_THRESHOLDS'] = [0.5, 1.5, 3.0]  # Нагрузка, при которой выбирается следующий по скорости профиль
+app.config['UPLOAD_BUFFER_SIZE'] = 1024 * 1024  # Размер блока при записи загрузки на диск
+app.config['PROBE_MAX_BYTES'] = 16 * 1024 * 1024  # Лимит начала и конца файла для предварительной проверки
+app.config['PROBE_RETENTION_SECONDS'] = 60 * 60  # Срок хранения неиспользованных результатов проверки
+app.config['PROBE_CACHE_SIZE'] = 1024  # Результатов ffprobe в памяти процесса по (путь, размер, mtime) (0 - без кеша)
+app.config['PIPELINE_UPLOADS'] = True  # Конвертировать потоковые контейнеры во время загрузки
+app.config['PIPELINE_MAX_STREAMS'] = 2  # Одновременных конвертаций во время загрузки (сверх пула)
+app.config['PIPELINE_CANCEL_POLL_SECONDS'] = 2  # Период проверки отмены конвертации во время загрузки из других процессов
+app.config['FFMPEG_STALL_TIMEOUT'] = 120  # FFmpeg без прогресса дольше этого времени (в секундах) завершается
+app.config['JOB_MAX_SECONDS'] = 6 * 60 * 60  # Лимит времени обработки одной задачи (None - без лимита)
+app.config['PROGRESS_UPDATE_INTERVAL'] = 1.0  # Как часто сохранять прогресс FFmpeg (в секундах)
+app.config['STATUS_STREAM_INTERVAL'] = 0.5  # Период проверки статуса в SSE-потоке
+app.config['STATUS_STREAM_KEEPALIVE'] = 15  # Период комментариев keep-alive в SSE-потоке
+app.config['SENDFILE_MODE'] = None  # Отдача результатов прокси: None (сам Flask), 'x-accel-redirect' (nginx) или 'x-sendfile'
+app.config['X_ACCEL_PREFIX'] = '/protected/render/'  # internal-location nginx, указывающий на RENDER_FOLDER
 
 # Создаем необходимые директории, если они не существуют
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['RENDER_FOLDER'], exist_ok=True)
 
-# Словарь для отслеживания статуса конвертации
-conversion_status = {}
+# Хранилище статусов конвертации
+job_store = create_job_store(app.config['JOB_STORE_BACKEND'], app.config['DATABASE_PATH'])
+
+# Учет результатов: уникальные имена, срок хранения и квота
+output_storage = OutputStorage(app.config['RENDER_FOLDER'], app.config['DATABASE_PATH'])
+
+# Наборы процессоров для одновременных задач: по одному на обработчик очереди этого процесса
+cpu_partitioner = None
+if app.config['CPU_PARTITIONING']:
+    cpu_partitioner = CPUPartitioner(
+        available_cpus(app.config['CPU_SET']),
+        slots=max(1, app.config['CONVERSION_WORKERS']),
+        reserved=app.config['CPU_RESERVED_FOR_WEB'],
+        nice=app.config['ENCODER_NICE'],
+        io_priority=app.config['ENCODER_IO_PRIORITY']
+    )
 
 # Инициализируем процессор видео
 video_processor = VideoProcessor(
     render_dir=app.config['RENDER_FOLDER'],
-    temp_dir=app.config['UPLOAD_FOLDER']
+    temp_dir=app.config['UPLOAD_FOLDER'],
+    segment_threshold=app.config['SEGMENT_DURATION_THRESHOLD'],
+    segment_workers=app.config['SEGMENT_WORKERS'],
+    remux_enabled=app.config['REMUX_FAST_PATH'],
+    stall_timeout=app.config['FFMPEG_STALL_TIMEOUT'],
+    max_job_duration=app.config['JOB_MAX_SECONDS'],
+    output_storage=output_storage,
+    previews=app.config['PREVIEWS_ENABLED'],
+    probe_cache_size=app.config['PROBE_CACHE_SIZE'],
+    cpu_partitioner=cpu_partitioner
+)
+
+# Возможности сборки FFmpeg опрашиваются один раз при запуске
+ffmpeg_capabilities()
+
+# Выбор профиля кодирования по нагрузке и статистика по профилям
+profile_selector = EncoderProfileSelector(
+    app.config['ENCODER_PROFILE'],
+    app.config['ENCODER_PROFILE_THRESHOLDS']
+)
+
+# Возобновляемые загрузки частями
+upload_manager = ChunkedUploadManager(
+    upload_dir=app.config['UPLOAD_FOLDER'],
+    db_path=app.config['DATABASE_PATH'],
+    max_size=app.config['MAX_UPLOAD_SIZE'],
+    buffer_size=app.config['UPLOAD_BUFFER_SIZE']
 )
 
+# Предварительная проверка файла до полной загрузки
+partial_probe = PartialProbe(
+    video_processor,
+    probe_dir=app.config['UPLOAD_FOLDER'],
+    db_path=app.config['DATABASE_PATH'],
+    max_bytes=app.config['PROBE_MAX_BYTES']
+)
+
+# Кеш готовых результатов по содержимому исходного файла
+conversion_cache = None
+if app.config['CACHE_ENABLED']:
+    conversion_cache = ConversionCache(
+        cache_dir=app.config['CACHE_FOLDER'],
+        db_path=app.config['DATABASE_PATH'],
+        max_bytes=app.config['CACHE_MAX_BYTES']
+    )
+
+# Долговременная очередь конвертации в общей базе: ее разбирают потоки веб-процессов и процессы worker.py
+job_queue = SQLiteJobQueue(
+    app.config['DATABASE_PATH'],
+    lease_seconds=app.config['QUEUE_LEASE_SECONDS'],
+    max_attempts=app.config['QUEUE_MAX_ATTEMPTS'],
+    retry_delay=app.config['QUEUE_RETRY_DELAY'],
+    max_size=app.config['CONVERSION_QUEUE_SIZE'],
+    aging_rate=app.config['QUEUE_AGING_RATE']
+)
+metrics.JOBS_QUEUED.set_function(lambda: job_queue.stats()['queued_jobs'])
+
+# Выполнение задач из очереди и сохранение результатов
+conversion_runner = ConversionJobRunner(
+    job_store,
+    job_queue,
+    video_processor,
+    profile_selector,
+    CostModel(app.config['DATABASE_PATH']),
+    conversion_cache,
+    cleanup_temp_files=app.config['CLEANUP_TEMP_FILES'],
+    progress_interval=app.config['PROGRESS_UPDATE_INTERVAL']
+)
+
+# Обработчики в веб-процессе; при CONVERSION_WORKERS = 0 задачи выполняют только процессы worker.py
+queue_worker = conversion_runner.create_worker(heartbeat_interval=app.config['QUEUE_HEARTBEAT_INTERVAL'])
+if app.config['CONVERSION_WORKERS'] > 0:
+    queue_worker.start(app.config['CONVERSION_WORKERS'])
+
 def allowed_file(filename):
     """Проверяет, допустимое ли расширение файла"""
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in [
-        'mp4', 'avi', 'mov', 'wmv', 'mkv', 'flv', 'webm', '3gp', 'ts', 'mpg', 'mpeg', 'm4v', 'mts', 'm2ts'
-    ]
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in VIDEO_EXTENSIONS
+
+def valid_encoder_profile(name):
+    """Проверяет имя профиля кодирования, запрошенного клиентом"""
+    return not name or name == 'auto' or (isinstance(name, str) and name in PROFILES)
+
+def valid_output_format(name):
+    """Проверяет формат результата, запрошенный клиентом: 'mp4' (один файл) или 'hls' (несколько качеств)"""
+    return not name or name in ('mp4', 'hls')
 
 def sanitize_filename(filename):
     """Очищает имя файла от небезопасных символов"""
@@ -53,30 +209,336 @@ def sanitize_filename(filename):
     filename = re.sub(r'[^\w\.-]', '_', filename)
     return filename
 
-def process_video_async(input_path, original_filename, job_id):
+def save_upload(stream, input_path, on_write=None):
     """
-    Асинхронно обрабатывает видео в отдельном потоке.
+    Записывает загруженный файл на диск, одновременно вычисляя хеш содержимого.
 
     Args:
-        input_path: Путь к исходному видео
-        original_filename: Исходное имя файла
-        job_id: Идентификатор задачи
+        stream: Поток с содержимым файла
+        input_path: Путь для сохранения
+        on_write: Функция, получающая размер каждого записанного на диск блока
+
+    Returns:
+        Кортеж (размер_в_байтах, хеш_содержимого)
+    """
+    hasher = ContentHasher()
+    buffer_size = app.config['UPLOAD_BUFFER_SIZE']
+    with metrics.timed('upload_write'), open(input_path, 'wb') as output:
+        while True:
+            chunk = stream.read(buffer_size)
+            if not chunk:
+                break
+            hasher.update(chunk)
+            output.write(chunk)
+            if on_write:
+                # Блок должен быть на диске до того, как его прочитает FFmpeg
+                output.flush()
+                on_write(len(chunk))
+    metrics.INPUT_BYTES.inc(hasher.size)
+    return hasher.size, hasher.hexdigest()
+
+def complete_from_cache(job_id, input_path, filename, content_hash, video_info=None, requested_profile=None):
+    """
+    Пытается завершить задачу готовым результатом из кеша.
+
+    Результат ищется для профиля, которым задача была бы закодирована
+    сейчас: запрошенного клиентом или выбранного по нагрузке. Если
+    видеопоток будет скопирован без перекодирования, профиль не важен.
+
+    Returns:
+        True, если результат найден и задача завершена
     """
+    if conversion_cache is None:
+        return False
+
+    encoder_profile = None
+    if video_info is None or video_processor.plan_conversion(video_info)['video'] == 'encode':
+        encoder_profile = conversion_runner.select_encoder_profile(requested_profile)
+    entry = conversion_cache.lookup(content_hash, video_processor.conversion_params_key(encoder_profile))
+    if entry is None:
+        return False
+
+    result = dict(entry['result'])
     try:
-        # Обрабатываем видео
-        result = video_processor.process_video(input_path, original_filename)
+        output_filename, output_path = video_processor.generate_output_filename(filename)
+        preview_path = None
+        if 'previews' in result:
+            preview_dirname, preview_path = video_processor.generate_preview_dirname(output_filename)
+            result['previews'] = dict(result['previews'], dir=preview_dirname)
+        conversion_cache.materialize(entry, output_path, preview_path)
+    except OSError as e:
+        logger.error(f"Не удалось использовать результат из кеша: {e}")
+        return False
 
-        # Обновляем статус
-        conversion_status[job_id].update(result)
+    result.update({
+        'status': 'completed',
+        'output_filename': output_filename,
+        'cache_hit': True
+    })
+    if result.get('video_info'):
+        result['video_summary'] = status_video_info(result['video_info'])
+    job_store.update(job_id, result)
+    output_storage.register(output_filename, job_id)
+    if 'previews' in result:
+        output_storage.register(result['previews']['dir'], job_id)
+    video_processor.cleanup_temp_file(input_path)
+    metrics.JOBS_FINISHED.inc(status='cache_hit')
+    logger.info(f"Задача {job_id} завершена из кеша: {output_filename}")
+    return True
 
-        # Очищаем временный файл, если требуется
-        if app.config['CLEANUP_TEMP_FILES']:
-            video_processor.cleanup_temp_file(input_path)
+def pipeline_video_async(job_id, source, input_path, original_filename, video_info, requested_profile=None):
+    """
+    Конвертирует видео, пока оно еще загружается.
 
+    Данные передаются в stdin FFmpeg из дописываемого файла. Если потоковая
+    конвертация не удалась (например, FFmpeg понадобилась перемотка) или
+    файл не совпал с предварительной проверкой, задача ставится в обычную
+    очередь и обрабатывается по полностью загруженному файлу.
+
+    Args:
+        job_id: Идентификатор задачи
+        source: Загружаемый файл (GrowingFile)
+        input_path: Путь к загружаемому файлу
+        original_filename: Исходное имя файла
+        video_info: Информация о видео из предварительной проверки
+        requested_profile: Профиль кодирования, запрошенный клиентом
+    """
+    encoder_profile = conversion_runner.select_encoder_profile(requested_profile)
+    job_store.update(job_id, {'encoder_profile': encoder_profile})
+    metrics.JOBS_IN_FLIGHT.inc()
+
+    # Отмена из другого веб-процесса приходит флагом в записи задачи
+    converted = threading.Event()
+    threading.Thread(target=watch_cancel_request, args=(job_id, converted), daemon=True).start()
+    try:
+        result = video_processor.process_stream(
+            source.chunks(), original_filename, video_info, conversion_runner.make_progress_callback(job_id),
+            encoder_profile,
+            job_id
+        )
     except Exception as e:
-        logger.error(f"Ошибка при обработке видео: {str(e)}")
-        conversion_status[job_id]['status'] = 'error'
-        conversion_status[job_id]['error'] = str(e)
+        logger.error(f"Ошибка потоковой конвертации: {str(e)}")
+        result = {'status': 'error', 'error': str(e)}
+    finally:
+        converted.set()
+        pipeline_slots.release()
+        metrics.JOBS_IN_FLIGHT.dec()
+
+    upload_complete = source.wait()
+    record = job_store.get(job_id) or {}
+
+    # Хеш содержимого появляется в записи только после полной загрузки
+    if not record.get('content_hash'):
+        if result['status'] == 'completed':
+            video_processor.cleanup_temp_file(
+                os.path.join(app.config['RENDER_FOLDER'], result['output_filename'])
+            )
+            if result.get('previews'):
+                remove_path(os.path.join(app.config['RENDER_FOLDER'], result['previews']['dir']))
+        video_processor.cleanup_temp_file(input_path)
+        return
+
+    # Отмененная задача не повторяется по загруженному файлу
+    if record.get('cancel_requested') and result['status'] != 'completed':
+        result = {'status': 'cancelled', 'error': 'Задача отменена'}
+    if result['status'] == 'cancelled' or (upload_complete and result['status'] == 'completed'):
+        conversion_runner.finish_job(job_id, input_path, result, record['content_hash'])
+        return
+
+    logger.warning(f"Потоковая конвертация задачи {job_id} не удалась, обрабатываем загруженный файл")
+    job_store.update(job_id, {'status': 'queued', 'progress': None})
+    try:
+        enqueue_job(
+            job_id, input_path, original_filename, record['content_hash'],
+            record['video_info'] if record.get('probe_verified') else None,
+            requested_profile
+        )
+    except QueueFullError:
+        job_store.update(job_id, {
+            'status': 'error',
+            'error': 'Сервер перегружен. Пожалуйста, повторите попытку позже'
+        })
+        video_processor.cleanup_temp_file(input_path)
+        return
+
+    # Отмена, пришедшая до постановки в очередь, не нашла задачу ни в очереди, ни в конвертации
+    if (job_store.get(job_id) or {}).get('cancel_requested') and job_queue.cancel(job_id) is not None:
+        conversion_runner.finish_job(job_id, input_path, {'status': 'cancelled', 'error': 'Задача отменена'}, None)
+
+def watch_cancel_request(job_id, converted):
+    """
+    Останавливает конвертацию во время загрузки, отмененную в другом процессе.
+
+    Такая задача не стоит в очереди, поэтому отмена передается флагом
+    cancel_requested в записи задачи, который проверяется раз в
+    PIPELINE_CANCEL_POLL_SECONDS до окончания конвертации.
+
+    Args:
+        job_id: Идентификатор задачи
+        converted: Событие окончания конвертации
+    """
+    while not converted.wait(app.config['PIPELINE_CANCEL_POLL_SECONDS']):
+        try:
+            record = job_store.get(job_id)
+        except Exception as e:
+            logger.warning(f"Не удалось проверить отмену задачи {job_id}: {e}")
+            continue
+        if record is not None and record.get('cancel_requested'):
+            video_processor.cancel_job(job_id)
+            return
+
+# Ограничение конвертаций во время загрузки
+pipeline_slots = threading.BoundedSemaphore(app.config['PIPELINE_MAX_STREAMS'])
+
+def queue_item(job_id, input_path, original_filename, content_hash, video_info=None, requested_profile=None,
+               output_format='mp4', keep_input=False):
+    """
+    Формирует элемент очереди конвертации: (job_id, данные задачи, оценка времени обработки).
+
+    Args:
+        keep_input: Исходник - файл сервера, а не загрузка; после обработки не удаляется
+    """
+    payload = {
+        'input_path': input_path,
+        'original_filename': original_filename,
+        'content_hash': content_hash,
+        'video_info': video_info,
+        'requested_profile': requested_profile,
+        'output_format': output_format
+    }
+    if keep_input:
+        payload['keep_input'] = True
+    return job_id, payload, conversion_runner.estimate_cost(video_info, output_format, requested_profile)
+
+def enqueue_job(job_id, input_path, original_filename, content_hash, video_info=None, requested_profile=None,
+                output_format='mp4'):
+    """
+    Ставит задачу в очередь конвертации.
+
+    Место в очереди зависит от оценки времени обработки: короткие задачи
+    выполняются раньше, длинные продвигаются по мере ожидания.
+
+    Raises:
+        QueueFullError: Если очередь заполнена
+    """
+    job_queue.enqueue(*queue_item(
+        job_id, input_path, original_filename, content_hash, video_info, requested_profile, output_format
+    ))
+
+def queue_full_response(retry_after):
+    """Формирует ответ 429 для переполненной очереди"""
+    response = jsonify({
+        'error': 'Сервер перегружен. Пожалуйста, повторите попытку позже',
+        'retry_after': retry_after
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+def register_job(job_id, input_path, filename, file_size, content_hash, probe_id=None, requested_profile=None,
+                 output_format=None, extra=None):
+    """
+    Регистрирует задачу для полностью загруженного файла.
+
+    Если такой файл уже конвертировался, задача сразу завершается
+    результатом из кеша. Иначе возвращается элемент очереди, который
+    вызывающий код ставит в очередь сам (одну задачу или весь пакет).
+
+    Args:
+        job_id: Идентификатор задачи
+        input_path: Путь к загруженному файлу
+        filename: Безопасное имя файла
+        file_size: Размер файла в байтах
+        content_hash: Хеш содержимого файла (None - без кеша)
+        probe_id: Идентификатор предварительной проверки файла (если была)
+        requested_profile: Профиль кодирования, запрошенный клиентом (None или 'auto' - по нагрузке)
+        output_format: Формат результата: 'mp4' (по умолчанию) или 'hls'
+        extra: Дополнительные поля записи о задаче
+
+    Returns:
+        Элемент очереди (см. queue_item) или None, если задача завершена из кеша
+
+    Raises:
+        ValueError: Если файл не удалось проанализировать (запись не создается)
+    """
+    record = {
+        'status': 'queued',
+        'input_filename': filename,
+        'upload_time': time.time(),
+        'file_size': file_size,
+        'content_hash': content_hash,
+        'output_format': output_format or 'mp4'
+    }
+    if requested_profile:
+        record['requested_profile'] = requested_profile
+    if extra:
+        record.update(extra)
+
+    # Результат предварительной проверки избавляет от повторного запуска ffprobe
+    video_info = None
+    if probe_id:
+        video_info = partial_probe.verified_video_info(probe_id, input_path)
+
+    # Файл, который не удалось проанализировать, не ставится в очередь: повтор обработки не поможет
+    if video_info is None:
+        try:
+            video_info = video_processor.get_video_info(input_path)
+        except ValueError as e:
+            logger.warning(f"Файл {filename} отклонен: {e}")
+            raise ValueError(f"Файл {filename} не удалось проанализировать: {e}")
+
+    record['video_info'] = video_info
+    record['video_summary'] = status_video_info(video_info)
+
+    # Инициализируем статус для этой задачи
+    job_store.create(job_id, record)
+
+    # Одинаковый файл уже конвертировался - отдаем готовый результат (кешируются только MP4)
+    if (record['output_format'] == 'mp4' and content_hash
+            and complete_from_cache(job_id, input_path, filename, content_hash, video_info, requested_profile)):
+        return None
+
+    return queue_item(
+        job_id, input_path, filename, content_hash, video_info, requested_profile, record['output_format'],
+        record.get('keep_input', False)
+    )
+
+def start_job(job_id, input_path, filename, file_size, content_hash, probe_id=None, requested_profile=None,
+              output_format=None):
+    """
+    Регистрирует задачу для полностью загруженного файла и ставит ее в очередь.
+
+    Аргументы те же, что у register_job.
+
+    Returns:
+        Ответ Flask для клиента
+    """
+    try:
+        item = register_job(job_id, input_path, filename, file_size, content_hash, probe_id, requested_profile,
+                            output_format)
+    except ValueError as e:
+        # Файл без видеопотока или нечитаемый - удаляем загрузку, как при отказе предварительной проверки
+        video_processor.cleanup_temp_file(input_path)
+        return jsonify({'error': str(e)}), 400
+    if item is None:
+        return jsonify({
+            'job_id': job_id,
+            'status': 'completed'
+        })
+
+    # Ставим задачу в очередь конвертации; обрабатывают ее потоки-обработчики или процессы worker.py
+    try:
+        job_queue.enqueue(*item)
+    except QueueFullError as e:
+        job_store.delete(job_id)
+        video_processor.cleanup_temp_file(input_path)
+        return queue_full_response(e.retry_after)
+
+    return jsonify({
+        'job_id': job_id,
+        'status': 'queued',
+        'queue_position': job_queue.position(job_id)
+    })
 
 @app.route('/')
 def index():
@@ -86,6 +548,9 @@ def index():
 @app.route('/upload', methods=['POST'])
 def upload_file():
     """Обрабатывает загрузку файла"""
+    if request.mimetype == 'application/octet-stream':
+        return upload_stream()
+
     if 'file' not in request.files:
         return jsonify({'error': 'Отсутствует файл в запросе'}), 400
 
@@ -97,6 +562,18 @@ def upload_file():
     if not allowed_file(file.filename):
         return jsonify({'error': 'Недопустимый тип файла'}), 400
 
+    requested_profile = request.form.get('profile')
+    if not valid_encoder_profile(requested_profile):
+        return jsonify({'error': 'Неизвестный профиль кодирования'}), 400
+
+    output_format = request.form.get('output')
+    if not valid_output_format(output_format):
+        return jsonify({'error': 'Неизвестный формат результата'}), 400
+
+    # Не принимаем файл, если очередь уже заполнена
+    if job_queue.is_full():
+        return queue_full_response(job_queue.retry_after())
+
     # Генерируем идентификатор задачи
     job_id = str(uuid.uuid4())
 
@@ -104,125 +581,809 @@ def upload_file():
         # Сохраняем загруженный файл
         filename = secure_filename(file.filename)
         input_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{job_id}_{filename}")
-        file.save(input_path)
-
-        # Инициализируем статус для этой задачи
-        conversion_status[job_id] = {
-            'status': 'uploaded',
-            'input_filename': filename,
-            'upload_time': time.time(),
-            'file_size': os.path.getsize(input_path)
-        }
+        file_size, content_hash = save_upload(file.stream, input_path)
 
-        # Запускаем обработку в отдельном потоке
-        thread = threading.Thread(
-            target=process_video_async,
-            args=(input_path, filename, job_id)
+        return start_job(
+            job_id, input_path, filename, file_size, content_hash, request.form.get('probe_id'), requested_profile,
+            output_format
         )
-        thread.daemon = True
-        thread.start()
 
-        return jsonify({
-            'job_id': job_id,
-            'status': 'uploaded'
-        })
+    except Exception as e:
+        logger.error(f"Ошибка загрузки: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+def upload_stream():
+    """
+    Принимает файл телом запроса (application/octet-stream).
+
+    Имя файла, необязательные probe_id, profile и output передаются в строке запроса. Если
+    предварительная проверка показала, что контейнер читается потоком,
+    конвертация начинается сразу и идет параллельно с загрузкой; иначе файл
+    сначала сохраняется целиком, как при обычной загрузке.
+    """
+    filename = request.args.get('filename', '')
+    probe_id = request.args.get('probe_id')
+    requested_profile = request.args.get('profile')
+    output_format = request.args.get('output')
+
+    if not filename:
+        return jsonify({'error': 'Файл не выбран'}), 400
+
+    if not allowed_file(filename):
+        return jsonify({'error': 'Недопустимый тип файла'}), 400
+
+    if not valid_encoder_profile(requested_profile):
+        return jsonify({'error': 'Неизвестный профиль кодирования'}), 400
+
+    if not valid_output_format(output_format):
+        return jsonify({'error': 'Неизвестный формат результата'}), 400
+
+    if not request.content_length:
+        return jsonify({'error': 'Требуется заголовок Content-Length'}), 411
+
+    # Не принимаем файл, если очередь уже заполнена
+    if job_queue.is_full():
+        return queue_full_response(job_queue.retry_after())
+
+    job_id = str(uuid.uuid4())
+    filename = secure_filename(filename)
+    input_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{job_id}_{filename}")
+
+    probe = partial_probe.get(probe_id) if probe_id else None
+    # Во время загрузки конвертируется только одиночный MP4
+    pipelined = (
+        app.config['PIPELINE_UPLOADS']
+        and output_format in (None, 'mp4')
+        and probe is not None
+        and probe['streamable']
+        and probe['video_info'] is not None
+        and probe['size'] == request.content_length
+        and pipeline_slots.acquire(blocking=False)
+    )
+
+    if not pipelined:
+        try:
+            file_size, content_hash = save_upload(request.stream, input_path)
+            return start_job(
+                job_id, input_path, filename, file_size, content_hash, probe_id, requested_profile, output_format
+            )
+        except Exception as e:
+            logger.error(f"Ошибка загрузки: {str(e)}")
+            video_processor.cleanup_temp_file(input_path)
+            return jsonify({'error': str(e)}), 500
 
+    now = time.time()
+    job_store.create(job_id, {
+        'status': 'processing',
+        'input_filename': filename,
+        'upload_time': now,
+        'start_time': now,
+        'file_size': request.content_length,
+        'video_info': probe['video_info'],
+        'video_summary': status_video_info(probe['video_info']),
+        'requested_profile': requested_profile,
+        'pipelined': True
+    })
+
+    # Файл должен существовать до того, как его начнет читать FFmpeg
+    open(input_path, 'wb').close()
+    source = GrowingFile(input_path, app.config['UPLOAD_BUFFER_SIZE'])
+    threading.Thread(
+        target=pipeline_video_async,
+        args=(job_id, source, input_path, filename, probe['video_info'], requested_profile),
+        daemon=True
+    ).start()
+
+    try:
+        file_size, content_hash = save_upload(request.stream, input_path, on_write=source.append)
+        if file_size != request.content_length:
+            raise IOError(f"Получено {file_size} байт из {request.content_length}")
+    except Exception as e:
+        logger.error(f"Загрузка задачи {job_id} прервана: {str(e)}")
+        job_store.update(job_id, {'status': 'error', 'error': 'Загрузка прервана'})
+        source.fail()
+        return jsonify({'error': 'Загрузка прервана. Пожалуйста, попробуйте снова.'}), 400
+
+    # Сверяем файл с предварительной проверкой, по которой запущена конвертация
+    probe_verified = partial_probe.verified_video_info(probe_id, input_path) is not None
+    job_store.update(job_id, {'content_hash': content_hash, 'probe_verified': probe_verified})
+    if probe_verified:
+        source.finish()
+    else:
+        source.fail()
+
+    return jsonify({
+        'job_id': job_id,
+        'status': 'processing',
+        'pipelined': True
+    })
+
+@app.route('/probe', methods=['POST'])
+def probe_file():
+    """
+    Проверяет файл по его началу и концу до полной загрузки.
+
+    Форма содержит поля filename и size (полный размер файла), файл head
+    (первые мегабайты) и, для больших файлов, tail (последние мегабайты).
+    Ответ содержит probe_id и решение: 'accept', 'reject' (файл
+    конвертировать нельзя) или 'unknown' (данных недостаточно).
+    """
+    filename = request.form.get('filename', '')
+    if not filename:
+        return jsonify({'error': 'Файл не выбран'}), 400
+
+    if not allowed_file(filename):
+        return jsonify({'error': 'Недопустимый тип файла'}), 400
+
+    if 'head' not in request.files:
+        return jsonify({'error': 'Отсутствует начало файла в запросе'}), 400
+
+    try:
+        size = int(request.form.get('size', 0))
+    except ValueError:
+        return jsonify({'error': 'Некорректный размер файла'}), 400
+
+    if size > app.config['MAX_UPLOAD_SIZE']:
+        return jsonify({'error': 'Файл слишком большой'}), 413
+
+    head = request.files['head'].read()
+    tail = request.files['tail'].read() if 'tail' in request.files else b''
+
+    try:
+        result = partial_probe.probe(secure_filename(filename), size, head, tail)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Подсказка клиенту: такой файл можно отправить одним запросом и конвертировать во время загрузки
+    result['pipelined'] = bool(
+        app.config['PIPELINE_UPLOADS']
+        and result.get('streamable')
+        and size <= app.config['MAX_CONTENT_LENGTH']
+    )
+
+    return jsonify(result)
+
+@app.errorhandler(UploadError)
+def handle_upload_error(e):
+    """Возвращает ошибку протокола загрузки частями"""
+    return jsonify({'error': str(e)}), e.status_code
+
+@app.route('/uploads', methods=['POST'])
+def init_chunked_upload():
+    """
+    Начинает загрузку частями.
+
+    Тело запроса: JSON {"filename": ..., "size": ...}.
+    Ответ содержит upload_id и размер части.
+    """
+    data = request.get_json(silent=True) or {}
+    filename = data.get('filename', '')
+    try:
+        size = int(data.get('size', 0))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Некорректный размер файла'}), 400
+
+    if not filename:
+        return jsonify({'error': 'Файл не выбран'}), 400
+
+    if not allowed_file(filename):
+        return jsonify({'error': 'Недопустимый тип файла'}), 400
+
+    # Не начинаем загрузку, если очередь уже заполнена
+    if job_queue.is_full():
+        return queue_full_response(job_queue.retry_after())
+
+    upload = upload_manager.init(secure_filename(filename), size)
+    return jsonify(upload), 201
+
+@app.route('/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    """
+    Принимает часть файла.
+
+    Тело запроса - байты части, диапазон задается заголовком
+    Content-Range: bytes <начало>-<конец>/<размер>.
+    """
+    start, end, total = ChunkedUploadManager.parse_content_range(request.headers.get('Content-Range'))
+    with metrics.timed('upload_chunk'):
+        status = upload_manager.write_chunk(upload_id, start, end, total, request.stream)
+    metrics.INPUT_BYTES.inc(end - start + 1)
+    return jsonify(status)
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+def chunked_upload_status(upload_id):
+    """Возвращает полученные и недостающие части для возобновления загрузки"""
+    return jsonify(upload_manager.status(upload_id))
+
+@app.route('/uploads/<upload_id>', methods=['DELETE'])
+def abort_chunked_upload(upload_id):
+    """Отменяет загрузку частями"""
+    upload_manager.abort(upload_id)
+    return '', 204
+
+@app.route('/uploads/<upload_id>/complete', methods=['POST'])
+def complete_chunked_upload(upload_id):
+    """
+    Завершает загрузку частями и ставит файл в очередь конвертации.
+
+    Тело запроса (необязательно): JSON {"probe_id": ..., "profile": ..., "output": ...}
+    с идентификатором предварительной проверки файла, профилем кодирования
+    и форматом результата.
+    """
+    data = request.get_json(silent=True) or {}
+    probe_id = data.get('probe_id')
+    requested_profile = data.get('profile')
+    output_format = data.get('output')
+    if not valid_encoder_profile(requested_profile):
+        return jsonify({'error': 'Неизвестный профиль кодирования'}), 400
+
+    if not valid_output_format(output_format):
+        return jsonify({'error': 'Неизвестный формат результата'}), 400
+
+    upload = upload_manager.finalize(upload_id)
+
+    try:
+        # Идентификатор загрузки становится идентификатором задачи
+        return start_job(
+            upload_id, upload['path'], upload['filename'], upload['size'], upload['content_hash'], probe_id,
+            requested_profile, output_format
+        )
     except Exception as e:
         logger.error(f"Ошибка загрузки: {str(e)}")
+        video_processor.cleanup_temp_file(upload['path'])
+        return jsonify({'error': str(e)}), 500
+
+def resolve_batch_path(path):
+    """
+    Проверяет путь файла сервера из пакета.
+
+    Returns:
+        Абсолютный путь внутри BATCH_SOURCE_ROOT или None, если путь
+        выходит за ее пределы, не является файлом или не является видео
+    """
+    root = os.path.abspath(app.config['BATCH_SOURCE_ROOT'])
+    if not isinstance(path, str) or not path:
+        return None
+    full_path = os.path.abspath(os.path.join(root, path))
+    if os.path.commonpath([root, full_path]) != root:
+        return None
+    if not os.path.isfile(full_path) or not allowed_file(full_path):
+        return None
+    return full_path
+
+@app.route('/batch', methods=['POST'])
+def create_batch():
+    """
+    Ставит в очередь пакет файлов одной транзакцией.
+
+    Файлы передаются загрузкой (multipart/form-data, поле files, поля
+    profile и output) или путями на сервере: JSON {"paths": [...],
+    "profile": ..., "output": ...} с путями относительно BATCH_SOURCE_ROOT.
+    Файлы сервера конвертируются на месте без копирования в uploads/ и не
+    удаляются после обработки. Пакет ставится в очередь целиком или не
+    ставится вовсе (ответ 429).
+    """
+    data = request.get_json(silent=True) if request.is_json else None
+    if data is not None:
+        if app.config['BATCH_SOURCE_ROOT'] is None:
+            return jsonify({'error': 'Пакеты по путям на сервере отключены'}), 403
+        paths = data.get('paths')
+        if not isinstance(paths, list) or not paths:
+            return jsonify({'error': 'Требуется непустой список paths'}), 400
+        sources = paths
+        requested_profile = data.get('profile')
+        output_format = data.get('output')
+        queue_size = app.config['BATCH_QUEUE_SIZE']
+    else:
+        files = request.files.getlist('files')
+        if not files or any(file.filename == '' for file in files):
+            return jsonify({'error': 'Файлы не выбраны'}), 400
+        sources = [file.filename for file in files]
+        requested_profile = request.form.get('profile')
+        output_format = request.form.get('output')
+        queue_size = job_queue.max_size
+
+    if len(sources) > app.config['BATCH_MAX_FILES']:
+        return jsonify({'error': f"В пакете больше {app.config['BATCH_MAX_FILES']} файлов"}), 413
+
+    if not valid_encoder_profile(requested_profile):
+        return jsonify({'error': 'Неизвестный профиль кодирования'}), 400
+
+    if not valid_output_format(output_format):
+        return jsonify({'error': 'Неизвестный формат результата'}), 400
+
+    if data is not None:
+        resolved = [resolve_batch_path(path) for path in paths]
+        invalid = [path for path, full_path in zip(paths, resolved) if full_path is None]
+        if invalid:
+            return jsonify({'error': 'Недопустимые пути', 'paths': invalid}), 400
+    elif not all(allowed_file(source) for source in sources):
+        return jsonify({'error': 'Недопустимый тип файла'}), 400
+
+    # Не принимаем пакет, если он не поместится в очередь целиком
+    if job_queue.stats()['queued_jobs'] + len(sources) > queue_size:
+        return queue_full_response(job_queue.retry_after())
+
+    batch_id = str(uuid.uuid4())
+    jobs = []
+    items = []
+    try:
+        for index, source in enumerate(sources):
+            job_id = str(uuid.uuid4())
+            job = {'job_id': job_id, 'source': source, 'filename': secure_filename(os.path.basename(source))}
+            jobs.append(job)
+            if data is not None:
+                # Файл сервера: без хеширования и кеша, исходник не удаляется
+                job.update({
+                    'input_path': resolved[index],
+                    'file_size': os.path.getsize(resolved[index]),
+                    'content_hash': None,
+                    'extra': {'batch_id': batch_id, 'source_path': source, 'keep_input': True}
+                })
+            else:
+                job['input_path'] = os.path.join(app.config['UPLOAD_FOLDER'], f"{job_id}_{job['filename']}")
+                job['file_size'], job['content_hash'] = save_upload(files[index].stream, job['input_path'])
+                job['extra'] = {'batch_id': batch_id}
+
+        # Все файлы анализируются параллельно; register_job берет результаты из кеша анализа
+        video_processor.probe_many(job['input_path'] for job in jobs)
+
+        for job in jobs:
+            item = register_job(
+                job['job_id'], job['input_path'], job['filename'], job['file_size'], job['content_hash'], None,
+                requested_profile, output_format, job['extra']
+            )
+            if item is not None:
+                items.append(item)
+
+        job_queue.enqueue_many(items, queue_size)
+    except Exception as e:
+        # Пакет не ставится частично: удаляем уже созданные задачи и загруженные файлы
+        for job in jobs:
+            job_store.delete(job['job_id'])
+            if data is None and 'input_path' in job:
+                video_processor.cleanup_temp_file(job['input_path'])
+        if isinstance(e, QueueFullError):
+            return queue_full_response(e.retry_after)
+        if isinstance(e, ValueError):
+            # Один из файлов не удалось проанализировать
+            return jsonify({'error': str(e)}), 400
+        logger.error(f"Ошибка создания пакета: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+    job_store.create_batch(batch_id, {
+        'created': time.time(),
+        'job_ids': [job['job_id'] for job in jobs],
+        'sources': [job['source'] for job in jobs]
+    })
+    logger.info(f"Пакет {batch_id}: {len(jobs)} файлов, в очереди {len(items)}")
+
+    return jsonify({
+        'batch_id': batch_id,
+        'status_url': url_for('batch_status', batch_id=batch_id),
+        'jobs': [{'job_id': job['job_id'], 'source': job['source']} for job in jobs]
+    })
+
+@app.route('/batch/<batch_id>', methods=['GET'])
+def batch_status(batch_id):
+    """
+    Возвращает сводку пакета: число задач по статусам, общий прогресс и
+    время ожидания и обработки каждого файла.
+
+    Записи задач читаются одним запросом, без отдельного /status на файл.
+    """
+    batch = job_store.get_batch(batch_id)
+    if batch is None:
+        return jsonify({'error': 'Пакет не найден'}), 404
+
+    records = job_store.get_many(batch['job_ids'])
+    counts = {}
+    percent_total = 0.0
+    files = []
+    for job_id, source in zip(batch['job_ids'], batch['sources']):
+        record = records.get(job_id)
+        status = record['status'] if record else 'expired'
+        counts[status] = counts.get(status, 0) + 1
+        entry = {'job_id': job_id, 'source': source, 'status': status}
+        if record is None:
+            files.append(entry)
+            continue
+
+        if status in FINISHED_STATUSES:
+            percent = 100.0
+        else:
+            percent = (record.get('progress') or {}).get('percent', 0.0)
+        percent_total += percent
+        entry['percent'] = percent
+
+        # Ожидание в очереди и обработка отдельно: сумма - полное время файла
+        if record.get('start_time'):
+            entry['wait_time'] = round(record['start_time'] - record['upload_time'], 3)
+        if record.get('processing_time') is not None:
+            entry['processing_time'] = round(record['processing_time'], 3)
+        if record.get('cache_hit'):
+            entry['cache_hit'] = True
+        if record.get('error'):
+            entry['error'] = record['error']
+        if status == 'completed' and not record.get('output_expired'):
+            if record.get('output_format') == 'hls':
+                entry['playlist_url'] = url_for(
+                    'stream_file', filename=f"{record['output_dir']}/{record['playlist']}"
+                )
+            else:
+                entry['download_url'] = url_for('download_file', filename=record['output_filename'])
+        files.append(entry)
+
+    total = len(batch['job_ids'])
+    finished = all(file['status'] in FINISHED_STATUSES + ('expired',) for file in files)
+    return jsonify({
+        'batch_id': batch_id,
+        'created': batch['created'],
+        'total': total,
+        'counts': counts,
+        'percent': round(percent_total / total, 1) if total else 100.0,
+        'finished': finished,
+        'files': files
+    })
+
+def build_status(job_id):
+    """
+    Формирует ответ о статусе задачи для клиента.
+
+    Returns:
+        Словарь со статусом или None, если задача не найдена
+    """
+    status_data = job_store.get(job_id)
+    if status_data is None:
+        return None
+
+    if status_data['status'] == 'queued':
+        status_data['queue_position'] = job_queue.position(job_id)
+
+    # Прогноз начала и завершения по оценкам времени обработки задач в очереди
+    if status_data['status'] in ('queued', 'processing'):
+        forecast = job_queue.forecast(job_id)
+        if forecast is not None:
+            status_data.update(forecast)
+
+    # Полная информация о видео в ответ не попадает: краткая сохраняется в записи
+    # при анализе и завершении задачи, для старых записей собирается здесь
+    video_info = status_data.pop('video_info', None)
+    video_summary = status_data.pop('video_summary', None)
+    if video_summary is None and video_info:
+        video_summary = status_video_info(video_info)
+    if video_summary is not None:
+        status_data['video_info'] = video_summary
+
+    if status_data['status'] == 'completed':
+        if status_data.get('output_expired'):
+            # Результат удален по сроку хранения или квоте - ссылок нет
+            pass
+        elif status_data.get('output_format') == 'hls':
+            # Главный плейлист адаптивного вывода
+            status_data['playlist_url'] = url_for(
+                'stream_file',
+                filename=f"{status_data['output_dir']}/{status_data['playlist']}"
+            )
+        else:
+            # Добавляем URL для скачивания в ответ
+            status_data['download_url'] = url_for(
+                'download_file',
+                filename=status_data['output_filename']
+            )
+
+            # Постер, листы миниатюр с индексом WebVTT и облегченная копия
+            previews = status_data.get('previews')
+            if previews:
+                def preview_url(name):
+                    return url_for('preview_file', filename=f"{previews['dir']}/{name}")
+
+                status_data['preview_urls'] = {
+                    'sprites': [preview_url(name) for name in previews['sprites']],
+                    'thumbnails': preview_url(previews['thumbnails']),
+                    'proxy': preview_url(previews['proxy'])
+                }
+                if previews.get('poster'):
+                    status_data['preview_urls']['poster'] = preview_url(previews['poster'])
+
+        # Время обработки сохраняется при завершении; для старых записей и
+        # результатов из кеша считаем его от момента загрузки
+        if 'processing_time' not in status_data and 'upload_time' in status_data:
+            status_data['processing_time'] = time.time() - status_data['upload_time']
+
+    return status_data
+
 @app.route('/status/<job_id>', methods=['GET'])
 def check_status(job_id):
     """Проверяет статус обработки видео"""
-    if job_id not in conversion_status:
+    status_data = build_status(job_id)
+    if status_data is None:
         return jsonify({'error': 'Задача не найдена'}), 404
 
-    status_data = conversion_status[job_id].copy()
-
-    # Удаляем информацию о видео из ответа (она слишком большая)
-    if 'video_info' in status_data:
-        # Оставляем только базовую информацию
-        video_info = status_data['video_info']
-        status_data['video_info'] = {
-            'duration': video_info.get('duration', 0),
-            'is_vertical': video_info.get('is_vertical', False),
-            'width': video_info.get('width', 0),
-            'height': video_info.get('height', 0),
-            'has_audio': video_info.get('has_audio', False)
+    return jsonify(status_data)
+
+@app.route('/status/<job_id>/stream', methods=['GET'])
+def stream_status(job_id):
+    """
+    Передает обновления статуса задачи через Server-Sent Events.
+
+    Событие отправляется только при изменении статуса или прогресса,
+    поток закрывается после завершения задачи.
+    """
+    if job_store.get(job_id) is None:
+        return jsonify({'error': 'Задача не найдена'}), 404
+
+    def generate():
+        last_payload = None
+        last_sent = time.monotonic()
+        # Клиенту, потерявшему соединение, браузер переподключится через 3 секунды
+        yield 'retry: 3000\n\n'
+
+        while True:
+            status_data = build_status(job_id)
+            if status_data is None:
+                yield 'event: error\ndata: {"error": "Задача не найдена"}\n\n'
+                return
+
+            payload = json.dumps(status_data, ensure_ascii=False)
+            now = time.monotonic()
+            if payload != last_payload:
+                yield f"data: {payload}\n\n"
+                last_payload = payload
+                last_sent = now
+            elif now - last_sent >= app.config['STATUS_STREAM_KEEPALIVE']:
+                # Комментарий не дает прокси закрыть простаивающее соединение
+                yield ': keep-alive\n\n'
+                last_sent = now
+
+            if status_data['status'] in FINISHED_STATUSES:
+                return
+
+            time.sleep(app.config['STATUS_STREAM_INTERVAL'])
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # Отключаем буферизацию в nginx
         }
+    )
 
-    if status_data['status'] == 'completed':
-        # Добавляем URL для скачивания в ответ
-        status_data['download_url'] = url_for(
-            'download_file',
-            filename=status_data['output_filename']
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """
+    Отменяет задачу.
+
+    Задача из очереди снимается сразу (ответ 200). Выполняющейся задаче
+    отмена передается через очередь: обработчик, в каком бы процессе он ни
+    работал, узнает о ней при продлении аренды и завершает процессы FFmpeg,
+    а статус 'cancelled' появляется после их остановки (ответ 202).
+    Конвертация во время загрузки идет вне очереди - ей отмена передается
+    флагом cancel_requested в записи задачи (watch_cancel_request).
+    Загруженный файл и недописанный результат удаляются.
+    """
+    record = job_store.get(job_id)
+    if record is None:
+        return jsonify({'error': 'Задача не найдена'}), 404
+
+    if record['status'] in FINISHED_STATUSES:
+        return jsonify({'error': 'Задача уже завершена', 'status': record['status']}), 409
+
+    payload = job_queue.cancel(job_id)
+    if payload is not None:
+        job_store.update(job_id, {'status': 'cancelled', 'error': 'Задача отменена'})
+        if not payload.get('keep_input'):
+            video_processor.cleanup_temp_file(payload['input_path'])
+        metrics.JOBS_FINISHED.inc(status='cancelled')
+        return jsonify({'job_id': job_id, 'status': 'cancelled'})
+
+    # Конвертация во время загрузки идет вне очереди и, возможно, в другом процессе:
+    # флаг в общей записи задачи проверяет процесс, который ее выполняет
+    if not job_queue.request_cancel(job_id):
+        job_store.update(job_id, {'cancel_requested': True})
+        video_processor.cancel_job(job_id)
+    return jsonify({'job_id': job_id, 'status': 'cancelling'}), 202
+
+def output_etag(stat):
+    """
+    Формирует сильный ETag результата.
+
+    Файлы в RENDER_FOLDER не изменяются после записи, поэтому inode, размер
+    и время изменения однозначно определяют содержимое без чтения файла.
+    """
+    return f"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"
+
+def deliver_file(filename, as_attachment=False, mimetype=None):
+    """
+    Отдает файл из RENDER_FOLDER.
+
+    Без прокси (SENDFILE_MODE = None) файл отдает Flask с поддержкой Range
+    и условных запросов (If-None-Match, If-Modified-Since, If-Range). С прокси
+    Flask проверяет только условные запросы и возвращает заголовок
+    X-Accel-Redirect или X-Sendfile без тела: файл и диапазоны отдает nginx
+    или Apache, а рабочий процесс Python сразу освобождается.
+
+    Args:
+        filename: Путь к файлу относительно RENDER_FOLDER
+        as_attachment: Отдавать как вложение (Content-Disposition: attachment)
+        mimetype: Тип содержимого (по умолчанию определяется по расширению)
+
+    Returns:
+        Ответ Flask
+    """
+    root = os.path.abspath(app.config['RENDER_FOLDER'])
+    path = os.path.normpath(os.path.join(root, filename))
+    if not path.startswith(root + os.sep) or not os.path.isfile(path):
+        return jsonify({'error': 'Файл не найден'}), 404
+
+    stat = os.stat(path)
+    etag = output_etag(stat)
+    mimetype = mimetype or mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    mode = app.config['SENDFILE_MODE']
+
+    if not mode:
+        return send_file(
+            path, mimetype=mimetype, as_attachment=as_attachment, conditional=True,
+            etag=etag, last_modified=stat.st_mtime
         )
 
-        # Добавляем информацию о времени обработки
-        if 'upload_time' in status_data:
-            status_data['processing_time'] = time.time() - status_data['upload_time']
+    response = Response(mimetype=mimetype)
+    response.set_etag(etag)
+    response.last_modified = stat.st_mtime
+    response.headers['Accept-Ranges'] = 'bytes'
+    if as_attachment:
+        response.headers.set('Content-Disposition', 'attachment', filename=os.path.basename(path))
 
-    return jsonify(status_data)
+    response = response.make_conditional(request)
+    if response.status_code == 304:
+        return response
+
+    if mode == 'x-accel-redirect':
+        relative = os.path.relpath(path, root).replace(os.sep, '/')
+        response.headers['X-Accel-Redirect'] = app.config['X_ACCEL_PREFIX'] + quote(relative)
+    else:
+        response.headers['X-Sendfile'] = path
+    return response
 
 @app.route('/download/<filename>', methods=['GET'])
 def download_file(filename):
     """Отправляет обработанный файл для скачивания"""
-    return send_from_directory(app.config['RENDER_FOLDER'], filename, as_attachment=True)
+    return deliver_file(filename, as_attachment=True)
+
+# Типы файлов адаптивного вывода, которых нет в стандартной таблице mimetypes
+HLS_MIMETYPES = {
+    '.m3u8': 'application/vnd.apple.mpegurl',
+    '.m4s': 'video/iso.segment',
+    '.mp4': 'video/mp4'
+}
+
+@app.route('/hls/<path:filename>', methods=['GET'])
+def stream_file(filename):
+    """Отдает плейлисты и сегменты адаптивного вывода (HLS) для воспроизведения"""
+    mimetype = HLS_MIMETYPES.get(os.path.splitext(filename)[1].lower())
+    if mimetype is None:
+        return jsonify({'error': 'Файл не найден'}), 404
+    return deliver_file(filename, mimetype=mimetype)
+
+# Типы файлов превью
+PREVIEW_MIMETYPES = {
+    '.jpg': 'image/jpeg',
+    '.vtt': 'text/vtt',
+    '.mp4': 'video/mp4'
+}
+
+@app.route('/preview/<path:filename>', methods=['GET'])
+def preview_file(filename):
+    """Отдает постер, листы миниатюр, индекс WebVTT и облегченную копию"""
+    mimetype = PREVIEW_MIMETYPES.get(os.path.splitext(filename)[1].lower())
+    if mimetype is None:
+        return jsonify({'error': 'Файл не найден'}), 404
+    return deliver_file(filename, mimetype=mimetype)
 
 @app.route('/api/video/recent', methods=['GET'])
 def get_recent_conversions():
     """Возвращает список последних конвертаций"""
-    # Получаем последние 10 конвертаций
-    recent = []
-    for job_id, status in conversion_status.items():
-        if status['status'] == 'completed':
-            recent.append({
-                'job_id': job_id,
-                'filename': status['input_filename'],
-                'output_filename': status['output_filename'],
-                'timestamp': status.get('upload_time', 0)
-            })
-
-    # Сортируем по времени (последние сверху)
-    recent.sort(key=lambda x: x['timestamp'], reverse=True)
-
-    # Возвращаем только 10 последних
-    return jsonify(recent[:10])
+    # Получаем последние 10 конвертаций (индексированный запрос к хранилищу)
+    recent = [
+        {
+            'job_id': status['job_id'],
+            'filename': status['input_filename'],
+            'output_filename': status.get('output_filename') or status.get('output_dir'),
+            'timestamp': status.get('upload_time', 0)
+        }
+        for status in job_store.recent_completed(limit=10)
+    ]
+
+    return jsonify(recent)
 
 @app.route('/stats', methods=['GET'])
 def get_stats():
     """Возвращает статистику конвертаций"""
+    # Счетчики поддерживаются хранилищем инкрементально
+    store_stats = job_store.stats()
     stats = {
-        'total_jobs': len(conversion_status),
-        'completed_jobs': sum(1 for status in conversion_status.values() if status['status'] == 'completed'),
-        'error_jobs': sum(1 for status in conversion_status.values() if status['status'] == 'error'),
-        'pending_jobs': sum(1 for status in conversion_status.values() if status['status'] in ['uploaded', 'processing']),
-        'total_size_mb': sum(status.get('file_size', 0) for status in conversion_status.values()) / (1024 * 1024)
+        'total_jobs': store_stats['total_jobs'],
+        'completed_jobs': store_stats['completed_jobs'],
+        'error_jobs': store_stats['error_jobs'],
+        'cancelled_jobs': store_stats['cancelled_jobs'],
+        'pending_jobs': store_stats['pending_jobs'],
+        'total_size_mb': store_stats['total_size'] / (1024 * 1024),
+        'avg_processing_time': store_stats['avg_processing_time']
     }
 
-    # Рассчитываем среднее время обработки
-    processing_times = [
-        status.get('processing_time', 0)
-        for status in conversion_status.values()
-        if status['status'] == 'completed' and 'processing_time' in status
-    ]
+    stats['queue'] = job_queue.stats()
+    stats['cost_model'] = conversion_runner.cost_model.stats()
 
-    if processing_times:
-        stats['avg_processing_time'] = sum(processing_times) / len(processing_times)
-    else:
-        stats['avg_processing_time'] = 0
+    # Пропускная способность по профилям кодирования (по задачам всех обработчиков)
+    stats['encoder_profiles'] = {
+        'mode': profile_selector.mode,
+        'profiles': job_store.profile_stats()
+    }
+
+    if conversion_cache is not None:
+        stats['cache'] = conversion_cache.stats()
+
+    stats['storage'] = output_storage.stats()
+    stats['probe_cache'] = video_processor.probe.stats()
+
+    # Разделение процессоров между задачами этого процесса
+    if cpu_partitioner is not None:
+        stats['cpu_partitions'] = cpu_partitioner.stats()
 
     return jsonify(stats)
 
-# Очистка старых записей (в реальном приложении стоит использовать Celery или другой планировщик)
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Отдает метрики обработки в текстовом формате Prometheus"""
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 def cleanup_old_records():
     """Удаляет старые записи о конвертациях"""
-    current_time = time.time()
-    for job_id in list(conversion_status.keys()):
-        status = conversion_status[job_id]
-        # Удаляем записи старше 24 часов
-        if 'upload_time' in status and current_time - status['upload_time'] > 24 * 60 * 60:
-            del conversion_status[job_id]
+    # Удаляем записи старше срока хранения одним запросом по индексу upload_time
+    cutoff = time.time() - app.config['JOB_RETENTION_SECONDS']
+    removed = job_store.delete_older_than(cutoff)
+    if removed:
+        logger.info(f"Удалено устаревших записей о задачах: {removed}")
+
+    partial_probe.delete_older_than(time.time() - app.config['PROBE_RETENTION_SECONDS'])
+
+    # Файлы задач из dead-letter удаляются при переводе, здесь - оставшиеся после сбоев
+    for payload in job_queue.delete_dead_older_than(cutoff):
+        if not payload.get('keep_input'):
+            video_processor.cleanup_temp_file(payload['input_path'])
+
+    upload_manager.delete_stale(time.time() - app.config['CHUNKED_UPLOAD_STALE_SECONDS'])
+    return removed
+
+def evict_outputs():
+    """Удаляет результаты по сроку хранения и квоте и отмечает это в записях задач"""
+    evicted = output_storage.evict(app.config['OUTPUT_RETENTION_SECONDS'], app.config['OUTPUT_QUOTA_BYTES'])
+    for _, job_id in evicted:
+        if job_id:
+            job_store.update(job_id, {'output_expired': True})
+    return len(evicted)
+
+def reclaim_orphans():
+    """
+    Находит файлы, оставшиеся после аварийного завершения процессов.
+
+    Результаты без записи в индексе ставятся на учет (и удаляются по сроку
+    хранения), загрузки, на которые не ссылаются задачи и загрузки частями,
+    удаляются.
+    """
+    output_storage.adopt_unindexed(app.config['OUTPUT_ADOPT_MIN_AGE'])
+    referenced = [payload['input_path'] for payload in job_queue.pending_payloads()]
+    referenced.extend(upload_manager.paths())
+    return reclaim_upload_orphans(app.config['UPLOAD_FOLDER'], referenced, app.config['UPLOAD_ORPHAN_SECONDS'])
+
+# Фоновое обслуживание: срок хранения записей и файлов, квота RENDER_FOLDER, потерянные загрузки
+janitor = Janitor(
+    app.config['JANITOR_INTERVAL'],
+    tasks=[cleanup_old_records, evict_outputs],
+    startup_tasks=[reclaim_orphans]
+)
+janitor.start()
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+Пакетная конвертация дерева директорий без веб-сервера.
+
+Все видео исходной директории конвертируются в MP4 пулом процессов;
+каждый процесс пула использует VideoProcessor и свой набор процессоров.
+Состояние хранится в базе в директории результатов, поэтому прерванный
+запуск продолжается с незавершенных файлов.
+
+Примеры:
+    python batch_convert.py /srv/incoming /srv/converted
+    python batch_convert.py incoming converted --workers 4 --summary summary.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+
+from cpu_partition import CPUPartitioner, available_cpus, default_worker_count
+from database import SQLiteDatabase
+from encoder_profiles import DEFAULT_PROFILE, PROFILES, ffmpeg_capabilities
+from media_probe import MediaProbe
+from video_utils import VIDEO_EXTENSIONS, VideoProcessor
+
+logger = logging.getLogger(__name__)
+
+
+class BatchState:
+    """
+    Состояние пакетной конвертации директории (python batch_convert.py).
+
+    Для каждого исходного файла хранятся его размер и время изменения на
+    момент успешной конвертации и размер результата. Пока они совпадают,
+    файл пропускается: повторный запуск после прерывания продолжает с
+    незавершенных файлов, а измененные исходники конвертируются заново.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS batch_files (
+            source TEXT PRIMARY KEY,
+            source_size INTEGER NOT NULL,
+            source_mtime_ns INTEGER NOT NULL,
+            output TEXT NOT NULL,
+            output_size INTEGER NOT NULL,
+            seconds REAL NOT NULL,
+            updated REAL NOT NULL
+        );
+    """
+
+    def __init__(self, path: str):
+        """
+        Инициализирует состояние.
+
+        Args:
+            path: Путь к базе данных SQLite (в директории результатов)
+        """
+        self.db = SQLiteDatabase(path)
+        self.db.executescript(self.SCHEMA)
+
+    def is_current(self, source: str, source_stat: os.stat_result, output_path: str) -> bool:
+        """Проверяет, что результат для исходника уже получен и не устарел"""
+        row = self.db.connection().execute(
+            'SELECT source_size, source_mtime_ns, output_size FROM batch_files WHERE source = ?', (source,)
+        ).fetchone()
+        if row is None:
+            return False
+        try:
+            output_size = os.path.getsize(output_path)
+        except OSError:
+            return False
+        return (
+            row['source_size'] == source_stat.st_size
+            and row['source_mtime_ns'] == source_stat.st_mtime_ns
+            and row['output_size'] == output_size
+        )
+
+    def record(self, source: str, source_stat: os.stat_result, output: str, output_size: int, seconds: float):
+        """Запоминает успешную конвертацию исходника"""
+        with self.db.transaction() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO batch_files '
+                '(source, source_size, source_mtime_ns, output, output_size, seconds, updated) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (source, source_stat.st_size, source_stat.st_mtime_ns, output, output_size, seconds, time.time())
+            )
+
+
+def find_batch_sources(source_dir: str, output_dir: str) -> List[Tuple[str, str]]:
+    """
+    Находит видео в дереве директорий и назначает им пути результатов.
+
+    Результат повторяет структуру поддиректорий: a/b/clip.mov -> a/b/clip.mp4.
+    Если имена совпадают без расширения (clip.mp4 и clip.mkv), имя clip.mp4
+    получает MP4, а остальные - имя с расширением (clip_mkv.mp4). Директория
+    результатов внутри исходной не обходится.
+
+    Returns:
+        Отсортированный список (путь_исходника, путь_результата) относительно
+        source_dir и output_dir
+    """
+    output_root = os.path.abspath(output_dir)
+    sources = []
+    for directory, dirnames, filenames in os.walk(source_dir):
+        dirnames[:] = sorted(
+            name for name in dirnames if os.path.abspath(os.path.join(directory, name)) != output_root
+        )
+        for name in sorted(filenames):
+            if os.path.splitext(name)[1].lower().lstrip('.') in VIDEO_EXTENSIONS:
+                sources.append(os.path.relpath(os.path.join(directory, name), source_dir))
+
+    # Исходник в MP4 первым занимает имя без расширения
+    sources.sort(key=lambda source: (os.path.splitext(source)[0], os.path.splitext(source)[1].lower() != '.mp4'))
+    taken = set()
+    tasks = []
+    for source in sources:
+        stem, extension = os.path.splitext(source)
+        output = f"{stem}.mp4"
+        if output in taken:
+            output = f"{stem}_{extension.lstrip('.').lower()}.mp4"
+        taken.add(output)
+        tasks.append((source, output))
+    return sorted(tasks)
+
+
+# Процессор видео в процессе пула пакетной конвертации
+_batch_processor = None
+
+
+def _init_batch_worker(options: Dict[str, Any], cpu_sets: Optional[Any], nice: int):
+    """Создает процессор видео в процессе пула; процесс берет свой набор процессоров из очереди"""
+    global _batch_processor
+    cpu_partitioner = None
+    if cpu_sets is not None:
+        cpu_partitioner = CPUPartitioner(cpu_sets.get(), 1, reserved=0, nice=nice)
+    _batch_processor = VideoProcessor(cpu_partitioner=cpu_partitioner, **options)
+
+
+def _convert_batch_file(source_path: str, source: str, output: str, video_info: Dict[str, Any],
+                        encoder_profile: str) -> Tuple[Dict[str, Any], float]:
+    """Конвертирует один файл пакета в процессе пула; возвращает результат и время обработки"""
+    started = time.monotonic()
+    # Путь исходника служит идентификатором задачи для надзора и набора процессоров
+    result = _batch_processor.process_video(
+        source_path, source, video_info=video_info, encoder_profile=encoder_profile, job_id=source,
+        output_filename=output
+    )
+    return result, time.monotonic() - started
+
+
+def convert_directory(source_dir: str, output_dir: str, workers: int, processor_options: Dict[str, Any],
+                      encoder_profile: str = DEFAULT_PROFILE, force: bool = False,
+                      cpus: Optional[List[int]] = None, nice: int = 10) -> Dict[str, Any]:
+    """
+    Конвертирует все видео дерева директорий пулом процессов.
+
+    Каждый файл обрабатывается VideoProcessor.process_video в отдельном
+    процессе пула. Актуальные результаты (BatchState) пропускаются, поэтому
+    прерванный запуск продолжается повторным вызовом.
+
+    Args:
+        source_dir: Директория исходных видео
+        output_dir: Директория результатов
+        workers: Количество процессов пула
+        processor_options: Параметры VideoProcessor в процессах пула
+        encoder_profile: Профиль кодирования
+        force: Конвертировать заново и актуальные результаты
+        cpus: Процессоры, которые делятся между процессами пула поровну
+            (None - без привязки)
+        nice: Приращение nice процессов FFmpeg при привязке
+
+    Returns:
+        Итог: количество конвертированных, пропущенных и неудачных файлов,
+        общее время и список файлов со временем обработки каждого
+    """
+    started = time.monotonic()
+    state = BatchState(os.path.join(output_dir, '.batch_convert.db'))
+    files = []
+    pending = []
+    for source, output in find_batch_sources(source_dir, output_dir):
+        source_path = os.path.join(source_dir, source)
+        source_stat = os.stat(source_path)
+        if not force and state.is_current(source, source_stat, os.path.join(output_dir, output)):
+            files.append({'source': source, 'output': output, 'status': 'skipped'})
+        else:
+            pending.append((source, output, source_path, source_stat))
+
+    logger.info(f"Пакетная конвертация: к обработке {len(pending)}, актуальных {len(files)}")
+
+    # Все файлы анализируются заранее параллельными ffprobe: процессы пула получают
+    # готовую информацию, а длинные видео запускаются первыми и не остаются в хвосте
+    probes = MediaProbe(0).probe_many(source_path for _, _, source_path, _ in pending)
+    queued = []
+    for source, output, source_path, source_stat in pending:
+        video_info = probes[source_path]
+        if isinstance(video_info, Exception):
+            files.append({'source': source, 'output': output, 'status': 'error', 'error': str(video_info)})
+        else:
+            queued.append((source, output, source_path, source_stat, video_info))
+    queued.sort(key=lambda task: task[4].get('duration', 0), reverse=True)
+
+    # Каждый процесс пула получает свой набор процессоров
+    workers = max(1, workers)
+    cpu_sets = None
+    if cpus:
+        sets = CPUPartitioner(cpus, workers, reserved=0).sets
+        cpu_sets = multiprocessing.Queue()
+        for index in range(workers):
+            cpu_sets.put(sets[index % len(sets)])
+
+    interrupted = False
+    executor = ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_batch_worker, initargs=(processor_options, cpu_sets, nice)
+    )
+    try:
+        futures = {
+            executor.submit(_convert_batch_file, source_path, source, output, video_info, encoder_profile):
+                (source, output, source_stat)
+            for source, output, source_path, source_stat, video_info in queued
+        }
+        for future in as_completed(futures):
+            source, output, source_stat = futures[future]
+            try:
+                result, seconds = future.result()
+            except Exception as e:
+                result, seconds = {'status': 'error', 'error': str(e)}, 0.0
+            entry = {'source': source, 'output': output, 'status': result['status'], 'seconds': round(seconds, 3)}
+            if result['status'] == 'completed':
+                output_size = os.path.getsize(os.path.join(output_dir, output))
+                state.record(source, source_stat, output, output_size, seconds)
+                entry.update({
+                    'output_size': output_size,
+                    'duration': result['video_info'].get('duration', 0),
+                    'conversion_path': result['conversion_path']['mode']
+                })
+                if result.get('previews'):
+                    entry['previews'] = result['previews']['dir']
+                logger.info(f"Готово за {seconds:.1f} с: {source} -> {output}")
+            else:
+                entry['error'] = result.get('error')
+                logger.error(f"Ошибка конвертации {source}: {entry['error']}")
+            files.append(entry)
+    except KeyboardInterrupt:
+        # Незавершенные файлы не записаны в состояние и будут обработаны при следующем запуске
+        interrupted = True
+        logger.warning('Пакетная конвертация прервана')
+    finally:
+        executor.shutdown(wait=not interrupted, cancel_futures=True)
+
+    files.sort(key=lambda entry: entry['source'])
+    return {
+        'source': source_dir,
+        'output': output_dir,
+        'workers': workers,
+        'elapsed': round(time.monotonic() - started, 3),
+        'interrupted': interrupted,
+        'total': len(files),
+        'converted': sum(1 for entry in files if entry['status'] == 'completed'),
+        'skipped': sum(1 for entry in files if entry['status'] == 'skipped'),
+        'failed': sum(1 for entry in files if entry['status'] not in ('completed', 'skipped')),
+        'files': files
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Разбирает аргументы командной строки и конвертирует директорию (см. описание модуля)"""
+    parser = argparse.ArgumentParser(description='Пакетная конвертация директории видео в MP4')
+    parser.add_argument('source', help='Директория исходных видео (обходится рекурсивно)')
+    parser.add_argument('output', help='Директория результатов')
+    parser.add_argument('--workers', type=int, default=default_worker_count(),
+                        help='Количество одновременно конвертируемых файлов')
+    parser.add_argument('--encoder-profile', default=DEFAULT_PROFILE, choices=sorted(PROFILES),
+                        help='Профиль кодирования')
+    parser.add_argument('--segment-threshold', type=float, default=0,
+                        help='Длительность, начиная с которой видео кодируется по сегментам (0 - отключить)')
+    parser.add_argument('--no-remux', action='store_true', help='Всегда перекодировать видеопоток')
+    parser.add_argument('--previews', action='store_true', help='Создавать превью рядом с MP4')
+    parser.add_argument('--force', action='store_true', help='Конвертировать и актуальные результаты')
+    parser.add_argument('--cpus', help='Процессоры для кодирования в формате cpuset, например 0-7 (по умолчанию все)')
+    parser.add_argument('--no-cpu-partitioning', action='store_true',
+                        help='Не привязывать процессы пула к отдельным наборам процессоров')
+    parser.add_argument('--nice', type=int, default=10, help='Приращение nice процессов FFmpeg')
+    parser.add_argument('--temp-dir', help='Директория временных файлов (по умолчанию - в директории результатов)')
+    parser.add_argument('--summary', help='Файл итога в JSON (по умолчанию - стандартный вывод)')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        stream=sys.stderr
+    )
+
+    source_dir = os.path.abspath(args.source)
+    output_dir = os.path.abspath(args.output)
+    if not os.path.isdir(source_dir):
+        parser.error(f"Директория не найдена: {args.source}")
+    if output_dir == source_dir:
+        parser.error('Директория результатов должна отличаться от исходной')
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Проверяем FFmpeg до запуска пула, чтобы не получить ошибку на каждом файле
+    ffmpeg_capabilities()
+    processor_options = {
+        'render_dir': output_dir,
+        'temp_dir': args.temp_dir or os.path.join(output_dir, '.tmp'),
+        'segment_threshold': args.segment_threshold,
+        'remux_enabled': not args.no_remux,
+        'previews': args.previews
+    }
+    cpus = None if args.no_cpu_partitioning else available_cpus(args.cpus)
+    summary = convert_directory(
+        source_dir, output_dir, args.workers, processor_options,
+        encoder_profile=args.encoder_profile, force=args.force, cpus=cpus, nice=args.nice
+    )
+
+    text = json.dumps(summary, ensure_ascii=False, indent=2)
+    if args.summary:
+        with open(args.summary, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    if summary['interrupted']:
+        return 130
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк конвейера конвертации.
+
+Входные файлы генерируются локально источниками lavfi (testsrc и sine),
+поэтому набор воспроизводим и не требует загрузок. Для каждого файла
+замеряются этапы get_video_info, convert_video и process_video, а также
+сценарий параллельной нагрузки на Flask-приложение (/upload -> /status).
+
+Примеры:
+    python benchmark.py --output results.json
+    python benchmark.py --baseline baseline.json
+    python benchmark.py --save-baseline baseline.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import statistics
+import subprocess
+import tempfile
+import threading
+from typing import Any, Callable, Dict, List, Optional
+import logging
+
+from video_utils import VideoProcessor
+from encoder_profiles import PROFILES
+
+logger = logging.getLogger(__name__)
+
+# Набор входных файлов: ориентация, разрешение, частота кадров, длительность и аудио
+CORPUS = [
+    {'name': 'h720p25_aac', 'width': 1280, 'height': 720, 'fps': 25, 'duration': 10, 'audio': 'aac'},
+    {'name': 'h1080p30_mp3', 'width': 1920, 'height': 1080, 'fps': 30, 'duration': 10, 'audio': 'mp3'},
+    {'name': 'h480p60_aac', 'width': 854, 'height': 480, 'fps': 60, 'duration': 5, 'audio': 'aac'},
+    {'name': 'v1080x1920p30_aac', 'width': 1080, 'height': 1920, 'fps': 30, 'duration': 10, 'audio': 'aac'},
+    {'name': 'v720x1280p25_mp3', 'width': 720, 'height': 1280, 'fps': 25, 'duration': 10, 'audio': 'mp3'},
+    {'name': 'v480x854p24_none', 'width': 480, 'height': 854, 'fps': 24, 'duration': 5, 'audio': None},
+    {'name': 'h720p30_long_aac', 'width': 1280, 'height': 720, 'fps': 30, 'duration': 60, 'audio': 'aac',
+     'segment_threshold': 30},
+]
+
+# Сокращенный набор для быстрой проверки
+QUICK_CORPUS = ['h720p25_aac', 'v720x1280p25_mp3']
+
+AUDIO_ENCODERS = {'aac': 'aac', 'mp3': 'libmp3lame'}
+
+
+def generate_input(spec: Dict[str, Any], corpus_dir: str) -> str:
+    """
+    Генерирует входной файл, если его еще нет.
+
+    Args:
+        spec: Описание файла из CORPUS
+        corpus_dir: Директория для сгенерированных файлов
+
+    Returns:
+        Путь к файлу
+    """
+    path = os.path.join(corpus_dir, f"{spec['name']}.mp4")
+    if os.path.exists(path):
+        return path
+
+    duration = spec['duration']
+    cmd = [
+        'ffmpeg', '-y', '-v', 'error',
+        '-f', 'lavfi', '-i', f"testsrc=size={spec['width']}x{spec['height']}:rate={spec['fps']}:duration={duration}"
+    ]
+    if spec['audio']:
+        cmd.extend(['-f', 'lavfi', '-i', f"sine=frequency=440:sample_rate=48000:duration={duration}"])
+    cmd.extend(['-c:v', 'libx264', '-preset', 'veryfast', '-pix_fmt', 'yuv420p'])
+    if spec['audio']:
+        cmd.extend(['-c:a', AUDIO_ENCODERS[spec['audio']], '-b:a', '128k', '-shortest'])
+
+    # Пишем во временный файл, чтобы прерванная генерация не оставила битый вход
+    temp_path = f"{path}.tmp.mp4"
+    cmd.append(temp_path)
+    subprocess.run(cmd, check=True)
+    os.replace(temp_path, path)
+    return path
+
+
+def measure(func: Callable[[], Any]) -> Dict[str, Any]:
+    """
+    Выполняет функцию и замеряет время.
+
+    Процессорное время включает завершившиеся дочерние процессы (FFmpeg).
+
+    Returns:
+        Словарь с wall_s, cpu_s и результатом функции
+    """
+    start_times = os.times()
+    start = time.perf_counter()
+    result = func()
+    wall = time.perf_counter() - start
+    end_times = os.times()
+    cpu = sum(
+        end - begin for end, begin in zip(end_times[:4], start_times[:4])
+    )
+    return {'wall_s': wall, 'cpu_s': cpu, 'result': result}
+
+
+def summarize(samples: List[Dict[str, Any]], duration: float, output_path: Optional[str]) -> Dict[str, Any]:
+    """Собирает показатели этапа по нескольким повторам (медиана)"""
+    wall = statistics.median(sample['wall_s'] for sample in samples)
+    cpu = statistics.median(sample['cpu_s'] for sample in samples)
+    summary = {
+        'wall_s': round(wall, 4),
+        'cpu_s': round(cpu, 4),
+        'realtime_factor': round(duration / wall, 2) if wall > 0 else 0,
+        'repeats': len(samples)
+    }
+    if output_path and os.path.exists(output_path):
+        summary['output_bytes'] = os.path.getsize(output_path)
+    return summary
+
+
+def bench_stages(spec: Dict[str, Any], input_path: str, work_dir: str, repeat: int,
+                 encoder_profile: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Замеряет этапы обработки одного файла.
+
+    Args:
+        encoder_profile: Профиль кодирования (по умолчанию профиль VideoProcessor)
+
+    Returns:
+        Словарь {этап: показатели}
+    """
+    render_dir = os.path.join(work_dir, 'render')
+    temp_dir = os.path.join(work_dir, 'temp')
+    processor = VideoProcessor(
+        render_dir=render_dir,
+        temp_dir=temp_dir,
+        segment_threshold=spec.get('segment_threshold', 600),
+        min_segment_duration=10
+    )
+    duration = spec['duration']
+    results = {}
+
+    # Замеряется сам ffprobe, поэтому кеш анализа не используется
+    probes = [measure(lambda: processor.get_video_info(input_path, cache=False)) for _ in range(repeat)]
+    video_info = probes[-1]['result']
+    results['get_video_info'] = summarize(probes, duration, None)
+
+    convert_output = os.path.join(work_dir, 'convert.mp4')
+    converts = []
+    for _ in range(repeat):
+        sample = measure(lambda: processor.convert_video(
+            input_path, convert_output, video_info, encoder_profile=encoder_profile
+        ))
+        if not sample['result']:
+            raise RuntimeError(f"convert_video завершилась с ошибкой для {spec['name']}")
+        converts.append(sample)
+    results['convert_video'] = summarize(converts, duration, convert_output)
+
+    processes = []
+    output_path = None
+    for _ in range(repeat):
+        shutil.rmtree(render_dir, ignore_errors=True)
+        os.makedirs(render_dir)
+        sample = measure(lambda: processor.process_video(
+            input_path, os.path.basename(input_path), encoder_profile=encoder_profile
+        ))
+        if sample['result']['status'] != 'completed':
+            raise RuntimeError(f"process_video завершилась с ошибкой для {spec['name']}: {sample['result']}")
+        output_path = os.path.join(render_dir, sample['result']['output_filename'])
+        processes.append(sample)
+    results['process_video'] = summarize(processes, duration, output_path)
+    results['process_video']['conversion_path'] = processes[-1]['result']['conversion_path']['mode']
+    results['process_video']['encode_segments'] = processes[-1]['result']['encode_segments']
+
+    return results
+
+
+def bench_concurrent(input_paths: List[str], work_dir: str, concurrency: int, timeout: float) -> Dict[str, Any]:
+    """
+    Сценарий параллельной нагрузки: несколько клиентов загружают файлы
+    через /upload и опрашивают /status до завершения.
+
+    Приложение импортируется в отдельной рабочей директории, чтобы база,
+    загрузки и результаты не смешивались с рабочими данными.
+
+    Returns:
+        Показатели сценария
+    """
+    previous_cwd = os.getcwd()
+    app_dir = os.path.join(work_dir, 'app')
+    os.makedirs(app_dir, exist_ok=True)
+    os.chdir(app_dir)
+    try:
+        import app as app_module
+        # Кеш отключаем: одинаковые файлы иначе завершались бы мгновенно
+        app_module.conversion_cache = None
+        app_module.conversion_runner.conversion_cache = None
+        client = app_module.app.test_client()
+
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+
+        def run_client(index):
+            path = input_paths[index % len(input_paths)]
+            start = time.perf_counter()
+            with open(path, 'rb') as source:
+                response = client.post(
+                    '/upload',
+                    data={'file': (source, os.path.basename(path))},
+                    content_type='multipart/form-data'
+                )
+            if response.status_code != 200:
+                with lock:
+                    errors.append(f"/upload: {response.status_code}")
+                return
+            job_id = response.get_json()['job_id']
+
+            deadline = start + timeout
+            while time.perf_counter() < deadline:
+                status = client.get(f"/status/{job_id}").get_json()
+                if status['status'] in ('completed', 'error', 'cancelled'):
+                    with lock:
+                        if status['status'] != 'completed':
+                            errors.append(status.get('error', 'error'))
+                        else:
+                            latencies.append(time.perf_counter() - start)
+                    return
+                time.sleep(0.1)
+            with lock:
+                errors.append('timeout')
+
+        def run_all():
+            threads = [threading.Thread(target=run_client, args=(index,)) for index in range(concurrency)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        sample = measure(run_all)
+    finally:
+        os.chdir(previous_cwd)
+
+    latencies.sort()
+    return {
+        'clients': concurrency,
+        'workers': app_module.app.config['CONVERSION_WORKERS'],
+        'wall_s': round(sample['wall_s'], 4),
+        'cpu_s': round(sample['cpu_s'], 4),
+        'completed': len(latencies),
+        'errors': errors,
+        'throughput_jobs_per_s': round(len(latencies) / sample['wall_s'], 4) if sample['wall_s'] else 0,
+        'latency_mean_s': round(statistics.mean(latencies), 4) if latencies else None,
+        'latency_p95_s': round(latencies[max(0, int(len(latencies) * 0.95) - 1)], 4) if latencies else None
+    }
+
+
+def environment() -> Dict[str, Any]:
+    """Описание окружения, в котором получены результаты"""
+    try:
+        ffmpeg_version = subprocess.run(
+            ['ffmpeg', '-version'], capture_output=True, text=True, check=True
+        ).stdout.splitlines()[0]
+    except (OSError, subprocess.CalledProcessError, IndexError):
+        ffmpeg_version = 'unknown'
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'ffmpeg': ffmpeg_version,
+        'timestamp': time.time()
+    }
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[Dict[str, Any]]:
+    """
+    Сравнивает результаты с эталонными.
+
+    Args:
+        results: Текущие результаты
+        baseline: Эталонные результаты (тот же формат)
+        threshold: Допустимое относительное увеличение времени (0.1 = 10%)
+
+    Returns:
+        Список сравнений по этапам; у регрессий поле regression = True
+    """
+    rows = []
+    for name, stages in results['inputs'].items():
+        for stage, current in stages.items():
+            previous = baseline.get('inputs', {}).get(name, {}).get(stage)
+            if not previous or not previous.get('wall_s'):
+                continue
+            ratio = current['wall_s'] / previous['wall_s']
+            rows.append({
+                'stage': f"{name}/{stage}",
+                'baseline_wall_s': previous['wall_s'],
+                'wall_s': current['wall_s'],
+                'ratio': round(ratio, 3),
+                'regression': ratio > 1 + threshold
+            })
+
+    current = results.get('concurrent')
+    previous = baseline.get('concurrent')
+    if current and previous and previous.get('wall_s'):
+        ratio = current['wall_s'] / previous['wall_s']
+        rows.append({
+            'stage': 'concurrent',
+            'baseline_wall_s': previous['wall_s'],
+            'wall_s': current['wall_s'],
+            'ratio': round(ratio, 3),
+            'regression': ratio > 1 + threshold
+        })
+    return rows
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Бенчмарк конвейера конвертации видео')
+    parser.add_argument('--corpus-dir', default='.benchmark_corpus', help='Директория сгенерированных входных файлов')
+    parser.add_argument('--output', help='Файл для сохранения результатов (JSON)')
+    parser.add_argument('--baseline', help='Эталонные результаты для сравнения')
+    parser.add_argument('--save-baseline', help='Сохранить результаты как эталонные')
+    parser.add_argument('--threshold', type=float, default=0.10, help='Допустимое замедление (доля)')
+    parser.add_argument('--repeat', type=int, default=3, help='Количество повторов каждого этапа')
+    parser.add_argument('--concurrency', type=int, default=4, help='Клиентов в сценарии нагрузки (0 - пропустить)')
+    parser.add_argument('--timeout', type=float, default=600, help='Тайм-аут задачи в сценарии нагрузки')
+    parser.add_argument('--quick', action='store_true', help='Сокращенный набор файлов')
+    parser.add_argument('--only', action='append', help='Запустить только указанные файлы набора')
+    parser.add_argument('--profile', choices=sorted(PROFILES), help='Профиль кодирования для замеров этапов')
+    args = parser.parse_args(argv)
+
+    # Подробный журнал FFmpeg-команд искажает замеры и мешает читать результат
+    logging.getLogger().setLevel(logging.WARNING)
+
+    names = args.only or (QUICK_CORPUS if args.quick else [spec['name'] for spec in CORPUS])
+    corpus = [spec for spec in CORPUS if spec['name'] in names]
+    os.makedirs(args.corpus_dir, exist_ok=True)
+    corpus_dir = os.path.abspath(args.corpus_dir)
+
+    results = {'environment': environment(), 'encoder_profile': args.profile, 'inputs': {}}
+    work_root = tempfile.mkdtemp(prefix='video_benchmark_')
+    try:
+        input_paths = []
+        for spec in corpus:
+            print(f"Генерация {spec['name']}...", file=sys.stderr)
+            input_path = generate_input(spec, corpus_dir)
+            input_paths.append(input_path)
+
+            print(f"Замер {spec['name']}...", file=sys.stderr)
+            work_dir = os.path.join(work_root, spec['name'])
+            os.makedirs(work_dir)
+            results['inputs'][spec['name']] = bench_stages(spec, input_path, work_dir, args.repeat, args.profile)
+
+        if args.concurrency > 0 and input_paths:
+            print(f"Параллельная нагрузка ({args.concurrency} клиентов)...", file=sys.stderr)
+            results['concurrent'] = bench_concurrent(input_paths, work_root, args.concurrency, args.timeout)
+    finally:
+        shutil.rmtree(work_root, ignore_errors=True)
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            comparison = compare(results, json.load(baseline_file), args.threshold)
+        results['comparison'] = comparison
+        regressions = [row for row in comparison if row['regression']]
+        for row in regressions:
+            print(f"Регрессия {row['stage']}: {row['baseline_wall_s']} -> {row['wall_s']} с "
+                  f"(x{row['ratio']})", file=sys.stderr)
+        if regressions:
+            exit_code = 1
+
+    output = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output)
+    else:
+        print(output)
+
+    if args.save_baseline:
+        baseline = {key: value for key, value in results.items() if key != 'comparison'}
+        with open(args.save_baseline, 'w') as baseline_file:
+            json.dump(baseline, baseline_file, indent=2, ensure_ascii=False)
+
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+import os
+import time
+import uuid
+import hashlib
+from typing import Any, BinaryIO, Dict, List, Optional
+import logging
+
+from database import SQLiteDatabase
+from conversion_cache import HASH_BLOCK_SIZE, combine_block_digests
+
+logger = logging.getLogger(__name__)
+
+
+class UploadError(Exception):
+    """Ошибка протокола частичной загрузки"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class ChunkedUploadManager:
+    """
+    Возобновляемая загрузка файлов частями.
+
+    При инициализации создается файл итогового размера, и каждая часть
+    записывается сразу по своему смещению - без промежуточного буфера и
+    повторного копирования. Части можно отправлять параллельно и в любом
+    порядке, а после обрыва соединения дозагрузить только недостающие.
+
+    Размер части совпадает с блоком хеша содержимого, поэтому хеш файла
+    собирается из хешей частей без повторного чтения файла.
+    """
+
+    CHUNK_SIZE = HASH_BLOCK_SIZE
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS uploads (
+            upload_id TEXT PRIMARY KEY,
+            filename TEXT NOT NULL,
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            created REAL NOT NULL,
+            updated REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS uploads_updated ON uploads (updated);
+
+        CREATE TABLE IF NOT EXISTS upload_chunks (
+            upload_id TEXT NOT NULL,
+            chunk_index INTEGER NOT NULL,
+            digest BLOB NOT NULL,
+            PRIMARY KEY (upload_id, chunk_index)
+        );
+    """
+
+    def __init__(self, upload_dir: str, db_path: str, max_size: int, buffer_size: int = 1024 * 1024):
+        """
+        Инициализирует менеджер загрузок.
+
+        Args:
+            upload_dir: Директория для загружаемых файлов
+            db_path: Путь к базе данных SQLite с состоянием загрузок
+            max_size: Максимальный размер загружаемого файла
+            buffer_size: Размер блока чтения тела запроса
+        """
+        self.upload_dir = upload_dir
+        self.max_size = max_size
+        self.buffer_size = buffer_size
+        os.makedirs(upload_dir, exist_ok=True)
+
+        self.db = SQLiteDatabase(db_path)
+        self.db.executescript(self.SCHEMA)
+
+    def total_chunks(self, size: int) -> int:
+        """Количество частей для файла заданного размера"""
+        return max(1, (size + self.CHUNK_SIZE - 1) // self.CHUNK_SIZE)
+
+    def _get(self, upload_id: str) -> Dict[str, Any]:
+        """Возвращает запись о загрузке или выбрасывает UploadError"""
+        row = self.db.connection().execute(
+            'SELECT * FROM uploads WHERE upload_id = ?', (upload_id,)
+        ).fetchone()
+        if row is None:
+            raise UploadError('Загрузка не найдена', 404)
+        return dict(row)
+
+    def init(self, filename: str, size: int) -> Dict[str, Any]:
+        """
+        Начинает новую загрузку.
+
+        Args:
+            filename: Безопасное имя файла
+            size: Полный размер файла в байтах
+
+        Returns:
+            Параметры загрузки: upload_id, chunk_size, total_chunks
+        """
+        if size <= 0:
+            raise UploadError('Некорректный размер файла')
+        if size > self.max_size:
+            raise UploadError('Файл слишком большой', 413)
+
+        upload_id = str(uuid.uuid4())
+        path = os.path.join(self.upload_dir, f"{upload_id}_{filename}")
+
+        # Файл сразу получает итоговый размер, части записываются по своим смещениям
+        with open(path, 'wb') as output:
+            output.truncate(size)
+
+        now = time.time()
+        with self.db.transaction() as connection:
+            connection.execute(
+                'INSERT INTO uploads (upload_id, filename, path, size, created, updated) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (upload_id, filename, path, size, now, now)
+            )
+
+        return {
+            'upload_id': upload_id,
+            'chunk_size': self.CHUNK_SIZE,
+            'total_chunks': self.total_chunks(size)
+        }
+
+    def write_chunk(self, upload_id: str, start: int, end: int, total: int, stream: BinaryIO) -> Dict[str, Any]:
+        """
+        Записывает часть файла из тела запроса.
+
+        Args:
+            upload_id: Идентификатор загрузки
+            start: Смещение первого байта (из Content-Range)
+            end: Смещение последнего байта включительно
+            total: Полный размер файла
+            stream: Поток с телом запроса
+
+        Returns:
+            Состояние загрузки после записи части
+        """
+        upload = self._get(upload_id)
+
+        if total != upload['size']:
+            raise UploadError('Размер файла не совпадает с заявленным')
+        if start % self.CHUNK_SIZE != 0:
+            raise UploadError('Начало части должно быть кратно размеру части')
+
+        chunk_index = start // self.CHUNK_SIZE
+        expected_length = min(self.CHUNK_SIZE, upload['size'] - start)
+        if expected_length <= 0 or end - start + 1 != expected_length:
+            raise UploadError('Некорректная длина части')
+
+        digest = hashlib.sha256()
+        written = 0
+        with open(upload['path'], 'r+b') as output:
+            output.seek(start)
+            while written < expected_length:
+                data = stream.read(min(self.buffer_size, expected_length - written))
+                if not data:
+                    break
+                digest.update(data)
+                output.write(data)
+                written += len(data)
+
+        if written != expected_length:
+            raise UploadError('Часть получена не полностью')
+
+        with self.db.transaction() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO upload_chunks (upload_id, chunk_index, digest) VALUES (?, ?, ?)',
+                (upload_id, chunk_index, digest.digest())
+            )
+            connection.execute(
+                'UPDATE uploads SET updated = ? WHERE upload_id = ?', (time.time(), upload_id)
+            )
+
+        return self.status(upload_id)
+
+    def status(self, upload_id: str) -> Dict[str, Any]:
+        """
+        Возвращает состояние загрузки для возобновления.
+
+        Returns:
+            Словарь с размером, размером части и списками полученных и недостающих частей
+        """
+        upload = self._get(upload_id)
+        received = [
+            row['chunk_index'] for row in self.db.connection().execute(
+                'SELECT chunk_index FROM upload_chunks WHERE upload_id = ? ORDER BY chunk_index',
+                (upload_id,)
+            )
+        ]
+        received_set = set(received)
+        total_chunks = self.total_chunks(upload['size'])
+        return {
+            'upload_id': upload_id,
+            'filename': upload['filename'],
+            'size': upload['size'],
+            'chunk_size': self.CHUNK_SIZE,
+            'total_chunks': total_chunks,
+            'received_chunks': received,
+            'missing_chunks': [index for index in range(total_chunks) if index not in received_set]
+        }
+
+    def finalize(self, upload_id: str) -> Dict[str, Any]:
+        """
+        Завершает загрузку.
+
+        Returns:
+            Словарь с путем к файлу, именем, размером и хешем содержимого
+        """
+        upload = self._get(upload_id)
+        total_chunks = self.total_chunks(upload['size'])
+
+        with self.db.transaction() as connection:
+            digests = [
+                row['digest'] for row in connection.execute(
+                    'SELECT digest FROM upload_chunks WHERE upload_id = ? ORDER BY chunk_index',
+                    (upload_id,)
+                )
+            ]
+            if len(digests) != total_chunks:
+                raise UploadError(f"Получено частей: {len(digests)} из {total_chunks}", 409)
+
+            connection.execute('DELETE FROM upload_chunks WHERE upload_id = ?', (upload_id,))
+            connection.execute('DELETE FROM uploads WHERE upload_id = ?', (upload_id,))
+
+        return {
+            'path': upload['path'],
+            'filename': upload['filename'],
+            'size': upload['size'],
+            'content_hash': combine_block_digests(digests, upload['size'])
+        }
+
+    def abort(self, upload_id: str):
+        """Отменяет загрузку и удаляет частично записанный файл"""
+        upload = self._get(upload_id)
+        with self.db.transaction() as connection:
+            connection.execute('DELETE FROM upload_chunks WHERE upload_id = ?', (upload_id,))
+            connection.execute('DELETE FROM uploads WHERE upload_id = ?', (upload_id,))
+        try:
+            os.remove(upload['path'])
+        except OSError:
+            pass
+
+    def paths(self) -> List[str]:
+        """Возвращает пути файлов незавершенных загрузок"""
+        rows = self.db.connection().execute('SELECT path FROM uploads').fetchall()
+        return [row['path'] for row in rows]
+
+    def delete_stale(self, older_than: float) -> int:
+        """
+        Удаляет загрузки, не получавшие частей с указанного момента.
+
+        Returns:
+            Количество удаленных загрузок
+        """
+        rows = self.db.connection().execute(
+            'SELECT upload_id FROM uploads WHERE updated < ?', (older_than,)
+        ).fetchall()
+        for row in rows:
+            try:
+                self.abort(row['upload_id'])
+            except UploadError:
+                pass
+        return len(rows)
+
+    @staticmethod
+    def parse_content_range(header: Optional[str]):
+        """
+        Разбирает заголовок Content-Range вида "bytes 0-1023/4096".
+
+        Returns:
+            Кортеж (start, end, total)
+        """
+        if not header or not header.startswith('bytes '):
+            raise UploadError('Требуется заголовок Content-Range')
+        try:
+            byte_range, total = header[len('bytes '):].split('/')
+            start, end = byte_range.split('-')
+            start, end, total = int(start), int(end), int(total)
+        except ValueError:
+            raise UploadError('Некорректный заголовок Content-Range')
+        if start < 0 or end < start or end >= total:
+            raise UploadError('Некорректный диапазон Content-Range')
+        return start, end, total
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+import os
+import json
+import time
+import shutil
+import hashlib
+import uuid
+from typing import Any, Dict, List, Optional
+import logging
+
+from database import SQLiteDatabase
+from storage_manager import path_size, remove_path
+
+logger = logging.getLogger(__name__)
+
+# Размер блока, по которому считается хеш содержимого
+HASH_BLOCK_SIZE = 8 * 1024 * 1024
+
+
+def combine_block_digests(block_digests: List[bytes], total_size: int) -> str:
+    """
+    Собирает итоговый хеш файла из хешей его блоков.
+
+    Args:
+        block_digests: SHA-256 последовательных блоков по HASH_BLOCK_SIZE байт
+        total_size: Размер файла в байтах
+
+    Returns:
+        Хеш содержимого в шестнадцатеричном виде
+    """
+    combined = hashlib.sha256()
+    combined.update(str(total_size).encode())
+    for digest in block_digests:
+        combined.update(digest)
+    return combined.hexdigest()
+
+
+class ContentHasher:
+    """
+    Потоковый хеш содержимого файла.
+
+    Файл делится на блоки по HASH_BLOCK_SIZE байт, итоговый хеш считается
+    от хешей блоков. Поэтому блоки можно хешировать независимо друг от друга
+    и в любом порядке, а результат совпадает с последовательным чтением.
+    """
+
+    def __init__(self):
+        self.size = 0
+        self._digests = []
+        self._block = hashlib.sha256()
+        self._block_size = 0
+
+    def update(self, data: bytes):
+        """Добавляет очередную порцию данных"""
+        view = memoryview(data)
+        while view:
+            take = min(len(view), HASH_BLOCK_SIZE - self._block_size)
+            self._block.update(view[:take])
+            self._block_size += take
+            self.size += take
+            view = view[take:]
+            if self._block_size == HASH_BLOCK_SIZE:
+                self._digests.append(self._block.digest())
+                self._block = hashlib.sha256()
+                self._block_size = 0
+
+    def hexdigest(self) -> str:
+        """Возвращает хеш всех переданных данных"""
+        digests = list(self._digests)
+        if self._block_size:
+            digests.append(self._block.digest())
+        return combine_block_digests(digests, self.size)
+
+
+class ConversionCache:
+    """
+    Кеш результатов конвертации, адресуемый содержимым.
+
+    Ключ записи - хеш исходного файла и отпечаток параметров конвертации.
+    Результаты хранятся жесткими ссылками в отдельной директории, поэтому
+    повторная загрузка того же файла завершается созданием ссылки в Render/
+    без ffprobe и кодирования. Объем кеша ограничен: при превышении лимита
+    удаляются записи, к которым дольше всего не обращались (LRU).
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS cache_entries (
+            cache_key TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            result TEXT NOT NULL,
+            created REAL NOT NULL,
+            last_access REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS cache_entries_last_access ON cache_entries (last_access);
+
+        CREATE TABLE IF NOT EXISTS cache_counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        );
+    """
+
+    def __init__(self, cache_dir: str, db_path: str, max_bytes: int):
+        """
+        Инициализирует кеш.
+
+        Args:
+            cache_dir: Директория для файлов кеша (на том же разделе, что и Render/)
+            db_path: Путь к базе данных SQLite с индексом кеша
+            max_bytes: Максимальный суммарный размер файлов кеша
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self.db = SQLiteDatabase(db_path)
+        self.db.executescript(self.SCHEMA)
+
+    @staticmethod
+    def make_key(content_hash: str, params_key: str) -> str:
+        """Формирует ключ записи кеша"""
+        return f"{content_hash}-{params_key}"
+
+    def _count(self, connection, name: str, delta: int = 1):
+        """Увеличивает счетчик кеша"""
+        connection.execute(
+            'INSERT INTO cache_counters (name, value) VALUES (?, ?) '
+            'ON CONFLICT (name) DO UPDATE SET value = value + excluded.value',
+            (name, delta)
+        )
+
+    @staticmethod
+    def preview_path(path: str) -> str:
+        """Директория превью, хранящаяся рядом с файлом кеша"""
+        return f"{os.path.splitext(path)[0]}_preview"
+
+    @staticmethod
+    def _link(source: str, destination: str):
+        """Создает жесткую ссылку, а если это невозможно - копию файла"""
+        try:
+            os.link(source, destination)
+        except OSError:
+            shutil.copy2(source, destination)
+
+    def lookup(self, content_hash: str, params_key: str) -> Optional[Dict[str, Any]]:
+        """
+        Ищет готовый результат конвертации.
+
+        Args:
+            content_hash: Хеш исходного файла
+            params_key: Отпечаток параметров конвертации
+
+        Returns:
+            Словарь {'path': путь_к_файлу_кеша, 'result': результат_конвертации} или None
+        """
+        cache_key = self.make_key(content_hash, params_key)
+        with self.db.transaction() as connection:
+            row = connection.execute(
+                'SELECT path, result FROM cache_entries WHERE cache_key = ?', (cache_key,)
+            ).fetchone()
+
+            if row is not None and (
+                not os.path.exists(row['path'])
+                or ('previews' in json.loads(row['result']) and not os.path.isdir(self.preview_path(row['path'])))
+            ):
+                # Файл удален в обход кеша - забываем запись
+                connection.execute('DELETE FROM cache_entries WHERE cache_key = ?', (cache_key,))
+                row = None
+
+            if row is None:
+                self._count(connection, 'misses')
+                return None
+
+            connection.execute(
+                'UPDATE cache_entries SET last_access = ? WHERE cache_key = ?',
+                (time.time(), cache_key)
+            )
+            self._count(connection, 'hits')
+
+        return {'path': row['path'], 'result': json.loads(row['result'])}
+
+    def materialize(self, entry: Dict[str, Any], output_path: str, previews_path: Optional[str] = None):
+        """
+        Размещает результат из кеша по указанному пути.
+
+        Args:
+            entry: Запись, возвращенная lookup()
+            output_path: Путь к выходному файлу в Render/
+            previews_path: Директория для превью (если они есть в записи)
+        """
+        self._link(entry['path'], output_path)
+        if previews_path and 'previews' in entry['result']:
+            shutil.copytree(
+                self.preview_path(entry['path']), previews_path, copy_function=self._link, dirs_exist_ok=True
+            )
+
+    def store(self, content_hash: str, params_key: str, output_path: str, result: Dict[str, Any],
+              previews_path: Optional[str] = None):
+        """
+        Добавляет результат конвертации в кеш.
+
+        Args:
+            content_hash: Хеш исходного файла
+            params_key: Отпечаток параметров конвертации
+            output_path: Путь к готовому файлу
+            result: Результат конвертации (сохраняется для повторной выдачи)
+            previews_path: Директория превью результата; сохраняется ссылками
+                рядом с файлом кеша
+        """
+        cache_key = self.make_key(content_hash, params_key)
+        cache_path = os.path.join(self.cache_dir, f"{cache_key}.mp4")
+
+        try:
+            size = 0
+            if previews_path:
+                # Превью размещаются до файла: lookup() находит запись только целиком
+                cache_previews = self.preview_path(cache_path)
+                remove_path(cache_previews)
+                shutil.copytree(previews_path, cache_previews, copy_function=self._link)
+                size = path_size(cache_previews)
+
+            # Создаем ссылку под временным именем и атомарно заменяем существующую
+            temp_path = f"{cache_path}.{uuid.uuid4().hex}.tmp"
+            self._link(output_path, temp_path)
+            os.replace(temp_path, cache_path)
+            size += os.path.getsize(cache_path)
+        except OSError as e:
+            logger.error(f"Не удалось добавить файл в кеш: {e}")
+            return
+
+        now = time.time()
+        with self.db.transaction() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO cache_entries '
+                '(cache_key, path, size, result, created, last_access) VALUES (?, ?, ?, ?, ?, ?)',
+                (cache_key, cache_path, size, json.dumps(result, ensure_ascii=False), now, now)
+            )
+
+        self.evict()
+
+    def evict(self) -> int:
+        """
+        Удаляет давно не использованные записи, пока кеш превышает лимит.
+
+        Returns:
+            Количество удаленных записей
+        """
+        removed_paths = []
+        with self.db.transaction() as connection:
+            total = connection.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM cache_entries'
+            ).fetchone()[0]
+            if total <= self.max_bytes:
+                return 0
+
+            # Обходим записи от самых старых по индексу last_access
+            for row in connection.execute(
+                'SELECT cache_key, path, size FROM cache_entries ORDER BY last_access'
+            ).fetchall():
+                if total <= self.max_bytes:
+                    break
+                connection.execute('DELETE FROM cache_entries WHERE cache_key = ?', (row['cache_key'],))
+                removed_paths.append(row['path'])
+                total -= row['size']
+
+            self._count(connection, 'evictions', len(removed_paths))
+
+        for path in removed_paths:
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"Не удалось удалить файл кеша {path}: {e}")
+            remove_path(self.preview_path(path))
+
+        if removed_paths:
+            logger.info(f"Из кеша вытеснено записей: {len(removed_paths)}")
+        return len(removed_paths)
+
+    def stats(self) -> Dict[str, Any]:
+        """Возвращает статистику кеша"""
+        connection = self.db.connection()
+        entries, size = connection.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries'
+        ).fetchone()
+        counters = {
+            row['name']: row['value']
+            for row in connection.execute('SELECT name, value FROM cache_counters')
+        }
+        hits = counters.get('hits', 0)
+        misses = counters.get('misses', 0)
+        return {
+            'entries': entries,
+            'size_mb': size / (1024 * 1024),
+            'max_size_mb': self.max_bytes / (1024 * 1024),
+            'hits': hits,
+            'misses': misses,
+            'evictions': counters.get('evictions', 0),
+            'hit_ratio': hits / (hits + misses) if hits + misses else 0
+        }
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+import time
+from typing import Any, Dict, Optional
+import logging
+
+from database import SQLiteDatabase
+from encoder_profiles import PROFILES
+
+logger = logging.getLogger(__name__)
+
+# Начальные оценки: секунд обработки на миллион пикселей-кадров (до первых замеров).
+# Полное кодирование libx264 - примерно реальное время для 1080p25 на 4 ядрах
+DEFAULT_RATES = {
+    'full': 0.02,
+    'full_segmented': 0.008,
+    # Адаптивный вывод: одно декодирование и кодирование нескольких качеств
+    'hls': 0.03,
+    'audio_transcode': 0.001,
+    'remux': 0.0005
+}
+
+# Оценка задачи, для которой информация о видео неизвестна
+DEFAULT_COST = 60.0
+
+
+class CostModel:
+    """
+    Оценка времени обработки задачи по параметрам видео.
+
+    Объем работы считается в миллионах пикселей-кадров: длительность x
+    разрешение x частота кадров (не ниже выходной). Для каждого способа
+    обработки (remux, перекодирование аудио, полное кодирование одним
+    процессом или по сегментам, адаптивный вывод HLS) хранится скорость
+    в секундах на единицу работы. Кодирование видео учитывается отдельно
+    по профилям ('full:quality', 'hls:fastest'): пресеты libx264 отличаются
+    по скорости в разы, и переключение профиля по нагрузке не должно
+    сдвигать общую оценку. Скорость уточняется по фактическому времени
+    завершенных задач (экспоненциальное скользящее среднее) и хранится в
+    общей базе, поэтому ее используют все веб-процессы и обработчики.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS cost_rates (
+            cost_key TEXT PRIMARY KEY,
+            seconds_per_unit REAL NOT NULL,
+            samples INTEGER NOT NULL DEFAULT 0,
+            updated REAL NOT NULL
+        );
+    """
+
+    def __init__(self, db_path: str, smoothing: float = 0.2, output_fps: float = 25):
+        """
+        Инициализирует модель.
+
+        Args:
+            db_path: Путь к базе данных SQLite
+            smoothing: Вес нового замера в скользящем среднем (0..1)
+            output_fps: Частота кадров результата
+        """
+        self.smoothing = smoothing
+        self.output_fps = output_fps
+        self.db = SQLiteDatabase(db_path)
+        self.db.executescript(self.SCHEMA)
+
+    def work_units(self, video_info: Dict[str, Any]) -> float:
+        """Объем работы в миллионах пикселей-кадров"""
+        fps = max(video_info.get('fps') or 0, self.output_fps)
+        pixels = (video_info.get('width') or 0) * (video_info.get('height') or 0)
+        return video_info.get('duration', 0) * fps * pixels / 1e6
+
+    @staticmethod
+    def cost_key(plan: Dict[str, str], segments: int = 1, encoder_profile: Optional[str] = None) -> str:
+        """
+        Ключ скорости для способа обработки.
+
+        Args:
+            plan: conversion_path результата VideoProcessor
+            segments: Количество сегментов параллельного кодирования
+            encoder_profile: Профиль кодирования; учитывается, только если
+                видеопоток перекодируется
+        """
+        if plan['mode'] == 'full' and segments > 1:
+            key = 'full_segmented'
+        else:
+            key = plan['mode']
+        if encoder_profile and plan.get('video') == 'encode':
+            key = f"{key}:{encoder_profile}"
+        return key
+
+    def _rate(self, cost_key: str) -> float:
+        """
+        Текущая скорость для ключа.
+
+        Для профиля без замеров скорость выводится из замеров других
+        профилей того же способа обработки (и замеров до разделения по
+        профилям) с поправкой на relative_cost, а без них - из начальной
+        оценки.
+        """
+        connection = self.db.connection()
+        row = connection.execute(
+            'SELECT seconds_per_unit FROM cost_rates WHERE cost_key = ?', (cost_key,)
+        ).fetchone()
+        if row is not None:
+            return row['seconds_per_unit']
+
+        mode, _, profile = cost_key.partition(':')
+        default = DEFAULT_RATES.get(mode, DEFAULT_RATES['full'])
+        if not profile:
+            return default
+        relative_cost = PROFILES.get(profile, {}).get('relative_cost', 1.0)
+        # Скорость в единицах профиля balanced по известным замерам
+        normalized = []
+        for other in connection.execute(
+            'SELECT cost_key, seconds_per_unit FROM cost_rates WHERE cost_key = ? OR cost_key LIKE ?',
+            (mode, f"{mode}:%")
+        ).fetchall():
+            other_profile = other['cost_key'].partition(':')[2]
+            other_cost = PROFILES.get(other_profile, {}).get('relative_cost', 1.0) if other_profile else 1.0
+            normalized.append(other['seconds_per_unit'] / other_cost)
+        base = sum(normalized) / len(normalized) if normalized else default
+        return base * relative_cost
+
+    def estimate(self, video_info: Optional[Dict[str, Any]], cost_key: str) -> float:
+        """
+        Оценивает время обработки в секундах.
+
+        Args:
+            video_info: Информация о видео (None - неизвестна)
+            cost_key: Ключ способа обработки (cost_key())
+        """
+        if not video_info:
+            return DEFAULT_COST
+        return self.work_units(video_info) * self._rate(cost_key)
+
+    def observe(self, video_info: Dict[str, Any], cost_key: str, seconds: float):
+        """Уточняет скорость по фактическому времени обработки задачи"""
+        units = self.work_units(video_info)
+        if units <= 0 or seconds <= 0:
+            return
+        rate = seconds / units
+        now = time.time()
+        with self.db.transaction() as connection:
+            row = connection.execute(
+                'SELECT seconds_per_unit FROM cost_rates WHERE cost_key = ?', (cost_key,)
+            ).fetchone()
+            if row is None:
+                # Первый замер заменяет начальную оценку целиком
+                connection.execute(
+                    'INSERT INTO cost_rates (cost_key, seconds_per_unit, samples, updated) VALUES (?, ?, 1, ?)',
+                    (cost_key, rate, now)
+                )
+            else:
+                connection.execute(
+                    'UPDATE cost_rates SET seconds_per_unit = ?, samples = samples + 1, updated = ? '
+                    'WHERE cost_key = ?',
+                    (row['seconds_per_unit'] * (1 - self.smoothing) + rate * self.smoothing, now, cost_key)
+                )
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Возвращает текущие скорости и количество замеров по способам обработки"""
+        stats = {
+            cost_key: {'seconds_per_unit': rate, 'samples': 0}
+            for cost_key, rate in DEFAULT_RATES.items()
+        }
+        for row in self.db.connection().execute('SELECT * FROM cost_rates').fetchall():
+            stats[row['cost_key']] = {'seconds_per_unit': row['seconds_per_unit'], 'samples': row['samples']}
+        return stats
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+import os
+import math
+import shutil
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Класс best-effort приоритета ввода-вывода (ionice -c 2)
+IOPRIO_CLASS_BE = 2
+
+
+def default_worker_count() -> int:
+    """
+    Возвращает количество обработчиков по умолчанию.
+
+    libx264 сам распараллеливает кодирование на несколько потоков,
+    поэтому одновременно запускаем примерно одну задачу на 4 ядра.
+    """
+    return max(1, (os.cpu_count() or 1) // 4)
+
+
+def parse_cpu_list(spec: str) -> List[int]:
+    """Разбирает список процессоров в формате cpuset: '0-3,8,10-11'"""
+    cpus = set()
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-', 1)
+            cpus.update(range(int(first), int(last) + 1))
+        else:
+            cpus.add(int(part))
+    return sorted(cpus)
+
+
+def format_cpu_list(cpus: List[int]) -> str:
+    """Записывает список процессоров в формате cpuset"""
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ','.join(str(first) if first == last else f"{first}-{last}" for first, last in ranges)
+
+
+def cgroup_cpu_limit() -> Optional[int]:
+    """
+    Возвращает лимит процессорного времени cgroup в ядрах (с округлением вверх).
+
+    Читается cpu.max (cgroup v2) или cpu.cfs_quota_us/cpu.cfs_period_us
+    (cgroup v1).
+
+    Returns:
+        Количество ядер или None, если лимита нет
+    """
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()[:2]
+        if quota == 'max':
+            return None
+        return max(1, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    try:
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+            quota = int(f.read())
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+            period = int(f.read())
+        if quota <= 0 or period <= 0:
+            return None
+        return max(1, math.ceil(quota / period))
+    except (OSError, ValueError):
+        return None
+
+
+def available_cpus(spec: Optional[str] = None) -> List[int]:
+    """
+    Процессоры, доступные процессу.
+
+    Учитываются маска привязки процесса (в нее входит cpuset cgroup) и
+    лимит процессорного времени cgroup: при лимите в N ядер используются
+    первые N процессоров маски, и кодирование не упирается в троттлинг.
+
+    Args:
+        spec: Ограничить процессорами из списка в формате cpuset ('0-3,8')
+
+    Returns:
+        Отсортированный список номеров процессоров
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = sorted(os.sched_getaffinity(0))
+    else:
+        cpus = list(range(os.cpu_count() or 1))
+    if spec:
+        allowed = set(parse_cpu_list(spec))
+        cpus = [cpu for cpu in cpus if cpu in allowed]
+        if not cpus:
+            raise ValueError(f"Процессоры {spec} недоступны процессу")
+    limit = cgroup_cpu_limit()
+    if limit is not None and limit < len(cpus):
+        cpus = cpus[:limit]
+    return cpus
+
+
+class CPUPartitioner:
+    """
+    Разделение процессоров между одновременными задачами кодирования.
+
+    Первые reserved процессоров остаются веб-процессам (FFmpeg на них не
+    запускается), остальные делятся на slots непересекающихся наборов
+    соседних процессоров. Задача на время обработки получает наименее
+    занятый набор: ее процессы FFmpeg привязываются к нему
+    (taskset до exec FFmpeg, см. command_prefix), libx264 и фильтры получают
+    число потоков по его размеру, а приоритет процессора и ввода-вывода
+    понижается. Так
+    одновременные задачи не вытесняют друг друга, а веб-запросы не ждут
+    кодирования.
+
+    Разделение действует в пределах процесса: несколько процессов
+    обработчиков на одном сервере должны получить разные процессоры (cpus).
+    """
+
+    def __init__(self, cpus: List[int], slots: int, reserved: int = 1,
+                 nice: int = 10, io_priority: Optional[int] = 7):
+        """
+        Инициализирует разделение.
+
+        Args:
+            cpus: Доступные процессоры (available_cpus)
+            slots: Количество одновременных задач (наборов процессоров)
+            reserved: Процессоров для веб-процессов; не резервируются, если
+                иначе кодированию ничего не останется
+            nice: Приращение nice процессов FFmpeg (0 - не менять)
+            io_priority: Уровень best-effort приоритета ввода-вывода 0-7
+                (7 - самый низкий; None - не менять)
+        """
+        cpus = sorted(cpus)
+        reserved = reserved if len(cpus) > reserved else 0
+        self.reserved = cpus[:reserved]
+        pool = cpus[reserved:]
+        count = max(1, min(slots, len(pool)))
+        # Наборы соседних процессоров почти равного размера
+        self.sets = [
+            pool[index * len(pool) // count:(index + 1) * len(pool) // count]
+            for index in range(count)
+        ]
+        self.nice = nice
+        self.io_priority = io_priority
+
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._users = [0] * len(self.sets)
+        self._warned = set()
+        self._tools = {}
+
+    @contextmanager
+    def job(self, job_id: Optional[str]) -> Iterator[Optional[List[int]]]:
+        """
+        Выделяет задаче набор процессоров на время обработки.
+
+        Если задач больше, чем наборов, задача разделяет наименее занятый
+        набор. Без job_id процессы не привязываются.
+
+        Returns:
+            Процессоры задачи или None
+        """
+        if job_id is None:
+            yield None
+            return
+        with self._lock:
+            index = min(range(len(self.sets)), key=lambda i: self._users[i])
+            self._users[index] += 1
+            self._jobs[job_id] = index
+        try:
+            yield self.sets[index]
+        finally:
+            with self._lock:
+                self._users[index] -= 1
+                self._jobs.pop(job_id, None)
+
+    def cpus_for(self, job_id: Optional[str]) -> Optional[List[int]]:
+        """Возвращает процессоры задачи или None, если задача не зарегистрирована"""
+        with self._lock:
+            index = self._jobs.get(job_id)
+        return self.sets[index] if index is not None else None
+
+    def ffmpeg_args(self, cmd: List[str], job_id: Optional[str], parallel: int = 1) -> List[str]:
+        """
+        Добавляет в команду FFmpeg число потоков по набору процессоров задачи.
+
+        -threads ставится после каждого кодировщика видео (-c:v, кроме copy),
+        поэтому относится к libx264 своего выхода; число потоков фильтров
+        задается глобально.
+
+        Args:
+            cmd: Команда FFmpeg, начинающаяся с 'ffmpeg'
+            job_id: Задача, к которой относится процесс
+            parallel: Сколько процессов задачи работают одновременно (делят набор)
+
+        Returns:
+            Команда с ограничением потоков (без изменений, если у задачи нет набора)
+        """
+        cpus = self.cpus_for(job_id)
+        if cpus is None:
+            return cmd
+        threads = str(max(1, len(cpus) // max(1, parallel)))
+        result = cmd[:1] + ['-filter_threads', threads, '-filter_complex_threads', threads]
+        index = 1
+        while index < len(cmd):
+            result.append(cmd[index])
+            if cmd[index] == '-c:v' and index + 1 < len(cmd):
+                result.append(cmd[index + 1])
+                if cmd[index + 1] != 'copy':
+                    result.extend(['-threads', threads])
+                index += 1
+            index += 1
+        return result
+
+    def command_prefix(self, job_id: Optional[str]) -> List[str]:
+        """
+        Возвращает обертку команды FFmpeg задачи: taskset, nice и ionice.
+
+        Ограничения задаются утилитами, которые последовательно выполняют
+        exec друг друга и FFmpeg в том же процессе (pid не меняется, надзор
+        и wait4 работают как без обертки). Привязка и приоритеты действуют
+        до первой инструкции FFmpeg и наследуются всеми его потоками, а в
+        многопоточном процессе Python после fork не выполняется никакой
+        код (preexec_fn для этого небезопасен). Отсутствующая утилита
+        пропускается с предупреждением.
+
+        Returns:
+            Начало команды (пустой список, если у задачи нет набора)
+        """
+        cpus = self.cpus_for(job_id)
+        if cpus is None:
+            return []
+        prefix = []
+        if self._tool('taskset'):
+            prefix.extend([self._tools['taskset'], '-c', format_cpu_list(cpus)])
+        if self.nice and self._tool('nice'):
+            prefix.extend([self._tools['nice'], '-n', str(self.nice)])
+        if self.io_priority is not None and self._tool('ionice'):
+            prefix.extend([self._tools['ionice'], '-c', str(IOPRIO_CLASS_BE), '-n', str(self.io_priority)])
+        return prefix
+
+    def _tool(self, name: str) -> bool:
+        """Проверяет наличие утилиты (результат поиска запоминается)"""
+        if name not in self._tools:
+            self._tools[name] = shutil.which(name)
+        if self._tools[name] is None:
+            self._warn_once(name, f"Утилита {name} не найдена, ограничение процессов FFmpeg через нее не задается")
+            return False
+        return True
+
+    def _warn_once(self, key: str, message: str):
+        """Записывает предупреждение один раз за время жизни процесса"""
+        with self._lock:
+            if key in self._warned:
+                return
+            self._warned.add(key)
+        logger.warning(message)
+
+    def stats(self) -> Dict[str, Any]:
+        """Возвращает разделение процессоров и занятость наборов"""
+        with self._lock:
+            jobs = [[] for _ in self.sets]
+            for job_id, index in self._jobs.items():
+                jobs[index].append(job_id)
+        return {
+            'reserved': format_cpu_list(self.reserved),
+            'nice': self.nice,
+            'io_priority': self.io_priority,
+            'sets': [
+                {'cpus': format_cpu_list(cpus), 'threads': len(cpus), 'jobs': jobs[index]}
+                for index, cpus in enumerate(self.sets)
+            ]
+        }
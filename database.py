@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteDatabase:
+    """
+    Обертка над файлом SQLite, общая для нескольких процессов.
+
+    Каждому потоку выдается собственное соединение. База работает в режиме WAL,
+    поэтому чтение не блокируется записью, а несколько веб-процессов и
+    обработчиков могут безопасно использовать один файл.
+    """
+
+    def __init__(self, path: str, busy_timeout: float = 30.0):
+        """
+        Инициализирует базу данных.
+
+        Args:
+            path: Путь к файлу базы данных
+            busy_timeout: Время ожидания блокировки записи (в секундах)
+        """
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        # Режим WAL сохраняется в самом файле, достаточно включить его один раз
+        connection = self.connection()
+        connection.execute('PRAGMA journal_mode=WAL')
+
+    def connection(self) -> sqlite3.Connection:
+        """Возвращает соединение текущего потока"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(
+                self.path,
+                timeout=self.busy_timeout,
+                isolation_level=None  # Транзакциями управляем явно
+            )
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """
+        Открывает транзакцию записи.
+
+        BEGIN IMMEDIATE сразу захватывает блокировку записи, поэтому
+        операции чтение-изменение-запись внутри транзакции атомарны между процессами.
+        """
+        connection = self.connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        else:
+            connection.execute('COMMIT')
+
+    def executescript(self, script: str):
+        """Выполняет SQL-скрипт (например, создание схемы)"""
+        self.connection().executescript(script)
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+import os
+import re
+import subprocess
+import threading
+from typing import Any, Dict, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Профили кодирования libx264: от лучшего сжатия к наибольшей скорости.
+# bitrate_factor умножает битрейт горизонтального видео, vertical_crf задает
+# качество вертикального видео (кодируется с CRF). Быстрые пресеты сжимают
+# хуже, поэтому для сопоставимого качества им нужен больший битрейт, а
+# медленный пресет дает то же качество при меньшем. relative_cost - время
+# кодирования относительно balanced (начальная оценка модели стоимости до
+# первых замеров профиля). Число потоков в профиль не входит: его задает
+# CPUPartitioner по набору процессоров задачи
+PROFILES = {
+    'quality': {
+        'preset': 'slow',
+        'tune': None,
+        'rc_lookahead': 60,
+        'vertical_crf': 21,
+        'bitrate_factor': 0.9,
+        'relative_cost': 2.0
+    },
+    'balanced': {
+        # Параметры libx264 по умолчанию - так кодировались все видео до появления профилей
+        'preset': 'medium',
+        'tune': None,
+        'rc_lookahead': None,
+        'vertical_crf': 23,
+        'bitrate_factor': 1.0,
+        'relative_cost': 1.0
+    },
+    'fast': {
+        'preset': 'veryfast',
+        'tune': None,
+        'rc_lookahead': 20,
+        'vertical_crf': 23,
+        'bitrate_factor': 1.15,
+        'relative_cost': 0.45
+    },
+    'fastest': {
+        'preset': 'ultrafast',
+        'tune': 'fastdecode',
+        'rc_lookahead': 0,
+        'vertical_crf': 25,
+        'bitrate_factor': 1.4,
+        'relative_cost': 0.25
+    }
+}
+
+# Порядок профилей по возрастанию скорости
+PROFILE_ORDER = ['quality', 'balanced', 'fast', 'fastest']
+
+DEFAULT_PROFILE = 'balanced'
+
+_capabilities = None
+_capabilities_lock = threading.Lock()
+
+
+def _list_names(args: List[str], pattern: str) -> List[str]:
+    """Запускает ffmpeg и извлекает имена из списка (-encoders, -filters)"""
+    try:
+        result = subprocess.run(
+            ['ffmpeg', '-hide_banner'] + args, capture_output=True, text=True, check=True
+        )
+    except (OSError, subprocess.CalledProcessError) as e:
+        logger.warning(f"Не удалось получить возможности FFmpeg ({' '.join(args)}): {e}")
+        return []
+    return re.findall(pattern, result.stdout, re.MULTILINE)
+
+
+def ffmpeg_capabilities() -> Dict[str, Any]:
+    """
+    Возвращает возможности локальной сборки FFmpeg.
+
+    Сборка опрашивается один раз за время жизни процесса: список
+    кодировщиков, фильтров и параметров libx264.
+
+    Returns:
+        Словарь с ключами encoders, filters и x264_options (множества имен)
+    """
+    global _capabilities
+    with _capabilities_lock:
+        if _capabilities is None:
+            encoders = set(_list_names(['-encoders'], r'^\s[VAS][\w.]{5}\s+(\S+)'))
+            filters = set(_list_names(['-filters'], r'^\s[\w.]{2,3}\s+(\S+)\s'))
+            x264_options = set()
+            if 'libx264' in encoders:
+                x264_options = set(_list_names(['-h', 'encoder=libx264'], r'^\s+-([\w-]+)\s'))
+            _capabilities = {
+                'encoders': encoders,
+                'filters': filters,
+                'x264_options': x264_options
+            }
+            logger.info(
+                f"Возможности FFmpeg: кодировщиков {len(encoders)}, фильтров {len(filters)}, "
+                f"libx264 {'доступен' if 'libx264' in encoders else 'недоступен'}"
+            )
+        return _capabilities
+
+
+def build_profile_args(profile: Dict[str, Any]) -> List[str]:
+    """
+    Формирует параметры libx264 для профиля.
+
+    Параметры, которых нет в локальной сборке FFmpeg, пропускаются.
+
+    Args:
+        profile: Профиль из PROFILES
+
+    Returns:
+        Список аргументов FFmpeg
+    """
+    options = ffmpeg_capabilities()['x264_options']
+
+    def supported(option):
+        # Если параметры получить не удалось, полагаемся на стандартную сборку
+        return not options or option in options
+
+    args = []
+    if profile.get('preset') and supported('preset'):
+        args.extend(['-preset', profile['preset']])
+    if profile.get('tune') and supported('tune'):
+        args.extend(['-tune', profile['tune']])
+    if profile.get('rc_lookahead') is not None and supported('rc-lookahead'):
+        args.extend(['-rc-lookahead', str(profile['rc_lookahead'])])
+    return args
+
+
+class EncoderProfileSelector:
+    """
+    Выбор профиля кодирования для задачи.
+
+    В режиме 'auto' профиль выбирается по нагрузке: чем длиннее очередь
+    на один обработчик и чем выше средняя загрузка процессора, тем более
+    быстрый (и менее экономный по размеру) профиль. В простое используется
+    самый качественный профиль. Статистика по профилям считается по
+    записям задач (JobStore.profile_stats).
+    """
+
+    def __init__(self, mode: str = 'auto', thresholds: Optional[List[float]] = None):
+        """
+        Инициализирует выбор профиля.
+
+        Args:
+            mode: 'auto' или имя профиля из PROFILES
+            thresholds: Границы нагрузки для переключения на следующий по скорости
+                профиль (по одной на переход, всего len(PROFILE_ORDER) - 1)
+        """
+        if mode != 'auto' and mode not in PROFILES:
+            raise ValueError(f"Неизвестный профиль кодирования: {mode}")
+        self.mode = mode
+        self.thresholds = thresholds or [0.5, 1.5, 3.0]
+
+    @staticmethod
+    def current_load(queued_jobs: int, workers: int) -> float:
+        """
+        Оценивает нагрузку.
+
+        Returns:
+            Наибольшее из: задач в очереди на один обработчик и средней
+            загрузки процессора за минуту на одно ядро
+        """
+        load = queued_jobs / max(workers, 1)
+        try:
+            load = max(load, os.getloadavg()[0] / (os.cpu_count() or 1))
+        except (AttributeError, OSError):
+            pass
+        return load
+
+    def select(self, queued_jobs: int, workers: int, requested: Optional[str] = None) -> str:
+        """
+        Выбирает профиль для задачи.
+
+        Args:
+            queued_jobs: Количество задач в очереди
+            workers: Количество обработчиков
+            requested: Профиль, явно запрошенный для задачи
+
+        Returns:
+            Имя профиля
+        """
+        if requested and requested != 'auto':
+            return requested
+        if self.mode != 'auto':
+            return self.mode
+
+        load = self.current_load(queued_jobs, workers)
+        index = sum(1 for threshold in self.thresholds if load >= threshold)
+        return PROFILE_ORDER[min(index, len(PROFILE_ORDER) - 1)]
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Надзор за процессами FFmpeg.
+
+Процессы регистрируются в FFmpegSupervisor на время работы. Один фоновый
+поток следит за ними и завершает процесс, если от него долго нет прогресса
+(зависание) или если задача превысила лимит времени. Задачу можно отменить:
+все ее процессы FFmpeg завершаются, а новые не запускаются.
+"""
+import subprocess
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Iterator, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних строк stderr FFmpeg хранится для сообщения об ошибке
+STDERR_TAIL_LINES = 200
+# Максимальная длина одной сохраняемой строки stderr
+STDERR_LINE_LIMIT = 2000
+
+
+class FFmpegAbortedError(Exception):
+    """Процесс FFmpeg остановлен: задача отменена, FFmpeg завис или превышен лимит времени"""
+
+    def __init__(self, reason: str, message: str):
+        """
+        Args:
+            reason: 'cancelled', 'stalled' или 'timeout'
+            message: Сообщение для пользователя
+        """
+        super().__init__(message)
+        self.reason = reason
+
+
+class StderrTail:
+    """
+    Последние строки stderr ограниченного объема.
+
+    FFmpeg может писать предупреждения на протяжении многочасового
+    кодирования, поэтому весь вывод не накапливается: для сообщения
+    об ошибке достаточно его конца.
+    """
+
+    def __init__(self, max_lines: int = STDERR_TAIL_LINES, max_line_length: int = STDERR_LINE_LIMIT):
+        self.max_line_length = max_line_length
+        self.dropped = 0
+        self._lines = deque(maxlen=max_lines)
+
+    def feed(self, line: str):
+        """Добавляет строку, вытесняя самую старую при заполнении"""
+        if len(self._lines) == self._lines.maxlen:
+            self.dropped += 1
+        self._lines.append(line[:self.max_line_length])
+
+    def text(self) -> str:
+        """Возвращает сохраненный конец вывода"""
+        prefix = f"... пропущено строк: {self.dropped}\n" if self.dropped else ''
+        return prefix + ''.join(self._lines)
+
+
+class WatchedProcess:
+    """Процесс FFmpeg под надзором"""
+
+    def __init__(self, process: subprocess.Popen, job_id: Optional[str], deadline: Optional[float]):
+        self.process = process
+        self.job_id = job_id
+        self.deadline = deadline
+        self.last_activity = time.monotonic()
+        self.reason = None
+
+    def touch(self):
+        """Отмечает активность процесса (прогресс или переданные ему данные)"""
+        self.last_activity = time.monotonic()
+
+    def kill(self, reason: str):
+        """Завершает процесс, запоминая причину (вызывается под блокировкой надзора)"""
+        if self.reason is None:
+            self.reason = reason
+        try:
+            self.process.kill()
+        except OSError:
+            pass
+
+
+class FFmpegSupervisor:
+    """
+    Следит за процессами FFmpeg: зависания, лимит времени задачи и отмена.
+    """
+
+    MESSAGES = {
+        'cancelled': 'Задача отменена',
+        'stalled': 'FFmpeg перестал сообщать о прогрессе',
+        'timeout': 'Превышено максимальное время обработки'
+    }
+
+    def __init__(self, stall_timeout: float = 120, max_job_duration: Optional[float] = None,
+                 poll_interval: float = 1.0):
+        """
+        Инициализирует надзор.
+
+        Args:
+            stall_timeout: Через сколько секунд без прогресса процесс считается
+                зависшим (0 или None отключает проверку)
+            max_job_duration: Лимит времени обработки одной задачи в секундах
+                (для процессов вне задачи - лимит времени процесса); None - без лимита
+            poll_interval: Период проверки процессов в секундах
+        """
+        self.stall_timeout = stall_timeout
+        self.max_job_duration = max_job_duration
+        self.poll_interval = poll_interval
+
+        self._lock = threading.Lock()
+        self._watched = []
+        self._jobs = {}
+        self._cancelled = {}
+        self._monitor = None
+
+    @contextmanager
+    def job(self, job_id: Optional[str]) -> Iterator[None]:
+        """
+        Регистрирует задачу на время обработки.
+
+        С момента входа отсчитывается лимит времени задачи; процессы,
+        запущенные с этим job_id, завершаются вместе с ней при отмене.
+        """
+        if job_id is None:
+            yield
+            return
+        with self._lock:
+            self._jobs[job_id] = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._jobs.pop(job_id, None)
+                self._cancelled.pop(job_id, None)
+
+    def cancel(self, job_id: str):
+        """
+        Отменяет задачу: завершает ее процессы FFmpeg и запрещает запуск новых.
+
+        Отмена действует и на задачу, которая еще не успела запустить FFmpeg.
+        """
+        now = time.monotonic()
+        with self._lock:
+            # Отмены задач, которые так и не начались, со временем забываются
+            if self.max_job_duration:
+                for stale_id, cancelled_at in list(self._cancelled.items()):
+                    if now - cancelled_at > self.max_job_duration:
+                        del self._cancelled[stale_id]
+            self._cancelled[job_id] = now
+            for watched in self._watched:
+                if watched.job_id == job_id:
+                    watched.kill('cancelled')
+        logger.info(f"Задача {job_id} отменена")
+
+    def raise_if_cancelled(self, job_id: Optional[str]):
+        """
+        Raises:
+            FFmpegAbortedError: Если задача отменена
+        """
+        if job_id is not None:
+            with self._lock:
+                cancelled = job_id in self._cancelled
+            if cancelled:
+                raise FFmpegAbortedError('cancelled', self.MESSAGES['cancelled'])
+
+    def watch(self, process: subprocess.Popen, job_id: Optional[str] = None) -> WatchedProcess:
+        """
+        Ставит процесс под надзор.
+
+        Args:
+            process: Запущенный процесс FFmpeg
+            job_id: Задача, к которой относится процесс
+
+        Returns:
+            Описание процесса; после завершения процесса его нужно передать в release()
+        """
+        with self._lock:
+            started = self._jobs.get(job_id, time.monotonic())
+            deadline = started + self.max_job_duration if self.max_job_duration else None
+            watched = WatchedProcess(process, job_id, deadline)
+            self._watched.append(watched)
+            # Отмена могла прийти между проверкой и запуском процесса
+            if job_id in self._cancelled:
+                watched.kill('cancelled')
+            self._ensure_monitor()
+        return watched
+
+    def release(self, watched: WatchedProcess):
+        """
+        Снимает завершившийся процесс с надзора.
+
+        Raises:
+            FFmpegAbortedError: Если процесс был остановлен надзором
+        """
+        with self._lock:
+            if watched in self._watched:
+                self._watched.remove(watched)
+        if watched.reason is not None:
+            raise FFmpegAbortedError(watched.reason, self.MESSAGES[watched.reason])
+
+    def _ensure_monitor(self):
+        """Запускает поток проверки при первом процессе (вызывается под блокировкой)"""
+        if self._monitor is not None:
+            return
+        self._monitor = threading.Thread(target=self._monitor_loop, name='ffmpeg-supervisor', daemon=True)
+        self._monitor.start()
+
+    def _monitor_loop(self):
+        """Периодически проверяет процессы на зависание и превышение лимита времени"""
+        while True:
+            time.sleep(self.poll_interval)
+            now = time.monotonic()
+            with self._lock:
+                for watched in self._watched:
+                    if watched.reason is not None:
+                        continue
+                    if self.stall_timeout and now - watched.last_activity > self.stall_timeout:
+                        logger.error(
+                            f"FFmpeg (pid {watched.process.pid}) без прогресса {self.stall_timeout} с, "
+                            f"процесс завершается"
+                        )
+                        watched.kill('stalled')
+                    elif watched.deadline is not None and now > watched.deadline:
+                        logger.error(
+                            f"Превышен лимит времени задачи {watched.job_id} "
+                            f"(pid {watched.process.pid}), процесс завершается"
+                        )
+                        watched.kill('timeout')
@@ -0,0 +1,685 @@
+#!/usr/bin/env python3
+"""
+Долговременная очередь задач конвертации на SQLite.
+
+Очередь хранится в той же базе, что и задачи, поэтому ее разбирают все
+обработчики, которым доступен файл базы: потоки веб-процессов и отдельные
+процессы worker.py на этом же сервере или на серверах с общим хранилищем.
+
+Задачи выдаются в порядке оценки времени обработки (сначала короткие), но
+оценка уменьшается со временем ожидания, поэтому длинные задачи не ждут
+бесконечно. Задача выдается обработчику в аренду (lease) на ограниченное время, которое
+обработчик продлевает, пока задача выполняется. Если обработчик завершился
+аварийно, аренда истекает и задачу забирает другой. Неудачные попытки
+повторяются с задержкой; задача, исчерпавшая попытки, переводится в
+dead-letter и больше не выдается.
+"""
+import heapq
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import logging
+
+from database import SQLiteDatabase
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Очередь конвертации переполнена"""
+
+    def __init__(self, retry_after: int):
+        super().__init__('Очередь конвертации переполнена')
+        self.retry_after = retry_after
+
+
+class Lease:
+    """Задача, выданная обработчику в аренду"""
+
+    def __init__(self, job_id: str, payload: Dict[str, Any], attempts: int, max_attempts: int,
+                 enqueued_at: float, worker_id: str, estimated_cost: float = 0):
+        self.job_id = job_id
+        self.payload = payload
+        self.attempts = attempts
+        self.max_attempts = max_attempts
+        self.enqueued_at = enqueued_at
+        self.worker_id = worker_id
+        self.estimated_cost = estimated_cost
+        self.leased_at = time.time()
+        # Аренда перешла к другому обработчику (не удалось продлить вовремя)
+        self.lost = False
+        # Задачу отменили через API
+        self.cancel_requested = False
+        # Ошибку попытки исправит повтор; обработчик сбрасывает флаг для
+        # ошибок самого файла, и задача сразу переходит в dead-letter
+        self.retryable = True
+
+    @property
+    def final_attempt(self) -> bool:
+        """Последняя ли это попытка: после неудачи задача уйдет в dead-letter"""
+        return self.attempts >= self.max_attempts or not self.retryable
+
+
+class SQLiteJobQueue:
+    """
+    Очередь задач с арендой, повторами и dead-letter.
+
+    Состояния задачи: 'ready' (ожидает), 'leased' (выполняется) и 'dead'
+    (попытки исчерпаны). Все переходы выполняются в транзакциях BEGIN
+    IMMEDIATE, поэтому одну задачу не получат два обработчика.
+
+    Порядок выдачи - наименьшая оценка времени обработки за вычетом
+    ожидания, умноженного на aging_rate. Вычитаемое растет одинаково для
+    всех задач, поэтому порядок задается постоянным ключом
+    priority = estimated_cost + aging_rate * enqueued_at, который хранится
+    в индексируемой колонке. Задача с оценкой C ждет более коротких не
+    дольше C / aging_rate.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS job_queue (
+            job_id TEXT PRIMARY KEY,
+            payload TEXT NOT NULL,
+            state TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            enqueued_at REAL NOT NULL,
+            available_at REAL NOT NULL,
+            lease_owner TEXT,
+            leased_at REAL,
+            lease_expires REAL,
+            cancel_requested INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            updated REAL NOT NULL,
+            estimated_cost REAL NOT NULL DEFAULT 0,
+            priority REAL NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS job_queue_state_enqueued ON job_queue (state, enqueued_at);
+
+        CREATE TABLE IF NOT EXISTS queue_workers (
+            worker_id TEXT PRIMARY KEY,
+            host TEXT NOT NULL,
+            pid INTEGER NOT NULL,
+            started REAL NOT NULL,
+            last_seen REAL NOT NULL,
+            job_id TEXT
+        );
+
+        CREATE TABLE IF NOT EXISTS queue_meta (
+            key TEXT PRIMARY KEY,
+            value REAL NOT NULL
+        );
+    """
+
+    # Колонки, добавленные после первой версии схемы
+    MIGRATIONS = {
+        'estimated_cost': 'ALTER TABLE job_queue ADD COLUMN estimated_cost REAL NOT NULL DEFAULT 0',
+        'priority': 'ALTER TABLE job_queue ADD COLUMN priority REAL NOT NULL DEFAULT 0'
+    }
+
+    def __init__(self, path: str, lease_seconds: float = 60, max_attempts: int = 3,
+                 retry_delay: float = 30, max_size: int = 100, aging_rate: float = 1.0):
+        """
+        Инициализирует очередь.
+
+        Args:
+            path: Путь к файлу базы данных SQLite
+            lease_seconds: Срок аренды; обработчик продлевает ее, пока задача выполняется
+            max_attempts: Количество попыток, после которого задача уходит в dead-letter
+            retry_delay: Задержка перед повторной попыткой (растет с номером попытки)
+            max_size: Максимальное количество ожидающих задач
+            aging_rate: На сколько секунд оценки уменьшается приоритетный ключ
+                за секунду ожидания (0 - строго короткие задачи первыми)
+        """
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_size = max_size
+        self.aging_rate = aging_rate
+        self.db = SQLiteDatabase(path)
+        self.db.executescript(self.SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        """Добавляет колонки, которых нет в базе, созданной предыдущей версией"""
+        with self.db.transaction() as connection:
+            columns = {row['name'] for row in connection.execute('PRAGMA table_info(job_queue)').fetchall()}
+            for column, statement in self.MIGRATIONS.items():
+                if column not in columns:
+                    connection.execute(statement)
+                    if column == 'priority':
+                        connection.execute('UPDATE job_queue SET priority = ? * enqueued_at', (self.aging_rate,))
+            connection.execute('CREATE INDEX IF NOT EXISTS job_queue_state_priority ON job_queue (state, priority)')
+
+    def enqueue(self, job_id: str, payload: Dict[str, Any], estimated_cost: float = 0):
+        """
+        Ставит задачу в очередь.
+
+        Args:
+            job_id: Идентификатор задачи
+            payload: Данные задачи для обработчика
+            estimated_cost: Оценка времени обработки в секундах (0 у всех
+                задач дает порядок поступления)
+
+        Raises:
+            QueueFullError: Если очередь заполнена
+        """
+        self.enqueue_many([(job_id, payload, estimated_cost)])
+
+    def enqueue_many(self, items: List[Tuple[str, Dict[str, Any], float]], max_size: Optional[int] = None):
+        """
+        Ставит в очередь несколько задач одной транзакцией: все или ни одной.
+
+        Args:
+            items: Кортежи (job_id, данные, оценка времени обработки)
+            max_size: Лимит ожидающих задач для этой постановки (по умолчанию max_size очереди)
+
+        Raises:
+            QueueFullError: Если все задачи не помещаются в очередь
+        """
+        limit = self.max_size if max_size is None else max_size
+        now = time.time()
+        with self.db.transaction() as connection:
+            ready = connection.execute(
+                "SELECT COUNT(*) FROM job_queue WHERE state = 'ready'"
+            ).fetchone()[0]
+            if ready + len(items) > limit:
+                raise QueueFullError(self._estimate_retry_after(connection))
+            connection.executemany(
+                'INSERT INTO job_queue (job_id, payload, state, enqueued_at, available_at, updated, '
+                'estimated_cost, priority) '
+                "VALUES (?, ?, 'ready', ?, ?, ?, ?, ?) "
+                "ON CONFLICT (job_id) DO UPDATE SET payload = excluded.payload, state = 'ready', "
+                'attempts = 0, available_at = excluded.available_at, lease_owner = NULL, '
+                'lease_expires = NULL, cancel_requested = 0, last_error = NULL, updated = excluded.updated, '
+                'estimated_cost = excluded.estimated_cost, priority = excluded.priority',
+                [
+                    (job_id, json.dumps(payload, ensure_ascii=False), now, now, now,
+                     estimated_cost, estimated_cost + self.aging_rate * now)
+                    for job_id, payload, estimated_cost in items
+                ]
+            )
+
+    def lease(self, worker_id: str) -> Optional[Lease]:
+        """
+        Выдает следующую задачу в аренду.
+
+        Выдаются ожидающие задачи, время повтора которых наступило, и задачи
+        с истекшей арендой (обработчик завершился аварийно), если у них
+        остались попытки, - с наименьшим приоритетным ключом.
+
+        Returns:
+            Аренда или None, если задач нет
+        """
+        now = time.time()
+        with self.db.transaction() as connection:
+            row = connection.execute(
+                "SELECT * FROM job_queue "
+                "WHERE (state = 'ready' AND available_at <= ?) "
+                "OR (state = 'leased' AND lease_expires < ? AND attempts < ?) "
+                'ORDER BY priority LIMIT 1',
+                (now, now, self.max_attempts)
+            ).fetchone()
+            if row is None:
+                return None
+            if row['state'] == 'leased':
+                logger.warning(f"Аренда задачи {row['job_id']} истекла у {row['lease_owner']}, задача выдается повторно")
+            connection.execute(
+                "UPDATE job_queue SET state = 'leased', attempts = attempts + 1, lease_owner = ?, "
+                'leased_at = ?, lease_expires = ?, updated = ? WHERE job_id = ?',
+                (worker_id, now, now + self.lease_seconds, now, row['job_id'])
+            )
+        return Lease(
+            row['job_id'], json.loads(row['payload']), row['attempts'] + 1, self.max_attempts,
+            row['enqueued_at'], worker_id, row['estimated_cost']
+        )
+
+    def heartbeat(self, lease: Lease) -> bool:
+        """
+        Продлевает аренду.
+
+        Заодно отмечает в lease запрос отмены задачи и потерю аренды.
+
+        Returns:
+            True, если аренда продлена
+        """
+        now = time.time()
+        with self.db.transaction() as connection:
+            cursor = connection.execute(
+                "UPDATE job_queue SET lease_expires = ?, updated = ? "
+                "WHERE job_id = ? AND state = 'leased' AND lease_owner = ?",
+                (now + self.lease_seconds, now, lease.job_id, lease.worker_id)
+            )
+            if cursor.rowcount == 0:
+                lease.lost = True
+                return False
+            row = connection.execute(
+                'SELECT cancel_requested FROM job_queue WHERE job_id = ?', (lease.job_id,)
+            ).fetchone()
+        lease.cancel_requested = bool(row['cancel_requested'])
+        return True
+
+    def complete(self, lease: Lease):
+        """Удаляет выполненную (или отмененную) задачу из очереди"""
+        now = time.time()
+        with self.db.transaction() as connection:
+            cursor = connection.execute(
+                "DELETE FROM job_queue WHERE job_id = ? AND state = 'leased' AND lease_owner = ?",
+                (lease.job_id, lease.worker_id)
+            )
+            if cursor.rowcount:
+                # Скользящее среднее длительности задачи для оценки Retry-After
+                duration = now - lease.leased_at
+                connection.execute(
+                    "INSERT INTO queue_meta (key, value) VALUES ('avg_duration', ?) "
+                    'ON CONFLICT (key) DO UPDATE SET value = value * 0.8 + excluded.value * 0.2',
+                    (duration,)
+                )
+
+    def fail(self, lease: Lease, error: str) -> bool:
+        """
+        Отмечает неудачную попытку.
+
+        Задача возвращается в очередь с задержкой, а после последней
+        попытки или ошибки, которую повтор не исправит (lease.retryable),
+        переводится в dead-letter.
+
+        Returns:
+            True, если задача переведена в dead-letter
+        """
+        now = time.time()
+        dead = lease.final_attempt
+        with self.db.transaction() as connection:
+            if dead:
+                cursor = connection.execute(
+                    "UPDATE job_queue SET state = 'dead', lease_owner = NULL, lease_expires = NULL, "
+                    "last_error = ?, updated = ? WHERE job_id = ? AND state = 'leased' AND lease_owner = ?",
+                    (error, now, lease.job_id, lease.worker_id)
+                )
+            else:
+                cursor = connection.execute(
+                    "UPDATE job_queue SET state = 'ready', lease_owner = NULL, lease_expires = NULL, "
+                    "available_at = ?, last_error = ?, updated = ? "
+                    "WHERE job_id = ? AND state = 'leased' AND lease_owner = ?",
+                    (now + self.retry_delay * lease.attempts, error, now, lease.job_id, lease.worker_id)
+                )
+        if cursor.rowcount == 0:
+            lease.lost = True
+            return False
+        return dead
+
+    def reap_expired(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        Переводит в dead-letter задачи с истекшей арендой и исчерпанными попытками.
+
+        Так обрабатываются файлы, на которых обработчик раз за разом
+        завершается аварийно и не успевает сообщить о неудаче.
+
+        Returns:
+            Список (job_id, payload) переведенных задач
+        """
+        now = time.time()
+        with self.db.transaction() as connection:
+            rows = connection.execute(
+                "SELECT job_id, payload FROM job_queue "
+                "WHERE state = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (now, self.max_attempts)
+            ).fetchall()
+            for row in rows:
+                connection.execute(
+                    "UPDATE job_queue SET state = 'dead', lease_owner = NULL, lease_expires = NULL, "
+                    "last_error = 'Аренда истекла на последней попытке', updated = ? WHERE job_id = ?",
+                    (now, row['job_id'])
+                )
+        return [(row['job_id'], json.loads(row['payload'])) for row in rows]
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Удаляет из очереди задачу, которая еще не выполняется.
+
+        Returns:
+            Данные задачи или None, если ожидающей задачи нет
+        """
+        with self.db.transaction() as connection:
+            row = connection.execute(
+                "SELECT payload FROM job_queue WHERE job_id = ? AND state = 'ready'", (job_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute('DELETE FROM job_queue WHERE job_id = ?', (job_id,))
+        return json.loads(row['payload'])
+
+    def request_cancel(self, job_id: str) -> bool:
+        """
+        Запрашивает отмену выполняющейся задачи.
+
+        Обработчик узнает о запросе при следующем продлении аренды.
+
+        Returns:
+            True, если задача сейчас выполняется
+        """
+        with self.db.transaction() as connection:
+            cursor = connection.execute(
+                "UPDATE job_queue SET cancel_requested = 1 WHERE job_id = ? AND state = 'leased'",
+                (job_id,)
+            )
+            return cursor.rowcount > 0
+
+    def position(self, job_id: str) -> Optional[int]:
+        """
+        Возвращает позицию задачи в очереди (1 - следующая на выполнение).
+
+        Returns:
+            Позиция или None, если задача не ожидает выполнения
+        """
+        connection = self.db.connection()
+        row = connection.execute(
+            "SELECT priority FROM job_queue WHERE job_id = ? AND state = 'ready'", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return len(self._ahead(connection, row['priority'], time.time())) + 1
+
+    @staticmethod
+    def _ahead(connection, priority: float, now: float) -> list:
+        """
+        Ожидающие задачи, которые будут выданы раньше задачи с ключом priority.
+
+        Общее правило для position и forecast: впереди задачи со строго
+        меньшим ключом. Задачи, ожидающие повтора (available_at в будущем),
+        lease сейчас не выдает, поэтому они не считаются впереди.
+
+        Returns:
+            Строки с estimated_cost в порядке выдачи
+        """
+        return connection.execute(
+            "SELECT estimated_cost FROM job_queue WHERE state = 'ready' AND available_at <= ? "
+            'AND priority < ? ORDER BY priority',
+            (now, priority)
+        ).fetchall()
+
+    def forecast(self, job_id: str) -> Optional[Dict[str, float]]:
+        """
+        Прогнозирует начало и завершение задачи по оценкам времени обработки.
+
+        Ожидающие задачи раздаются в порядке очереди тому обработчику,
+        который освободится первым; выполняющиеся задачи занимают
+        обработчиков на оставшуюся часть своей оценки.
+
+        Returns:
+            Словарь estimated_seconds, predicted_start и predicted_finish
+            (время Unix) или None, если задачи нет в очереди
+        """
+        now = time.time()
+        connection = self.db.connection()
+        row = connection.execute(
+            'SELECT state, estimated_cost, priority, leased_at, available_at FROM job_queue WHERE job_id = ?',
+            (job_id,)
+        ).fetchone()
+        if row is None or row['state'] == 'dead':
+            return None
+
+        cost = row['estimated_cost']
+        if row['state'] == 'leased':
+            start = row['leased_at']
+            return {
+                'estimated_seconds': cost,
+                'predicted_start': start,
+                'predicted_finish': max(now, start + cost)
+            }
+
+        # Время освобождения каждого обработчика
+        free_at = [
+            now + max(0.0, active['estimated_cost'] - (now - active['leased_at']))
+            for active in connection.execute(
+                "SELECT estimated_cost, leased_at FROM job_queue WHERE state = 'leased'"
+            ).fetchall()
+        ]
+        workers = max(self._live_workers(connection), 1)
+        free_at = sorted(free_at)[:workers] + [now] * max(0, workers - len(free_at))
+        heapq.heapify(free_at)
+
+        for pending in self._ahead(connection, row['priority'], now):
+            heapq.heappush(free_at, heapq.heappop(free_at) + pending['estimated_cost'])
+
+        # Задача, ожидающая повтора, не начнется раньше своего available_at
+        start = max(free_at[0], row['available_at'])
+        return {
+            'estimated_seconds': cost,
+            'predicted_start': start,
+            'predicted_finish': start + cost
+        }
+
+    def pending_payloads(self) -> List[Dict[str, Any]]:
+        """Возвращает данные ожидающих и выполняющихся задач"""
+        rows = self.db.connection().execute(
+            "SELECT payload FROM job_queue WHERE state IN ('ready', 'leased')"
+        ).fetchall()
+        return [json.loads(row['payload']) for row in rows]
+
+    def is_full(self) -> bool:
+        """Проверяет, заполнена ли очередь"""
+        return self.stats()['queued_jobs'] >= self.max_size
+
+    def retry_after(self) -> int:
+        """Рекомендуемая задержка (в секундах) перед повторной попыткой"""
+        return self._estimate_retry_after(self.db.connection())
+
+    def _estimate_retry_after(self, connection) -> int:
+        """Оценивает время освобождения места в очереди по средней длительности задачи"""
+        row = connection.execute("SELECT value FROM queue_meta WHERE key = 'avg_duration'").fetchone()
+        if row is None:
+            return 30
+        workers = self._live_workers(connection)
+        # Место в очереди освободится, когда любой из обработчиков возьмет следующую задачу
+        return max(1, int(row['value'] / max(workers, 1)))
+
+    def _live_workers(self, connection) -> int:
+        """Количество обработчиков, отметившихся в пределах срока аренды"""
+        return connection.execute(
+            'SELECT COUNT(*) FROM queue_workers WHERE last_seen >= ?',
+            (time.time() - self.lease_seconds,)
+        ).fetchone()[0]
+
+    def stats(self) -> Dict[str, int]:
+        """Возвращает состояние очереди и количество активных обработчиков"""
+        connection = self.db.connection()
+        counts = {
+            row['state']: row['jobs']
+            for row in connection.execute(
+                'SELECT state, COUNT(*) AS jobs FROM job_queue GROUP BY state'
+            ).fetchall()
+        }
+        return {
+            'workers': self._live_workers(connection),
+            'active_jobs': counts.get('leased', 0),
+            'queued_jobs': counts.get('ready', 0),
+            'dead_jobs': counts.get('dead', 0),
+            'max_queue_size': self.max_size
+        }
+
+    def dead_letters(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """Возвращает последние задачи из dead-letter с причиной неудачи"""
+        rows = self.db.connection().execute(
+            "SELECT job_id, payload, attempts, last_error, updated FROM job_queue "
+            "WHERE state = 'dead' ORDER BY updated DESC LIMIT ?", (limit,)
+        ).fetchall()
+        return [
+            {
+                'job_id': row['job_id'],
+                'payload': json.loads(row['payload']),
+                'attempts': row['attempts'],
+                'error': row['last_error'],
+                'updated': row['updated']
+            }
+            for row in rows
+        ]
+
+    def delete_dead_older_than(self, timestamp: float) -> List[Dict[str, Any]]:
+        """
+        Удаляет старые задачи из dead-letter.
+
+        Returns:
+            Данные удаленных задач (например, для удаления их файлов)
+        """
+        with self.db.transaction() as connection:
+            rows = connection.execute(
+                "SELECT payload FROM job_queue WHERE state = 'dead' AND updated < ?", (timestamp,)
+            ).fetchall()
+            connection.execute("DELETE FROM job_queue WHERE state = 'dead' AND updated < ?", (timestamp,))
+        return [json.loads(row['payload']) for row in rows]
+
+    def register_worker(self, worker_id: str, job_id: Optional[str] = None):
+        """Отмечает, что обработчик жив (и какую задачу выполняет)"""
+        now = time.time()
+        with self.db.transaction() as connection:
+            connection.execute(
+                'INSERT INTO queue_workers (worker_id, host, pid, started, last_seen, job_id) '
+                'VALUES (?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (worker_id) DO UPDATE SET last_seen = excluded.last_seen, job_id = excluded.job_id',
+                (worker_id, socket.gethostname(), os.getpid(), now, now, job_id)
+            )
+
+    def unregister_worker(self, worker_id: str):
+        """Удаляет обработчик из списка активных"""
+        with self.db.transaction() as connection:
+            connection.execute('DELETE FROM queue_workers WHERE worker_id = ?', (worker_id,))
+
+
+class QueueWorker:
+    """
+    Обработчики очереди: потоки, которые берут задачи в аренду и выполняют их.
+
+    Пока задача выполняется, отдельный поток продлевает аренду. Если задачу
+    отменили через API или аренда потеряна, вызывается on_cancel, который
+    должен остановить обработку.
+    """
+
+    def __init__(self, queue: SQLiteJobQueue, handler: Callable[[Lease], Optional[str]],
+                 on_dead_letter: Callable[[str, Dict[str, Any], str], None],
+                 on_cancel: Callable[[str], None],
+                 heartbeat_interval: float = 10, poll_interval: float = 1.0):
+        """
+        Инициализирует обработчики.
+
+        Args:
+            queue: Очередь задач
+            handler: Выполняет задачу; возвращает None при успехе (или отмене)
+                либо сообщение об ошибке, если попытка не удалась (и сбрасывает
+                lease.retryable, если повтор бесполезен)
+            on_dead_letter: Вызывается для задачи, переведенной в dead-letter:
+                on_dead_letter(job_id, payload, error)
+            on_cancel: Вызывается, когда выполняющуюся задачу нужно остановить
+            heartbeat_interval: Период продления аренды в секундах (должен быть
+                заметно меньше срока аренды)
+            poll_interval: Период опроса пустой очереди в секундах
+        """
+        self.queue = queue
+        self.handler = handler
+        self.on_dead_letter = on_dead_letter
+        self.on_cancel = on_cancel
+        self.heartbeat_interval = heartbeat_interval
+        self.poll_interval = poll_interval
+
+        self._stop = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def start(self, count: int):
+        """Запускает count фоновых потоков-обработчиков (повторный вызов ничего не делает)"""
+        with self._lock:
+            if self._threads:
+                return
+            for index in range(count):
+                worker_id = f"{socket.gethostname()}:{os.getpid()}:{index}:{uuid.uuid4().hex[:8]}"
+                thread = threading.Thread(
+                    target=self._worker_loop, args=(worker_id,), name=f"queue-worker-{index}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+        logger.info(f"Запущено обработчиков очереди: {count}")
+
+    def stop(self):
+        """Просит обработчики завершиться после текущих задач"""
+        self._stop.set()
+
+    def join(self):
+        """Ожидает завершения обработчиков"""
+        for thread in self._threads:
+            thread.join()
+
+    def _worker_loop(self, worker_id: str):
+        """Основной цикл обработчика"""
+        self.queue.register_worker(worker_id)
+        last_seen = time.monotonic()
+        try:
+            while not self._stop.is_set():
+                try:
+                    for job_id, payload in self.queue.reap_expired():
+                        logger.error(f"Задача {job_id} переведена в dead-letter: аренда истекла на последней попытке")
+                        self.on_dead_letter(job_id, payload, 'Обработчик аварийно завершился при обработке файла')
+
+                    lease = self.queue.lease(worker_id)
+                except Exception as e:
+                    logger.error(f"Ошибка очереди задач: {e}")
+                    lease = None
+
+                if lease is None:
+                    if time.monotonic() - last_seen >= self.heartbeat_interval:
+                        self.queue.register_worker(worker_id)
+                        last_seen = time.monotonic()
+                    self._stop.wait(self.poll_interval)
+                    continue
+
+                self._run(lease)
+                last_seen = time.monotonic()
+        finally:
+            self.queue.unregister_worker(worker_id)
+
+    def _run(self, lease: Lease):
+        """Выполняет задачу, продлевая аренду в отдельном потоке"""
+        metrics.QUEUE_WAIT.observe(max(0.0, lease.leased_at - lease.enqueued_at))
+        self.queue.register_worker(lease.worker_id, lease.job_id)
+
+        finished = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat_loop, args=(lease, finished), daemon=True)
+        heartbeat.start()
+        try:
+            error = self.handler(lease)
+        except Exception as e:
+            logger.error(f"Необработанная ошибка в задаче {lease.job_id}: {e}")
+            error = str(e)
+        finally:
+            finished.set()
+            heartbeat.join()
+
+        try:
+            if error is None:
+                self.queue.complete(lease)
+            elif self.queue.fail(lease, error):
+                logger.error(f"Задача {lease.job_id} переведена в dead-letter после попытки {lease.attempts}: {error}")
+                self.on_dead_letter(lease.job_id, lease.payload, error)
+            elif not lease.lost:
+                logger.warning(f"Попытка {lease.attempts} задачи {lease.job_id} не удалась, задача будет повторена")
+            self.queue.register_worker(lease.worker_id)
+        except Exception as e:
+            logger.error(f"Ошибка очереди задач при завершении {lease.job_id}: {e}")
+
+    def _heartbeat_loop(self, lease: Lease, finished: threading.Event):
+        """Продлевает аренду, пока задача выполняется"""
+        while not finished.wait(self.heartbeat_interval):
+            try:
+                renewed = self.queue.heartbeat(lease)
+                self.queue.register_worker(lease.worker_id, lease.job_id)
+            except Exception as e:
+                logger.warning(f"Не удалось продлить аренду задачи {lease.job_id}: {e}")
+                continue
+            if not renewed:
+                logger.error(f"Аренда задачи {lease.job_id} потеряна, обработка останавливается")
+            if not renewed or lease.cancel_requested:
+                self.on_cancel(lease.job_id)
+                return
@@ -0,0 +1,455 @@
+#!/usr/bin/env python3
+import copy
+import json
+import threading
+from typing import Any, Dict, List, Optional
+import logging
+
+from database import SQLiteDatabase
+
+logger = logging.getLogger(__name__)
+
+# Статусы задач, которые еще не завершены
+PENDING_STATUSES = ('uploaded', 'queued', 'processing')
+
+# Итоговые статусы задач
+FINISHED_STATUSES = ('completed', 'error', 'cancelled')
+
+
+class JobStore:
+    """
+    Базовый интерфейс хранилища задач конвертации.
+
+    Запись задачи - это словарь, который обязательно содержит поле 'status'
+    и обычно 'upload_time' и 'file_size'.
+    """
+
+    def create(self, job_id: str, record: Dict[str, Any]):
+        """Создает запись о задаче"""
+        raise NotImplementedError
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Возвращает копию записи о задаче или None"""
+        raise NotImplementedError
+
+    def update(self, job_id: str, fields: Dict[str, Any]):
+        """Обновляет поля записи о задаче"""
+        raise NotImplementedError
+
+    def delete(self, job_id: str):
+        """Удаляет запись о задаче"""
+        raise NotImplementedError
+
+    def recent_completed(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """Возвращает последние завершенные задачи (новые сверху)"""
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Возвращает агрегированную статистику.
+
+        Returns:
+            Словарь с ключами total_jobs, completed_jobs, error_jobs,
+            pending_jobs, total_size и avg_processing_time
+        """
+        raise NotImplementedError
+
+    def profile_stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Возвращает статистику завершенных конвертаций по профилям кодирования.
+
+        Учитываются задачи с сохраненными encoder_profile и processing_time
+        (результаты из кеша не учитываются).
+
+        Returns:
+            Для каждого профиля: число задач, среднее время обработки,
+            пропускная способность (секунд видео за секунду обработки) и
+            суммарный размер результатов в МБ
+        """
+        raise NotImplementedError
+
+    def delete_older_than(self, timestamp: float) -> int:
+        """
+        Удаляет задачи, загруженные раньше указанного момента, и пакеты,
+        созданные раньше него.
+
+        Returns:
+            Количество удаленных записей о задачах
+        """
+        raise NotImplementedError
+
+    def get_many(self, job_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Возвращает копии записей о задачах по идентификаторам (отсутствующие пропускаются)"""
+        raise NotImplementedError
+
+    def create_batch(self, batch_id: str, record: Dict[str, Any]):
+        """
+        Создает запись о пакете задач.
+
+        Запись обязательно содержит 'created' и 'job_ids'.
+        """
+        raise NotImplementedError
+
+    def get_batch(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        """Возвращает копию записи о пакете или None"""
+        raise NotImplementedError
+
+
+def _summarize_counters(counters: Dict[str, Dict[str, float]]) -> Dict[str, Any]:
+    """Собирает статистику из счетчиков, сгруппированных по статусу"""
+    completed = counters.get('completed', {})
+    time_count = completed.get('processing_time_count', 0)
+    return {
+        'total_jobs': int(sum(row['jobs'] for row in counters.values())),
+        'completed_jobs': int(completed.get('jobs', 0)),
+        'error_jobs': int(counters.get('error', {}).get('jobs', 0)),
+        'cancelled_jobs': int(counters.get('cancelled', {}).get('jobs', 0)),
+        'pending_jobs': int(sum(counters.get(status, {}).get('jobs', 0) for status in PENDING_STATUSES)),
+        'total_size': int(sum(row['bytes'] for row in counters.values())),
+        'avg_processing_time': completed.get('processing_time_sum', 0) / time_count if time_count else 0
+    }
+
+
+def _summarize_profiles(rows: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Собирает статистику профилей из сумм, сгруппированных по профилю"""
+    return {
+        row['profile']: {
+            'jobs': int(row['jobs']),
+            'avg_processing_time': row['processing_seconds'] / row['jobs'],
+            'realtime_factor': (
+                row['media_seconds'] / row['processing_seconds'] if row['processing_seconds'] else 0
+            ),
+            'output_mb': row['output_bytes'] / (1024 * 1024)
+        }
+        for row in rows if row['jobs']
+    }
+
+
+def _profile_sample(record: Dict[str, Any]) -> bool:
+    """Учитывается ли задача в статистике профилей"""
+    return (
+        record['status'] == 'completed'
+        and record.get('encoder_profile') is not None
+        and record.get('processing_time') is not None
+        and not record.get('cache_hit')
+    )
+
+
+class MemoryJobStore(JobStore):
+    """
+    Хранилище задач в памяти процесса.
+
+    Подходит для разработки и одного процесса: данные теряются при перезапуске.
+    """
+
+    def __init__(self):
+        self._jobs = {}
+        self._batches = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def _count(self, record: Dict[str, Any], sign: int):
+        """Учитывает запись в счетчиках (sign = 1 или -1)"""
+        row = self._counters.setdefault(record['status'], {
+            'jobs': 0, 'bytes': 0, 'processing_time_sum': 0.0, 'processing_time_count': 0
+        })
+        row['jobs'] += sign
+        row['bytes'] += sign * record.get('file_size', 0)
+        if record.get('processing_time') is not None:
+            row['processing_time_sum'] += sign * record['processing_time']
+            row['processing_time_count'] += sign
+
+    def create(self, job_id, record):
+        with self._lock:
+            self._jobs[job_id] = copy.deepcopy(record)
+            self._count(self._jobs[job_id], 1)
+
+    def get(self, job_id):
+        with self._lock:
+            record = self._jobs.get(job_id)
+            return copy.deepcopy(record) if record is not None else None
+
+    def update(self, job_id, fields):
+        with self._lock:
+            record = self._jobs.get(job_id)
+            if record is None:
+                return
+            self._count(record, -1)
+            record.update(copy.deepcopy(fields))
+            self._count(record, 1)
+
+    def delete(self, job_id):
+        with self._lock:
+            record = self._jobs.pop(job_id, None)
+            if record is not None:
+                self._count(record, -1)
+
+    def recent_completed(self, limit=10):
+        with self._lock:
+            completed = [
+                dict(record, job_id=job_id)
+                for job_id, record in self._jobs.items()
+                if record['status'] == 'completed'
+            ]
+        completed.sort(key=lambda record: record.get('upload_time', 0), reverse=True)
+        return copy.deepcopy(completed[:limit])
+
+    def stats(self):
+        with self._lock:
+            return _summarize_counters(self._counters)
+
+    def profile_stats(self):
+        rows = {}
+        with self._lock:
+            for record in self._jobs.values():
+                if not _profile_sample(record):
+                    continue
+                row = rows.setdefault(record['encoder_profile'], {
+                    'profile': record['encoder_profile'], 'jobs': 0, 'media_seconds': 0.0,
+                    'processing_seconds': 0.0, 'output_bytes': 0
+                })
+                row['jobs'] += 1
+                row['media_seconds'] += (record.get('video_info') or {}).get('duration', 0)
+                row['processing_seconds'] += record['processing_time']
+                row['output_bytes'] += record.get('output_size', 0)
+        return _summarize_profiles(list(rows.values()))
+
+    def delete_older_than(self, timestamp):
+        with self._lock:
+            expired = [
+                job_id for job_id, record in self._jobs.items()
+                if record.get('upload_time', 0) < timestamp
+            ]
+            for job_id in expired:
+                self._count(self._jobs.pop(job_id), -1)
+            for batch_id in [
+                batch_id for batch_id, record in self._batches.items() if record['created'] < timestamp
+            ]:
+                del self._batches[batch_id]
+        return len(expired)
+
+    def get_many(self, job_ids):
+        with self._lock:
+            return {
+                job_id: copy.deepcopy(self._jobs[job_id])
+                for job_id in job_ids if job_id in self._jobs
+            }
+
+    def create_batch(self, batch_id, record):
+        with self._lock:
+            self._batches[batch_id] = copy.deepcopy(record)
+
+    def get_batch(self, batch_id):
+        with self._lock:
+            record = self._batches.get(batch_id)
+            return copy.deepcopy(record) if record is not None else None
+
+
+class SQLiteJobStore(JobStore):
+    """
+    Хранилище задач в SQLite (режим WAL).
+
+    Позволяет нескольким веб-процессам работать с общими задачами.
+    Статус и время загрузки вынесены в индексируемые колонки, а счетчики
+    статистики поддерживаются триггерами при каждой вставке, изменении
+    и удалении записи, поэтому /stats не перебирает все задачи.
+    """
+
+    # Идентификаторов в одном запросе get_many (ограничение SQLite на число параметров)
+    MAX_QUERY_PARAMS = 500
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            upload_time REAL NOT NULL DEFAULT 0,
+            file_size INTEGER NOT NULL DEFAULT 0,
+            processing_time REAL,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS jobs_status_upload_time ON jobs (status, upload_time);
+        CREATE INDEX IF NOT EXISTS jobs_upload_time ON jobs (upload_time);
+
+        CREATE TABLE IF NOT EXISTS job_batches (
+            batch_id TEXT PRIMARY KEY,
+            created REAL NOT NULL,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS job_batches_created ON job_batches (created);
+
+        CREATE TABLE IF NOT EXISTS job_counters (
+            status TEXT PRIMARY KEY,
+            jobs INTEGER NOT NULL DEFAULT 0,
+            bytes INTEGER NOT NULL DEFAULT 0,
+            processing_time_sum REAL NOT NULL DEFAULT 0,
+            processing_time_count INTEGER NOT NULL DEFAULT 0
+        );
+
+        CREATE TRIGGER IF NOT EXISTS jobs_counters_insert AFTER INSERT ON jobs
+        BEGIN
+            INSERT INTO job_counters (status, jobs, bytes, processing_time_sum, processing_time_count)
+            VALUES (NEW.status, 1, NEW.file_size, COALESCE(NEW.processing_time, 0),
+                    NEW.processing_time IS NOT NULL)
+            ON CONFLICT (status) DO UPDATE SET
+                jobs = jobs + 1,
+                bytes = bytes + excluded.bytes,
+                processing_time_sum = processing_time_sum + excluded.processing_time_sum,
+                processing_time_count = processing_time_count + excluded.processing_time_count;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS jobs_counters_delete AFTER DELETE ON jobs
+        BEGIN
+            UPDATE job_counters SET
+                jobs = jobs - 1,
+                bytes = bytes - OLD.file_size,
+                processing_time_sum = processing_time_sum - COALESCE(OLD.processing_time, 0),
+                processing_time_count = processing_time_count - (OLD.processing_time IS NOT NULL)
+            WHERE status = OLD.status;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS jobs_counters_update
+        AFTER UPDATE OF status, file_size, processing_time ON jobs
+        BEGIN
+            UPDATE job_counters SET
+                jobs = jobs - 1,
+                bytes = bytes - OLD.file_size,
+                processing_time_sum = processing_time_sum - COALESCE(OLD.processing_time, 0),
+                processing_time_count = processing_time_count - (OLD.processing_time IS NOT NULL)
+            WHERE status = OLD.status;
+            INSERT INTO job_counters (status, jobs, bytes, processing_time_sum, processing_time_count)
+            VALUES (NEW.status, 1, NEW.file_size, COALESCE(NEW.processing_time, 0),
+                    NEW.processing_time IS NOT NULL)
+            ON CONFLICT (status) DO UPDATE SET
+                jobs = jobs + 1,
+                bytes = bytes + excluded.bytes,
+                processing_time_sum = processing_time_sum + excluded.processing_time_sum,
+                processing_time_count = processing_time_count + excluded.processing_time_count;
+        END;
+    """
+
+    def __init__(self, path: str):
+        """
+        Инициализирует хранилище.
+
+        Args:
+            path: Путь к файлу базы данных SQLite
+        """
+        self.db = SQLiteDatabase(path)
+        self.db.executescript(self.SCHEMA)
+
+    @staticmethod
+    def _columns(record: Dict[str, Any]) -> tuple:
+        """Извлекает значения индексируемых колонок из записи"""
+        return (
+            record['status'],
+            record.get('upload_time', 0),
+            record.get('file_size', 0),
+            record.get('processing_time'),
+            json.dumps(record, ensure_ascii=False)
+        )
+
+    def create(self, job_id, record):
+        with self.db.transaction() as connection:
+            connection.execute(
+                'INSERT INTO jobs (status, upload_time, file_size, processing_time, data, job_id) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                self._columns(record) + (job_id,)
+            )
+
+    def get(self, job_id):
+        row = self.db.connection().execute(
+            'SELECT data FROM jobs WHERE job_id = ?', (job_id,)
+        ).fetchone()
+        return json.loads(row['data']) if row else None
+
+    def update(self, job_id, fields):
+        with self.db.transaction() as connection:
+            row = connection.execute(
+                'SELECT data FROM jobs WHERE job_id = ?', (job_id,)
+            ).fetchone()
+            if row is None:
+                return
+            record = json.loads(row['data'])
+            record.update(fields)
+            connection.execute(
+                'UPDATE jobs SET status = ?, upload_time = ?, file_size = ?, '
+                'processing_time = ?, data = ? WHERE job_id = ?',
+                self._columns(record) + (job_id,)
+            )
+
+    def delete(self, job_id):
+        with self.db.transaction() as connection:
+            connection.execute('DELETE FROM jobs WHERE job_id = ?', (job_id,))
+
+    def recent_completed(self, limit=10):
+        rows = self.db.connection().execute(
+            "SELECT job_id, data FROM jobs WHERE status = 'completed' "
+            'ORDER BY upload_time DESC LIMIT ?', (limit,)
+        ).fetchall()
+        return [dict(json.loads(row['data']), job_id=row['job_id']) for row in rows]
+
+    def stats(self):
+        rows = self.db.connection().execute('SELECT * FROM job_counters').fetchall()
+        return _summarize_counters({row['status']: dict(row) for row in rows})
+
+    def profile_stats(self):
+        # Выборка идет по индексу статуса; поля профиля читаются из JSON записи
+        rows = self.db.connection().execute(
+            "SELECT json_extract(data, '$.encoder_profile') AS profile, COUNT(*) AS jobs, "
+            "SUM(COALESCE(json_extract(data, '$.video_info.duration'), 0)) AS media_seconds, "
+            'SUM(processing_time) AS processing_seconds, '
+            "SUM(COALESCE(json_extract(data, '$.output_size'), 0)) AS output_bytes "
+            "FROM jobs WHERE status = 'completed' AND processing_time IS NOT NULL "
+            "AND json_extract(data, '$.encoder_profile') IS NOT NULL "
+            "AND NOT COALESCE(json_extract(data, '$.cache_hit'), 0) "
+            'GROUP BY profile'
+        ).fetchall()
+        return _summarize_profiles([dict(row) for row in rows])
+
+    def delete_older_than(self, timestamp):
+        with self.db.transaction() as connection:
+            cursor = connection.execute('DELETE FROM jobs WHERE upload_time < ?', (timestamp,))
+            connection.execute('DELETE FROM job_batches WHERE created < ?', (timestamp,))
+            return cursor.rowcount
+
+    def get_many(self, job_ids):
+        records = {}
+        connection = self.db.connection()
+        for start in range(0, len(job_ids), self.MAX_QUERY_PARAMS):
+            chunk = job_ids[start:start + self.MAX_QUERY_PARAMS]
+            rows = connection.execute(
+                f"SELECT job_id, data FROM jobs WHERE job_id IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            records.update((row['job_id'], json.loads(row['data'])) for row in rows)
+        return records
+
+    def create_batch(self, batch_id, record):
+        with self.db.transaction() as connection:
+            connection.execute(
+                'INSERT INTO job_batches (batch_id, created, data) VALUES (?, ?, ?)',
+                (batch_id, record['created'], json.dumps(record, ensure_ascii=False))
+            )
+
+    def get_batch(self, batch_id):
+        row = self.db.connection().execute(
+            'SELECT data FROM job_batches WHERE batch_id = ?', (batch_id,)
+        ).fetchone()
+        return json.loads(row['data']) if row else None
+
+
+def create_job_store(backend: str, path: Optional[str] = None) -> JobStore:
+    """
+    Создает хранилище задач.
+
+    Args:
+        backend: Тип хранилища: 'sqlite' или 'memory'
+        path: Путь к файлу базы данных (для 'sqlite')
+
+    Returns:
+        Экземпляр хранилища задач
+    """
+    if backend == 'sqlite':
+        return SQLiteJobStore(path or 'video_converter.db')
+    if backend == 'memory':
+        return MemoryJobStore()
+    raise ValueError(f"Неизвестный тип хранилища задач: {backend}")
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+import os
+import json
+import threading
+import subprocess
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Optional, Tuple, Union
+import logging
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class NoVideoStreamError(ValueError):
+    """Файл не содержит видеопотока"""
+
+
+# Поля ffprobe, из которых собирается информация о видео; остальное ffprobe не выводит
+PROBE_ENTRIES = ':'.join([
+    'format=duration,start_time,bit_rate,format_name',
+    'stream=codec_type,codec_name,profile,width,height,pix_fmt,r_frame_rate,avg_frame_rate,bit_rate,channels',
+    'stream_tags=rotate',
+    'stream_side_data=rotation'
+])
+
+# Поля информации о видео, которые показывает статус задачи
+STATUS_FIELDS = {
+    'duration': 0,
+    'is_vertical': False,
+    'width': 0,
+    'height': 0,
+    'has_audio': False
+}
+
+
+def status_video_info(video_info: Dict[str, Any]) -> Dict[str, Any]:
+    """Краткая информация о видео для статуса задачи"""
+    return {key: video_info.get(key, default) for key, default in STATUS_FIELDS.items()}
+
+
+def parse_frame_rate(rate: str) -> float:
+    """Преобразует частоту кадров вида '30000/1001' в число"""
+    fps = 0
+    if '/' in rate:
+        num, den = map(int, rate.split('/'))
+        if den != 0:
+            fps = round(num / den, 2)
+    return fps
+
+
+def parse_rotation(video_stream: Dict[str, Any]) -> int:
+    """Извлекает угол поворота видеопотока (0, 90, 180, 270)"""
+    rotation = video_stream.get('tags', {}).get('rotate')
+    if rotation is None:
+        for side_data in video_stream.get('side_data_list', []):
+            if 'rotation' in side_data:
+                rotation = side_data['rotation']
+                break
+    try:
+        return int(float(rotation or 0)) % 360
+    except ValueError:
+        return 0
+
+
+def parse_video_info(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Собирает информацию о видео из вывода ffprobe.
+
+    Args:
+        data: Разобранный JSON ffprobe (format и streams)
+
+    Returns:
+        Словарь с информацией о видео (разрешение, битрейт, fps и т.д.)
+
+    Raises:
+        NoVideoStreamError: Если в файле нет видеопотока
+    """
+    # Извлекаем параметры видеопотока
+    video_stream = None
+    audio_stream = None
+
+    for stream in data.get('streams', []):
+        if stream.get('codec_type') == 'video' and not video_stream:
+            video_stream = stream
+        elif stream.get('codec_type') == 'audio' and not audio_stream:
+            audio_stream = stream
+
+    if not video_stream:
+        raise NoVideoStreamError("Видеопоток не найден в файле")
+
+    # Извлекаем и обрабатываем информацию о видео
+    width = int(video_stream.get('width', 0))
+    height = int(video_stream.get('height', 0))
+
+    # Получаем FPS
+    fps = parse_frame_rate(video_stream.get('r_frame_rate', '0/1'))
+
+    # Средняя частота кадров отличается от r_frame_rate у видео с переменной частотой
+    avg_fps = parse_frame_rate(video_stream.get('avg_frame_rate', '0/1'))
+
+    # Поворот из метаданных (телефоны часто пишут горизонтальный кадр с поворотом)
+    rotation = parse_rotation(video_stream)
+
+    # Получаем общую информацию о формате
+    format_info = data.get('format', {})
+
+    # Длительность в секундах
+    duration = float(format_info.get('duration', 0))
+
+    # Время начала (например, у MPEG-TS обычно не равно нулю)
+    start_time = float(format_info.get('start_time', 0) or 0)
+
+    # Общий битрейт
+    bitrate = int(format_info.get('bit_rate', 0))
+
+    # Битрейт видео (если доступен)
+    video_bitrate = int(video_stream.get('bit_rate', 0))
+    if video_bitrate == 0 and audio_stream:
+        # Если битрейт видео не указан, попробуем рассчитать
+        audio_bitrate = int(audio_stream.get('bit_rate', 0))
+        if audio_bitrate > 0 and bitrate > audio_bitrate:
+            video_bitrate = bitrate - audio_bitrate
+        else:
+            # Если ничего не помогло, используем общий битрейт
+            video_bitrate = bitrate
+
+    # Аудио битрейт
+    audio_bitrate = 0
+    if audio_stream:
+        audio_bitrate = int(audio_stream.get('bit_rate', 0))
+        # Если битрейт аудио не указан, используем стандартный
+        if audio_bitrate == 0:
+            audio_bitrate = 128000  # 128 кбит/с
+
+    # Количество аудиоканалов
+    audio_channels = 0
+    if audio_stream:
+        audio_channels = int(audio_stream.get('channels', 0))
+
+    # Кодеки
+    video_codec = video_stream.get('codec_name', '')
+    audio_codec = ''
+    if audio_stream:
+        audio_codec = audio_stream.get('codec_name', '')
+
+    # Собираем всю информацию
+    return {
+        'width': width,
+        'height': height,
+        'is_vertical': height > width,
+        'fps': fps,
+        'duration': duration,
+        'start_time': start_time,
+        'bitrate': bitrate,
+        'video_bitrate': video_bitrate,
+        'audio_bitrate': audio_bitrate,
+        'audio_channels': audio_channels,
+        'video_codec': video_codec,
+        'audio_codec': audio_codec,
+        'has_audio': audio_stream is not None,
+        'avg_fps': avg_fps,
+        'rotation': rotation,
+        'pix_fmt': video_stream.get('pix_fmt', ''),
+        'profile': video_stream.get('profile', ''),
+        'format_name': format_info.get('format_name', '')
+    }
+
+
+class MediaProbe:
+    """
+    Анализ видеофайлов ffprobe с кешем результатов.
+
+    ffprobe запрашивает только поля PROBE_ENTRIES, а не все сведения о
+    формате и потоках. Результаты хранятся в LRU-кеше по (путь, размер,
+    mtime_ns): повторный анализ того же файла (постановка в очередь,
+    обработка, оценка стоимости) не запускает процесс, а измененный файл
+    получает новый ключ. Ошибки не кешируются.
+    """
+
+    def __init__(self, max_entries: int = 1024, workers: Optional[int] = None):
+        """
+        Инициализирует анализ.
+
+        Args:
+            max_entries: Максимальное количество результатов в кеше (0 - без кеша)
+            workers: Параллельных процессов ffprobe в probe_many (по умолчанию по числу ядер)
+        """
+        self.max_entries = max_entries
+        self.workers = workers or min(8, os.cpu_count() or 1)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @staticmethod
+    def command(path: str) -> list:
+        """Команда ffprobe для файла"""
+        return [
+            'ffprobe',
+            '-v', 'quiet',
+            '-print_format', 'json',
+            '-show_entries', PROBE_ENTRIES,
+            path
+        ]
+
+    @staticmethod
+    def _key(path: str) -> Tuple[str, int, int]:
+        """Ключ кеша: путь, размер и время изменения файла"""
+        stat = os.stat(path)
+        return os.path.abspath(path), stat.st_size, stat.st_mtime_ns
+
+    def _run(self, path: str) -> Dict[str, Any]:
+        """Запускает ffprobe и разбирает результат"""
+        try:
+            with metrics.timed('probe'):
+                result = subprocess.run(self.command(path), capture_output=True, text=True, check=True)
+            return parse_video_info(json.loads(result.stdout))
+        except NoVideoStreamError:
+            raise
+        except subprocess.CalledProcessError as e:
+            logger.error(f"Ошибка при получении информации о видео: {e}")
+            raise ValueError(f"Не удалось получить информацию о видео: {e}")
+        except json.JSONDecodeError as e:
+            logger.error(f"Ошибка при обработке JSON: {e}")
+            raise ValueError(f"Ошибка при обработке JSON: {e}")
+        except Exception as e:
+            logger.error(f"Непредвиденная ошибка: {e}")
+            raise ValueError(f"Ошибка при обработке видео: {e}")
+
+    def probe(self, path: str, cache: bool = True) -> Dict[str, Any]:
+        """
+        Возвращает информацию о видеофайле.
+
+        Args:
+            path: Путь к видеофайлу
+            cache: Использовать кеш (False - для одноразовых файлов)
+
+        Returns:
+            Копия информации о видео (см. parse_video_info)
+
+        Raises:
+            NoVideoStreamError: Если в файле нет видеопотока
+            ValueError: Если файл не удалось проанализировать
+        """
+        if not cache or not self.max_entries:
+            return self._run(path)
+
+        try:
+            key = self._key(path)
+        except OSError as e:
+            raise ValueError(f"Ошибка при обработке видео: {e}")
+
+        with self._lock:
+            info = self._entries.get(key)
+            if info is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return dict(info)
+            self._misses += 1
+
+        info = self._run(path)
+        with self._lock:
+            self._entries[key] = info
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return dict(info)
+
+    def probe_many(self, paths: Iterable[str]) -> Dict[str, Union[Dict[str, Any], Exception]]:
+        """
+        Анализирует несколько файлов параллельными процессами ffprobe.
+
+        Файлы из кеша процессов не запускают. Ошибка одного файла не
+        прерывает остальные.
+
+        Returns:
+            Словарь путь -> информация о видео или исключение анализа
+        """
+        paths = list(dict.fromkeys(paths))
+
+        def probe_one(path):
+            try:
+                return self.probe(path)
+            except ValueError as e:
+                return e
+
+        if len(paths) <= 1:
+            return {path: probe_one(path) for path in paths}
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(paths))) as executor:
+            return dict(zip(paths, executor.map(probe_one, paths)))
+
+    def stats(self) -> Dict[str, int]:
+        """Возвращает размер кеша и число попаданий и промахов (в пределах процесса)"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self._hits,
+                'misses': self._misses
+            }
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+Метрики обработки видео в текстовом формате Prometheus.
+
+Метрики хранятся в памяти процесса: каждый процесс отдает только свои
+значения, и Prometheus их не объединяет - каждый процесс должен быть
+отдельной целью сбора (scrape target). Веб-процесс отдает метрики на
+/metrics, процесс worker.py - на собственном порту (serve, --metrics-port).
+Суммы по всем процессам считаются в запросах, например
+sum without (instance) (rate(video_converter_output_bytes_total[5m])).
+При нескольких процессах gunicorn за одним адресом каждый запрос /metrics
+попадает в случайный процесс, поэтому процессам нужны отдельные адреса.
+"""
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм длительности (в секундах)
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+def _format_value(value: float) -> str:
+    """Форматирует число по правилам текстового формата Prometheus"""
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    """Формирует блок меток {name="value",...}"""
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        pairs.append(f'{name}="{escaped}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class Metric:
+    """Базовый класс метрики с необязательными метками"""
+
+    metric_type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values = {}
+        REGISTRY.register(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        """Преобразует метки в ключ серии"""
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"Метрика {self.name} ожидает метки {self.label_names}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        """Возвращает строки выборки: (имя, метки, значение)"""
+        raise NotImplementedError
+
+    def render(self) -> str:
+        """Формирует описание метрики в текстовом формате"""
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.metric_type}"
+        ]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{labels} {_format_value(value)}")
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    """Монотонно растущий счетчик"""
+
+    metric_type = 'counter'
+
+    def inc(self, amount: float = 1, **labels: str):
+        """Увеличивает счетчик"""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [
+                (self.name, _format_labels(self.label_names, key), value)
+                for key, value in sorted(self._values.items())
+            ]
+
+
+class Gauge(Metric):
+    """Текущее значение, которое может расти и уменьшаться"""
+
+    metric_type = 'gauge'
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        super().__init__(name, documentation, label_names)
+        self._function = None
+
+    def set(self, value: float, **labels: str):
+        """Устанавливает значение"""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels: str):
+        """Увеличивает значение"""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str):
+        """Уменьшает значение"""
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], float]):
+        """Задает функцию, вычисляющую значение в момент чтения метрик (только без меток)"""
+        self._function = function
+
+    def samples(self):
+        if self._function is not None:
+            try:
+                return [(self.name, '', self._function())]
+            except Exception as e:
+                logger.warning(f"Не удалось вычислить метрику {self.name}: {e}")
+                return []
+        with self._lock:
+            return [
+                (self.name, _format_labels(self.label_names, key), value)
+                for key, value in sorted(self._values.items())
+            ]
+
+
+class Histogram(Metric):
+    """Распределение значений по корзинам"""
+
+    metric_type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = DURATION_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels: str):
+        """Добавляет наблюдение"""
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][index] += 1
+                    break
+            series['sum'] += value
+            series['count'] += 1
+
+    def samples(self):
+        rows = []
+        with self._lock:
+            for key, series in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series['counts']):
+                    cumulative += count
+                    labels = _format_labels(self.label_names + ('le',), key + (_format_value(bound),))
+                    rows.append((f"{self.name}_bucket", labels, cumulative))
+                labels = _format_labels(self.label_names, key)
+                rows.append((f"{self.name}_sum", labels, series['sum']))
+                rows.append((f"{self.name}_count", labels, series['count']))
+        return rows
+
+
+class Registry:
+    """Набор метрик процесса"""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric):
+        """Добавляет метрику"""
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self) -> str:
+        """Формирует все метрики в текстовом формате Prometheus"""
+        with self._lock:
+            metrics = list(self._metrics)
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+REGISTRY = Registry()
+
+STAGE_DURATION = Histogram(
+    'video_converter_stage_duration_seconds',
+    'Длительность этапов обработки (загрузка, ffprobe, кодирование, очистка)',
+    ['stage']
+)
+FFMPEG_CPU_SECONDS = Histogram(
+    'video_converter_ffmpeg_cpu_seconds',
+    'Процессорное время завершившегося процесса FFmpeg',
+    ['stage', 'mode']
+)
+FFMPEG_MAX_RSS_BYTES = Histogram(
+    'video_converter_ffmpeg_max_rss_bytes',
+    'Пиковый объем памяти процесса FFmpeg',
+    ['stage'],
+    buckets=tuple(2 ** power * 1024 * 1024 for power in range(4, 14))
+)
+INPUT_BYTES = Counter(
+    'video_converter_input_bytes_total',
+    'Объем принятых исходных файлов'
+)
+OUTPUT_BYTES = Counter(
+    'video_converter_output_bytes_total',
+    'Объем готовых результатов: файлов MP4 и директорий адаптивного вывода HLS (без превью)',
+    ['format']
+)
+REALTIME_FACTOR = Histogram(
+    'video_converter_realtime_factor',
+    'Отношение длительности видео к времени его обработки',
+    ['conversion_path'],
+    buckets=(0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32, 64, 128)
+)
+QUEUE_WAIT = Histogram(
+    'video_converter_queue_wait_seconds',
+    'Время ожидания задачи в очереди конвертации'
+)
+JOBS_FINISHED = Counter(
+    'video_converter_jobs_finished_total',
+    'Завершенные задачи по итоговому статусу',
+    ['status']
+)
+JOBS_IN_FLIGHT = Gauge(
+    'video_converter_jobs_in_flight',
+    'Задачи, обрабатываемые в данный момент'
+)
+JOBS_QUEUED = Gauge(
+    'video_converter_jobs_queued',
+    'Задачи, ожидающие в очереди конвертации'
+)
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """
+    Замеряет длительность этапа.
+
+    Пример:
+        with metrics.timed('probe'):
+            ...
+    """
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        STAGE_DURATION.observe(time.monotonic() - start, stage=stage)
+
+
+def observe_rusage(stage: str, rusage: Optional[object]):
+    """
+    Учитывает ресурсы завершившегося процесса FFmpeg.
+
+    Args:
+        stage: Этап обработки
+        rusage: Результат os.wait4 (resource.struct_rusage) или None
+    """
+    if rusage is None:
+        return
+    FFMPEG_CPU_SECONDS.observe(rusage.ru_utime, stage=stage, mode='user')
+    FFMPEG_CPU_SECONDS.observe(rusage.ru_stime, stage=stage, mode='system')
+    # В Linux ru_maxrss измеряется в килобайтах
+    FFMPEG_MAX_RSS_BYTES.observe(rusage.ru_maxrss * 1024, stage=stage)
+
+
+def render() -> str:
+    """Возвращает все метрики процесса в текстовом формате Prometheus"""
+    return REGISTRY.render()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """Отдает метрики процесса по GET /metrics"""
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Запросы сборщика не засоряют журнал
+        pass
+
+
+def serve(port: int, host: str = '') -> ThreadingHTTPServer:
+    """
+    Запускает HTTP-сервер метрик процесса в фоновом потоке.
+
+    Используется процессами без Flask (worker.py): у каждого процесса
+    свой порт и своя цель сбора в Prometheus.
+
+    Args:
+        port: Порт (0 - любой свободный)
+        host: Адрес для прослушивания (по умолчанию все интерфейсы)
+
+    Returns:
+        Запущенный сервер (server.shutdown() останавливает его)
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True)
+    thread.start()
+    logger.info(f"Метрики доступны на http://{host or '0.0.0.0'}:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+import os
+import json
+import time
+import uuid
+import hashlib
+from typing import Any, Dict, Optional
+import logging
+
+from database import SQLiteDatabase
+from video_utils import VideoProcessor, NoVideoStreamError
+
+logger = logging.getLogger(__name__)
+
+
+class PartialProbe:
+    """
+    Предварительная проверка файла по его началу и концу.
+
+    Клиент присылает несколько мегабайт из начала файла (и из конца, если
+    индекс контейнера - например, атом moov в MP4 - записан в конце). Части
+    раскладываются по своим смещениям в разреженный файл полного размера,
+    и ffprobe читает его так же, как настоящий файл. Так неподходящий файл
+    отклоняется до передачи гигабайтов.
+
+    Результат сохраняется вместе с хешами присланных частей: после полной
+    загрузки достаточно сравнить эти части с файлом, чтобы использовать
+    готовую информацию о видео без повторного запуска ffprobe.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS probes (
+            probe_id TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            head_length INTEGER NOT NULL,
+            head_digest TEXT NOT NULL,
+            tail_length INTEGER NOT NULL,
+            tail_digest TEXT NOT NULL,
+            decision TEXT NOT NULL,
+            streamable INTEGER NOT NULL DEFAULT 0,
+            video_info TEXT,
+            created REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS probes_created ON probes (created);
+    """
+
+    def __init__(self, video_processor: VideoProcessor, probe_dir: str, db_path: str, max_bytes: int):
+        """
+        Инициализирует предварительную проверку.
+
+        Args:
+            video_processor: Процессор видео (для запуска ffprobe)
+            probe_dir: Директория для временных разреженных файлов
+            db_path: Путь к базе данных SQLite с результатами проверок
+            max_bytes: Максимальный суммарный размер присланных частей
+        """
+        self.video_processor = video_processor
+        self.probe_dir = probe_dir
+        self.max_bytes = max_bytes
+        os.makedirs(probe_dir, exist_ok=True)
+
+        self.db = SQLiteDatabase(db_path)
+        self.db.executescript(self.SCHEMA)
+
+    def probe(self, filename: str, size: int, head: bytes, tail: bytes = b'') -> Dict[str, Any]:
+        """
+        Проверяет файл по его началу и концу.
+
+        Args:
+            filename: Безопасное имя файла (расширение помогает ffprobe)
+            size: Полный размер файла в байтах
+            head: Данные из начала файла
+            tail: Данные из конца файла (может быть пустым)
+
+        Returns:
+            Словарь с probe_id, решением ('accept', 'reject' или 'unknown'),
+            причиной отказа и основными параметрами видео
+        """
+        if not head or size < len(head) + len(tail):
+            raise ValueError('Некорректный размер файла')
+        if len(head) + len(tail) > self.max_bytes:
+            raise ValueError('Слишком большой фрагмент для проверки')
+
+        probe_id = str(uuid.uuid4())
+        extension = os.path.splitext(filename)[1]
+        path = os.path.join(self.probe_dir, f"{probe_id}.probe{extension}")
+
+        video_info = None
+        reason = None
+        streamable = False
+        try:
+            # Разреженный файл полного размера: середина не занимает места на диске
+            with open(path, 'wb') as sparse:
+                sparse.write(head)
+                if tail:
+                    sparse.seek(size - len(tail))
+                    sparse.write(tail)
+                sparse.truncate(size)
+
+            # Разреженный файл удаляется после проверки - кешировать его результат незачем
+            video_info = self.video_processor.get_video_info(path, cache=False)
+            streamable = self.video_processor.is_streamable(video_info, head)
+            decision = 'accept'
+        except NoVideoStreamError as e:
+            decision = 'reject'
+            reason = str(e)
+        except ValueError as e:
+            # Присланных данных может не хватить (например, индекс в середине файла) -
+            # окончательно решит проверка полного файла
+            logger.info(f"Предварительная проверка {filename} не дала результата: {e}")
+            decision = 'unknown'
+        finally:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+        with self.db.transaction() as connection:
+            connection.execute(
+                'INSERT INTO probes (probe_id, size, head_length, head_digest, tail_length, tail_digest, '
+                'decision, streamable, video_info, created) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (
+                    probe_id, size,
+                    len(head), hashlib.sha256(head).hexdigest(),
+                    len(tail), hashlib.sha256(tail).hexdigest(),
+                    decision,
+                    streamable,
+                    json.dumps(video_info) if video_info is not None else None,
+                    time.time()
+                )
+            )
+
+        result = {'probe_id': probe_id, 'decision': decision}
+        if reason:
+            result['reason'] = reason
+        if video_info is not None:
+            result.update({
+                'video_codec': video_info['video_codec'],
+                'audio_codec': video_info['audio_codec'],
+                'width': video_info['width'],
+                'height': video_info['height'],
+                'duration': video_info['duration'],
+                'streamable': streamable,
+                'conversion_path': self.video_processor.plan_conversion(video_info)['mode']
+            })
+        return result
+
+    def get(self, probe_id: str) -> Optional[Dict[str, Any]]:
+        """Возвращает сохраненный результат проверки или None"""
+        row = self.db.connection().execute(
+            'SELECT * FROM probes WHERE probe_id = ?', (probe_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        record = dict(row)
+        record['video_info'] = json.loads(record['video_info']) if record['video_info'] else None
+        record['streamable'] = bool(record['streamable'])
+        return record
+
+    def verified_video_info(self, probe_id: str, path: str) -> Optional[Dict[str, Any]]:
+        """
+        Возвращает информацию о видео из проверки, если она относится к этому файлу.
+
+        Сравниваются размер и хеши начала и конца файла - это чтение
+        нескольких мегабайт вместо повторного запуска ffprobe. Запись о
+        проверке после использования удаляется.
+
+        Args:
+            probe_id: Идентификатор предварительной проверки
+            path: Путь к полностью загруженному файлу
+
+        Returns:
+            Информация о видео или None, если проверку использовать нельзя
+        """
+        record = self.get(probe_id)
+        if record is None:
+            return None
+
+        with self.db.transaction() as connection:
+            connection.execute('DELETE FROM probes WHERE probe_id = ?', (probe_id,))
+
+        if record['video_info'] is None:
+            return None
+
+        try:
+            if os.path.getsize(path) != record['size']:
+                return None
+            with open(path, 'rb') as source:
+                head = source.read(record['head_length'])
+                source.seek(record['size'] - record['tail_length'])
+                tail = source.read(record['tail_length'])
+        except OSError as e:
+            logger.warning(f"Не удалось сверить файл с предварительной проверкой: {e}")
+            return None
+
+        if (hashlib.sha256(head).hexdigest() != record['head_digest']
+                or hashlib.sha256(tail).hexdigest() != record['tail_digest']):
+            logger.warning(f"Файл {path} не совпадает с предварительной проверкой {probe_id}")
+            return None
+
+        return record['video_info']
+
+    def delete_older_than(self, timestamp: float) -> int:
+        """
+        Удаляет неиспользованные результаты проверок.
+
+        Returns:
+            Количество удаленных записей
+        """
+        with self.db.transaction() as connection:
+            cursor = connection.execute('DELETE FROM probes WHERE created < ?', (timestamp,))
+            return cursor.rowcount
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+import threading
+from typing import Iterator
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class UploadInterruptedError(IOError):
+    """Загрузка оборвалась до получения всего файла"""
+
+
+class GrowingFile:
+    """
+    Файл, который еще дописывается загрузкой.
+
+    Загрузка пишет данные на диск с той скоростью, с какой они приходят, и
+    сообщает о каждой записи через append(). Читатель (поток, передающий
+    данные в stdin FFmpeg) получает байты из того же файла по мере их
+    появления, поэтому медленный FFmpeg не тормозит загрузку, а конвертация
+    идет, пока файл еще загружается.
+    """
+
+    def __init__(self, path: str, read_size: int = 1024 * 1024):
+        """
+        Инициализирует файл.
+
+        Args:
+            path: Путь к файлу, который пишет загрузка
+            read_size: Размер блока чтения
+        """
+        self.path = path
+        self.read_size = read_size
+        self._written = 0
+        self._finished = False
+        self._failed = False
+        self._condition = threading.Condition()
+
+    def append(self, length: int):
+        """Сообщает, что в файл дописано еще length байт"""
+        with self._condition:
+            self._written += length
+            self._condition.notify_all()
+
+    def finish(self):
+        """Сообщает, что загрузка завершена и файл записан полностью"""
+        with self._condition:
+            self._finished = True
+            self._condition.notify_all()
+
+    def fail(self):
+        """Сообщает, что загрузка оборвалась или данные нельзя использовать"""
+        with self._condition:
+            self._failed = True
+            self._condition.notify_all()
+
+    def wait(self) -> bool:
+        """
+        Ожидает окончания загрузки.
+
+        Returns:
+            True если файл загружен полностью, False если загрузка оборвалась
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._finished or self._failed)
+            return not self._failed
+
+    def chunks(self) -> Iterator[bytes]:
+        """
+        Возвращает данные файла по мере их записи.
+
+        Если загрузка оборвалась, выбрасывает UploadInterruptedError, чтобы
+        FFmpeg не принял обрезанный файл за целый.
+        """
+        position = 0
+        with open(self.path, 'rb') as source:
+            while True:
+                with self._condition:
+                    self._condition.wait_for(
+                        lambda: self._failed or self._finished or self._written > position
+                    )
+                    if self._failed:
+                        raise UploadInterruptedError('Загрузка прервана')
+                    available = self._written - position
+                    if available == 0:
+                        return
+
+                while available > 0:
+                    data = source.read(min(self.read_size, available))
+                    if not data:
+                        break
+                    position += len(data)
+                    available -= len(data)
+                    yield data
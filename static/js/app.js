@@ -19,6 +19,7 @@ document.addEventListener('DOMContentLoaded', function() {
     const statusText = document.getElementById('status-text');
     const resultMessage = document.getElementById('result-message');
     const videoInfo = document.getElementById('video-info');
+    const processingText = document.getElementById('processing-text');
     
     const downloadButton = document.getElementById('download-button');
     const convertAnotherButton = document.getElementById('convert-another-button');
@@ -33,11 +34,20 @@ document.addEventListener('DOMContentLoaded', function() {
     };
     
     // Ограничение размера файла
-    const MAX_FILE_SIZE = 1024 * 1024 * 1024; // 1GB
+    const MAX_FILE_SIZE = 10 * 1024 * 1024 * 1024; // 10GB
+    
+    // Параметры загрузки частями
+    const PARALLEL_CHUNKS = 4; // Количество одновременно отправляемых частей
+    const CHUNK_RETRIES = 3; // Количество попыток отправки одной части
+    
+    // Параметры предварительной проверки файла
+    const PROBE_HEAD_BYTES = 4 * 1024 * 1024; // Начало файла (заголовки контейнера)
+    const PROBE_TAIL_BYTES = 4 * 1024 * 1024; // Конец файла (например, атом moov в MP4)
     
     // Текущее состояние
     let currentJobId = null;
     let pollingInterval = null;
+    let statusSource = null;
     let conversionStartTime = 0;
     
     // Обработчик выбора файла
@@ -47,7 +57,7 @@ document.addEventListener('DOMContentLoaded', function() {
             
             // Проверка размера файла
             if (file.size > MAX_FILE_SIZE) {
-                showError(`Файл слишком большой. Максимальный размер: 1 ГБ`);
+                showError(`Файл слишком большой. Максимальный размер: 10 ГБ`);
                 this.value = '';
                 fileName.textContent = 'Файл не выбран';
                 uploadButton.disabled = true;
@@ -90,74 +100,300 @@ document.addEventListener('DOMContentLoaded', function() {
     // Обработчик кнопки "Попробовать снова"
     tryAgainButton.addEventListener('click', resetForm);
     
-    // Функция начала загрузки
+    // Функция начала загрузки: файл отправляется частями параллельно,
+    // а после обрыва соединения загрузка возобновляется с недостающих частей
     function startUpload(file) {
         // Показываем индикатор прогресса
         uploadContainer.classList.add('hidden');
         progressContainer.classList.remove('hidden');
-        statusText.textContent = 'Загрузка файла...';
+        statusText.textContent = 'Проверка файла...';
+        
+        const storageKey = uploadStorageKey(file);
+        let probeId = null;
         
-        // Создаем FormData для отправки файла
+        probeFile(file)
+            .then(probe => {
+                statusText.textContent = 'Загрузка файла...';
+                
+                // Потоковый контейнер конвертируется уже во время загрузки
+                if (probe && probe.pipelined) {
+                    return uploadStreamed(file, probe.probe_id);
+                }
+                
+                probeId = probe ? probe.probe_id : null;
+                return openUpload(file, storageKey)
+                    .then(upload => sendMissingChunks(file, upload).then(() => upload))
+                    .then(upload => requestJson('POST', `/uploads/${upload.upload_id}/complete`, { probe_id: probeId }));
+            })
+            .then(response => {
+                localStorage.removeItem(storageKey);
+                currentJobId = response.job_id;
+                
+                // Показываем индикатор обработки
+                progressContainer.classList.add('hidden');
+                processingContainer.classList.remove('hidden');
+                
+                // Запоминаем время начала конвертации
+                conversionStartTime = Date.now();
+                
+                // Начинаем отслеживать статус
+                startStatusTracking(currentJobId);
+            })
+            .catch(error => {
+                showError(error.message || 'Ошибка загрузки. Пожалуйста, попробуйте снова.');
+            });
+    }
+    
+    // Функция предварительной проверки: сервер анализирует начало и конец файла,
+    // и неподходящий файл отклоняется до загрузки целиком
+    function probeFile(file) {
         const formData = new FormData();
-        formData.append('file', file);
+        formData.append('filename', file.name);
+        formData.append('size', file.size);
         
-        // Отправляем запрос
-        const xhr = new XMLHttpRequest();
+        if (file.size > PROBE_HEAD_BYTES + PROBE_TAIL_BYTES) {
+            formData.append('head', file.slice(0, PROBE_HEAD_BYTES));
+            formData.append('tail', file.slice(file.size - PROBE_TAIL_BYTES));
+        } else {
+            formData.append('head', file);
+        }
+        
+        return fetch('/probe', { method: 'POST', body: formData })
+            .then(response => response.ok ? response.json() : null)
+            // Проверка необязательна: при ее сбое файл проверит сервер после загрузки
+            .catch(() => null)
+            .then(probe => {
+                if (probe && probe.decision === 'reject') {
+                    throw new Error(`Файл нельзя конвертировать: ${probe.reason || 'видеопоток не найден'}`);
+                }
+                return probe;
+            });
+    }
+    
+    // Ключ для сохранения незавершенной загрузки между попытками
+    function uploadStorageKey(file) {
+        return `upload:${file.name}:${file.size}:${file.lastModified}`;
+    }
+    
+    // Функция JSON-запроса к API загрузки
+    function requestJson(method, url, body) {
+        const options = { method: method };
+        if (body) {
+            options.headers = { 'Content-Type': 'application/json' };
+            options.body = JSON.stringify(body);
+        }
         
-        // Отслеживаем прогресс загрузки
-        xhr.upload.addEventListener('progress', function(e) {
-            if (e.lengthComputable) {
-                const percentComplete = Math.round((e.loaded / e.total) * 100);
-                progressBar.style.width = percentComplete + '%';
-                progressPercentage.textContent = percentComplete + '%';
+        return fetch(url, options).catch(() => {
+            throw new Error('Ошибка сети. Проверьте соединение и попробуйте снова.');
+        }).then(response => response.json().catch(() => ({})).then(data => {
+            if (!response.ok) {
+                const error = new Error(data.error || 'Ошибка загрузки. Пожалуйста, попробуйте снова.');
+                error.status = response.status;
+                throw error;
             }
+            return data;
+        }));
+    }
+    
+    // Функция открытия загрузки: возобновляет сохраненную или начинает новую
+    function openUpload(file, storageKey) {
+        const savedUploadId = localStorage.getItem(storageKey);
+        
+        if (savedUploadId) {
+            return requestJson('GET', `/uploads/${savedUploadId}`).catch(() => {
+                localStorage.removeItem(storageKey);
+                return createUpload(file, storageKey);
+            });
+        }
+        
+        return createUpload(file, storageKey);
+    }
+    
+    // Функция создания новой загрузки
+    function createUpload(file, storageKey) {
+        return requestJson('POST', '/uploads', { filename: file.name, size: file.size })
+            .then(upload => {
+                localStorage.setItem(storageKey, upload.upload_id);
+                
+                const missingChunks = [];
+                for (let index = 0; index < upload.total_chunks; index++) {
+                    missingChunks.push(index);
+                }
+                
+                return {
+                    upload_id: upload.upload_id,
+                    chunk_size: upload.chunk_size,
+                    missing_chunks: missingChunks
+                };
+            });
+    }
+    
+    // Функция отправки недостающих частей несколькими параллельными потоками
+    function sendMissingChunks(file, upload) {
+        const pending = upload.missing_chunks.slice();
+        const inFlight = {};
+        let completedBytes = file.size - pending.reduce(
+            (total, index) => total + chunkLength(file, upload, index), 0
+        );
+        
+        function updateProgress() {
+            let loaded = completedBytes;
+            Object.keys(inFlight).forEach(index => { loaded += inFlight[index]; });
+            const percentComplete = Math.round((loaded / file.size) * 100);
+            progressBar.style.width = percentComplete + '%';
+            progressPercentage.textContent = percentComplete + '%';
+        }
+        
+        function nextChunk() {
+            const index = pending.shift();
+            if (index === undefined) {
+                return Promise.resolve();
+            }
+            
+            return sendChunkWithRetry(file, upload, index, loaded => {
+                inFlight[index] = loaded;
+                updateProgress();
+            }, 1).then(() => {
+                delete inFlight[index];
+                completedBytes += chunkLength(file, upload, index);
+                updateProgress();
+                return nextChunk();
+            });
+        }
+        
+        updateProgress();
+        
+        const workers = [];
+        for (let i = 0; i < PARALLEL_CHUNKS; i++) {
+            workers.push(nextChunk());
+        }
+        return Promise.all(workers);
+    }
+    
+    // Размер части с заданным номером
+    function chunkLength(file, upload, index) {
+        const start = index * upload.chunk_size;
+        return Math.min(upload.chunk_size, file.size - start);
+    }
+    
+    // Функция отправки части с повторными попытками
+    function sendChunkWithRetry(file, upload, index, onProgress, attempt) {
+        return sendChunk(file, upload, index, onProgress).catch(error => {
+            // Ошибки клиента (4xx) повторять бессмысленно
+            if (attempt >= CHUNK_RETRIES || (error.status && error.status < 500)) {
+                throw error;
+            }
+            onProgress(0);
+            return new Promise(resolve => setTimeout(resolve, 1000 * attempt))
+                .then(() => sendChunkWithRetry(file, upload, index, onProgress, attempt + 1));
         });
+    }
+    
+    // Функция отправки одной части
+    function sendChunk(file, upload, index, onProgress) {
+        const start = index * upload.chunk_size;
+        const end = start + chunkLength(file, upload, index);
         
-        // Обработка завершения загрузки
-        xhr.addEventListener('load', function() {
-            if (xhr.status >= 200 && xhr.status < 300) {
-                try {
-                    const response = JSON.parse(xhr.responseText);
-                    currentJobId = response.job_id;
-                    
-                    // Показываем индикатор обработки
-                    progressContainer.classList.add('hidden');
-                    processingContainer.classList.remove('hidden');
-                    
-                    // Запоминаем время начала конвертации
-                    conversionStartTime = Date.now();
-                    
-                    // Начинаем опрос статуса
-                    startPolling(currentJobId);
-                } catch (error) {
-                    showError('Ошибка сервера. Пожалуйста, попробуйте снова.');
+        return sendBody('PUT', `/uploads/${upload.upload_id}`, {
+            'Content-Range': `bytes ${start}-${end - 1}/${file.size}`
+        }, file.slice(start, end), onProgress);
+    }
+    
+    // Функция отправки файла одним запросом: потоковый контейнер конвертируется
+    // на сервере во время загрузки
+    function uploadStreamed(file, probeId) {
+        const url = `/upload?filename=${encodeURIComponent(file.name)}&probe_id=${encodeURIComponent(probeId)}`;
+        return sendBody('POST', url, { 'Content-Type': 'application/octet-stream' }, file, loaded => {
+            const percentComplete = Math.round((loaded / file.size) * 100);
+            progressBar.style.width = percentComplete + '%';
+            progressPercentage.textContent = percentComplete + '%';
+        });
+    }
+    
+    // Функция отправки тела запроса с отслеживанием прогресса
+    function sendBody(method, url, headers, body, onProgress) {
+        return new Promise((resolve, reject) => {
+            const xhr = new XMLHttpRequest();
+            
+            // Отслеживаем прогресс отправки
+            xhr.upload.addEventListener('progress', function(e) {
+                onProgress(e.loaded);
+            });
+            
+            xhr.addEventListener('load', function() {
+                if (xhr.status >= 200 && xhr.status < 300) {
+                    try {
+                        resolve(JSON.parse(xhr.responseText));
+                    } catch (error) {
+                        resolve({});
+                    }
+                    return;
                 }
-            } else {
+                let message = 'Ошибка загрузки. Пожалуйста, попробуйте снова.';
                 try {
-                    const response = JSON.parse(xhr.responseText);
-                    showError(response.error || 'Ошибка загрузки. Пожалуйста, попробуйте снова.');
+                    message = JSON.parse(xhr.responseText).error || message;
                 } catch (error) {
-                    showError('Ошибка загрузки. Пожалуйста, попробуйте снова.');
+                    // Оставляем сообщение по умолчанию
                 }
-            }
+                const error = new Error(message);
+                error.status = xhr.status;
+                reject(error);
+            });
+            
+            // Обработка ошибок сети
+            xhr.addEventListener('error', function() {
+                reject(new Error('Ошибка сети. Проверьте соединение и попробуйте снова.'));
+            });
+            
+            // Обработка прерывания запроса
+            xhr.addEventListener('abort', function() {
+                reject(new Error('Загрузка прервана. Пожалуйста, попробуйте снова.'));
+            });
+            
+            xhr.open(method, url, true);
+            Object.keys(headers).forEach(name => xhr.setRequestHeader(name, headers[name]));
+            xhr.send(body);
         });
+    }
+    
+    // Функция отслеживания статуса: SSE-поток, а при его недоступности - опрос
+    function startStatusTracking(jobId) {
+        stopStatusTracking();
         
-        // Обработка ошибок сети
-        xhr.addEventListener('error', function() {
-            showError('Ошибка сети. Проверьте соединение и попробуйте снова.');
-        });
+        if (!window.EventSource) {
+            startPolling(jobId);
+            return;
+        }
         
-        // Обработка прерывания запроса
-        xhr.addEventListener('abort', function() {
-            showError('Загрузка прервана. Пожалуйста, попробуйте снова.');
-        });
+        statusSource = new EventSource(`/status/${jobId}/stream`);
+        
+        statusSource.onmessage = function(event) {
+            handleStatus(JSON.parse(event.data));
+        };
         
-        // Отправляем запрос
-        xhr.open('POST', '/upload', true);
-        xhr.send(formData);
+        statusSource.onerror = function() {
+            // При обрыве браузер переподключается сам; если поток закрыт окончательно,
+            // переходим на периодический опрос
+            if (statusSource && statusSource.readyState === EventSource.CLOSED) {
+                statusSource = null;
+                startPolling(jobId);
+            }
+        };
+    }
+    
+    // Функция остановки отслеживания статуса
+    function stopStatusTracking() {
+        if (statusSource) {
+            statusSource.close();
+            statusSource = null;
+        }
+        if (pollingInterval) {
+            clearInterval(pollingInterval);
+            pollingInterval = null;
+        }
     }
     
-    // Функция опроса статуса
+    // Функция опроса статуса (для браузеров без EventSource)
     function startPolling(jobId) {
         if (pollingInterval) {
             clearInterval(pollingInterval);
@@ -171,88 +407,112 @@ document.addEventListener('DOMContentLoaded', function() {
                     }
                     return response.json();
                 })
-                .then(data => {
-                    // Обрабатываем статус
-                    switch (data.status) {
-                        case 'uploaded':
-                        case 'processing':
-                            // Продолжаем опрос
-                            break;
-                            
-                        case 'completed':
-                            // Останавливаем опрос
-                            clearInterval(pollingInterval);
-                            pollingInterval = null;
-                            
-                            // Обновляем статистику
-                            stats.totalConversions++;
-                            stats.successfulConversions++;
-                            
-                            // Вычисляем время обработки
-                            const processingTime = (Date.now() - conversionStartTime) / 1000; // в секундах
-                            
-                            // Показываем результат
-                            processingContainer.classList.add('hidden');
-                            resultContainer.classList.remove('hidden');
-                            
-                            // Очищаем предыдущую информацию о видео
-                            videoInfo.innerHTML = '';
-                            
-                            // Добавляем информацию о видео
-                            if (data.video_info) {
-                                const infoDiv = document.createElement('div');
-                                infoDiv.innerHTML = `
-                                    <h4>Информация о видео:</h4>
-                                    <ul>
-                                        <li>Разрешение: ${data.video_info.width}x${data.video_info.height}</li>
-                                        <li>Длительность: ${Math.round(data.video_info.duration)} секунд</li>
-                                        <li>${data.video_info.is_vertical ? 'Вертикальное видео' : 'Горизонтальное видео'}</li>
-                                        <li>${data.video_info.has_audio ? 'Видео со звуком' : 'Видео без звука'}</li>
-                                    </ul>
-                                    <p class="processing-time">Время конвертации: ${processingTime.toFixed(1)} секунд</p>
-                                `;
-                                videoInfo.appendChild(infoDiv);
-                            } else {
-                                const timeInfo = document.createElement('p');
-                                timeInfo.classList.add('processing-time');
-                                timeInfo.textContent = `Время конвертации: ${processingTime.toFixed(1)} секунд`;
-                                videoInfo.appendChild(timeInfo);
-                            }
-                            
-                            // Настройка кнопки скачивания
-                            downloadButton.onclick = function() {
-                                window.location.href = data.download_url;
-                            };
-                            break;
-                            
-                        case 'error':
-                            // Останавливаем опрос
-                            clearInterval(pollingInterval);
-                            pollingInterval = null;
-                            
-                            // Обновляем статистику
-                            stats.totalConversions++;
-                            stats.failedConversions++;
-                            
-                            // Показываем ошибку
-                            showError(data.error || 'Ошибка конвертации. Пожалуйста, попробуйте с другим файлом.');
-                            break;
-                            
-                        default:
-                            // Неизвестный статус
-                            clearInterval(pollingInterval);
-                            pollingInterval = null;
-                            showError('Неизвестный статус конвертации. Пожалуйста, попробуйте снова.');
-                    }
-                })
+                .then(handleStatus)
                 .catch(error => {
-                    clearInterval(pollingInterval);
-                    pollingInterval = null;
+                    stopStatusTracking();
                     showError('Ошибка при проверке статуса. Пожалуйста, попробуйте снова.');
                 });
         }, 2000); // Проверять каждые 2 секунды
     }
     
+    // Функция форматирования оставшегося времени
+    function formatEta(seconds) {
+        if (seconds === null || seconds === undefined) {
+            return '';
+        }
+        if (seconds < 60) {
+            return `осталось ~${Math.ceil(seconds)} сек.`;
+        }
+        return `осталось ~${Math.ceil(seconds / 60)} мин.`;
+    }
+    
+    // Функция обработки статуса задачи
+    function handleStatus(data) {
+        switch (data.status) {
+            case 'queued':
+                // Показываем позицию в очереди
+                processingText.textContent = data.queue_position
+                    ? `В очереди на конвертацию: позиция ${data.queue_position}`
+                    : 'В очереди на конвертацию...';
+                break;
+
+            case 'uploaded':
+            case 'processing':
+                // Показываем прогресс конвертации, если FFmpeg уже его сообщил
+                if (data.progress) {
+                    const eta = formatEta(data.progress.eta);
+                    processingText.textContent = `Обработка видео... ${Math.round(data.progress.percent)}%` +
+                        (eta ? ` (${eta})` : '');
+                } else {
+                    processingText.textContent = 'Обработка видео...';
+                }
+                break;
+                
+            case 'completed':
+                // Останавливаем отслеживание
+                stopStatusTracking();
+                
+                // Обновляем статистику
+                stats.totalConversions++;
+                stats.successfulConversions++;
+                
+                // Вычисляем время обработки
+                const processingTime = (Date.now() - conversionStartTime) / 1000; // в секундах
+                
+                // Показываем результат
+                processingContainer.classList.add('hidden');
+                resultContainer.classList.remove('hidden');
+                
+                // Очищаем предыдущую информацию о видео
+                videoInfo.innerHTML = '';
+                
+                // Добавляем информацию о видео
+                if (data.video_info) {
+                    const infoDiv = document.createElement('div');
+                    infoDiv.innerHTML = `
+                        <h4>Информация о видео:</h4>
+                        <ul>
+                            <li>Разрешение: ${data.video_info.width}x${data.video_info.height}</li>
+                            <li>Длительность: ${Math.round(data.video_info.duration)} секунд</li>
+                            <li>${data.video_info.is_vertical ? 'Вертикальное видео' : 'Горизонтальное видео'}</li>
+                            <li>${data.video_info.has_audio ? 'Видео со звуком' : 'Видео без звука'}</li>
+                        </ul>
+                        <p class="processing-time">Время конвертации: ${processingTime.toFixed(1)} секунд</p>
+                    `;
+                    videoInfo.appendChild(infoDiv);
+                } else {
+                    const timeInfo = document.createElement('p');
+                    timeInfo.classList.add('processing-time');
+                    timeInfo.textContent = `Время конвертации: ${processingTime.toFixed(1)} секунд`;
+                    videoInfo.appendChild(timeInfo);
+                }
+                
+                // Настройка кнопки скачивания
+                downloadButton.onclick = function() {
+                    window.location.href = data.download_url;
+                };
+                break;
+                
+            case 'cancelled':
+            case 'error':
+                // Останавливаем отслеживание
+                stopStatusTracking();
+                
+                // Обновляем статистику
+                stats.totalConversions++;
+                stats.failedConversions++;
+                
+                // Показываем ошибку
+                showError(data.error || 'Ошибка конвертации. Пожалуйста, попробуйте с другим файлом.');
+                break;
+                
+            default:
+                // Неизвестный статус
+                stopStatusTracking();
+                showError('Неизвестный статус конвертации. Пожалуйста, попробуйте снова.');
+        }
+    }
+    
     // Функция отображения ошибки
     function showError(message) {
         uploadContainer.classList.add('hidden');
@@ -283,12 +543,9 @@ document.addEventListener('DOMContentLoaded', function() {
         fileName.textContent = 'Файл не выбран';
         uploadButton.disabled = true;
         
-        // Очищаем текущий идентификатор задачи и интервал
+        // Очищаем текущий идентификатор задачи и отслеживание статуса
         currentJobId = null;
-        if (pollingInterval) {
-            clearInterval(pollingInterval);
-            pollingInterval = null;
-        }
+        stopStatusTracking();
     }
     
     // Drag & drop функциональность
@@ -15,6 +15,7 @@ document.addEventListener('DOMContentLoaded', function() {
     const progressPercentage = document.getElementById('progress-percentage');
     const statusText = document.getElementById('status-text');
     const resultMessage = document.getElementById('result-message');
+    const processingText = document.getElementById('processing-text');
 
     const downloadButton = document.getElementById('download-button');
     const convertAnotherButton = document.getElementById('convert-another-button');
@@ -35,7 +36,7 @@ document.addEventListener('DOMContentLoaded', function() {
         uploadEndpoint: '/upload',
         statusEndpoint: '/status/',
         downloadEndpoint: '/download/',
-        maxFileSize: 1024 * 1024 * 1024, // 1GB
+        maxFileSize: 10 * 1024 * 1024 * 1024, // 10GB
         pollInterval: 2000 // 2 секунды
     });
 
@@ -74,6 +75,18 @@ document.addEventListener('DOMContentLoaded', function() {
             conversionStartTime = Date.now();
         },
 
+        // Ожидание в очереди
+        onQueued: (position) => {
+            processingText.textContent = position
+                ? `В очереди на конвертацию: позиция ${position}`
+                : 'В очереди на конвертацию...';
+        },
+
+        // Прогресс конвертации
+        onProcessingProgress: (progress) => {
+            processingText.textContent = `Обработка видео... ${Math.round(progress.percent)}%`;
+        },
+
         // Завершение обработки
         onProcessingComplete: (downloadUrl) => {
             // Показываем результат
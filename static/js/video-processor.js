@@ -8,9 +8,16 @@ class VideoProcessor {
         // Настройки по умолчанию
         this.config = {
             uploadEndpoint: '/upload',
+            uploadsEndpoint: '/uploads',
+            probeEndpoint: '/probe',
+            probeHeadBytes: 4 * 1024 * 1024, // Начало файла для предварительной проверки
+            probeTailBytes: 4 * 1024 * 1024, // Конец файла (например, атом moov в MP4)
+            parallelChunks: 4, // Количество одновременно отправляемых частей
+            chunkRetries: 3, // Количество попыток отправки одной части
             statusEndpoint: '/status/',
+            statusStreamSuffix: '/stream',
             downloadEndpoint: '/download/',
-            maxFileSize: 1024 * 1024 * 1024, // 1GB
+            maxFileSize: 10 * 1024 * 1024 * 1024, // 10GB
             pollInterval: 2000, // 2 секунды
             ...config
         };
@@ -21,6 +28,8 @@ class VideoProcessor {
             onUploadProgress: (percentage) => {},
             onUploadComplete: () => {},
             onProcessingStart: () => {},
+            onQueued: (position) => {},
+            onProcessingProgress: (progress) => {},
             onProcessingComplete: (downloadUrl) => {},
             onError: (message) => {},
             onReset: () => {}
@@ -31,6 +40,7 @@ class VideoProcessor {
             currentFile: null,
             jobId: null,
             pollingInterval: null,
+            statusSource: null,
             downloadUrl: null
         };
     }
@@ -69,7 +79,9 @@ class VideoProcessor {
     }
     
     /**
-     * Запускает процесс загрузки и обработки
+     * Запускает процесс загрузки и обработки.
+     * Файл отправляется частями параллельно; после обрыва соединения повторный
+     * вызов start() для того же файла дозагружает только недостающие части
      */
     start() {
         if (!this.state.currentFile) {
@@ -77,63 +89,281 @@ class VideoProcessor {
             return;
         }
         
-        // Создаем FormData для отправки файла
-        const formData = new FormData();
-        formData.append('file', this.state.currentFile);
+        const file = this.state.currentFile;
+        const storageKey = `upload:${file.name}:${file.size}:${file.lastModified}`;
+        
+        let probeId = null;
         
         // Оповещаем о начале загрузки
         this.events.onUploadStart();
         
-        // Создаем и настраиваем запрос
-        const xhr = new XMLHttpRequest();
+        this.probe(file)
+            .then(probe => {
+                // Потоковый контейнер конвертируется уже во время загрузки
+                if (probe && probe.pipelined) {
+                    return this.uploadStreamed(file, probe.probe_id);
+                }
+                
+                probeId = probe ? probe.probe_id : null;
+                return this.openUpload(file, storageKey)
+                    .then(upload => this.sendMissingChunks(file, upload).then(() => upload))
+                    .then(upload => this.requestJson('POST', `${this.config.uploadsEndpoint}/${upload.upload_id}/complete`, {
+                        probe_id: probeId
+                    }));
+            })
+            .then(response => {
+                localStorage.removeItem(storageKey);
+                this.state.jobId = response.job_id;
+                
+                // Оповещаем о завершении загрузки
+                this.events.onUploadComplete();
+                
+                // Начинаем отслеживать статус обработки
+                this.events.onProcessingStart();
+                this.startStatusTracking();
+            })
+            .catch(error => {
+                this.events.onError(error.message || 'Ошибка загрузки. Пожалуйста, попробуйте снова.');
+            });
+    }
+    
+    /**
+     * Проверяет файл по его началу и концу до полной загрузки.
+     * Отклоненный сервером файл не загружается; сбой самой проверки не мешает загрузке
+     * @param {File} file - Проверяемый файл
+     */
+    probe(file) {
+        const formData = new FormData();
+        formData.append('filename', file.name);
+        formData.append('size', file.size);
+        
+        if (file.size > this.config.probeHeadBytes + this.config.probeTailBytes) {
+            formData.append('head', file.slice(0, this.config.probeHeadBytes));
+            formData.append('tail', file.slice(file.size - this.config.probeTailBytes));
+        } else {
+            formData.append('head', file);
+        }
+        
+        return fetch(this.config.probeEndpoint, { method: 'POST', body: formData })
+            .then(response => response.ok ? response.json() : null)
+            .catch(() => null)
+            .then(probe => {
+                if (probe && probe.decision === 'reject') {
+                    throw new Error(`Файл нельзя конвертировать: ${probe.reason || 'видеопоток не найден'}`);
+                }
+                return probe;
+            });
+    }
+    
+    /**
+     * Выполняет JSON-запрос к API загрузки
+     * @param {string} method - HTTP-метод
+     * @param {string} url - Адрес запроса
+     * @param {Object} [body] - Тело запроса
+     */
+    requestJson(method, url, body) {
+        const options = { method: method };
+        if (body) {
+            options.headers = { 'Content-Type': 'application/json' };
+            options.body = JSON.stringify(body);
+        }
         
-        // Отслеживаем прогресс загрузки
-        xhr.upload.addEventListener('progress', (e) => {
-            if (e.lengthComputable) {
-                const percentage = Math.round((e.loaded / e.total) * 100);
-                this.events.onUploadProgress(percentage);
+        return fetch(url, options).catch(() => {
+            throw new Error('Ошибка сети. Проверьте соединение и попробуйте снова.');
+        }).then(response => response.json().catch(() => ({})).then(data => {
+            if (!response.ok) {
+                const error = new Error(data.error || 'Ошибка загрузки. Пожалуйста, попробуйте снова.');
+                error.status = response.status;
+                throw error;
             }
+            return data;
+        }));
+    }
+    
+    /**
+     * Возобновляет сохраненную загрузку или начинает новую
+     * @param {File} file - Загружаемый файл
+     * @param {string} storageKey - Ключ сохраненной загрузки в localStorage
+     */
+    openUpload(file, storageKey) {
+        const create = () => this.requestJson('POST', this.config.uploadsEndpoint, {
+            filename: file.name,
+            size: file.size
+        }).then(upload => {
+            localStorage.setItem(storageKey, upload.upload_id);
+            return {
+                upload_id: upload.upload_id,
+                chunk_size: upload.chunk_size,
+                missing_chunks: Array.from({ length: upload.total_chunks }, (_, index) => index)
+            };
         });
         
-        // Обработка завершения запроса
-        xhr.addEventListener('load', () => {
-            if (xhr.status >= 200 && xhr.status < 300) {
-                try {
-                    const response = JSON.parse(xhr.responseText);
-                    this.state.jobId = response.job_id;
-                    
-                    // Оповещаем о завершении загрузки
-                    this.events.onUploadComplete();
-                    
-                    // Начинаем отслеживать статус обработки
-                    this.events.onProcessingStart();
-                    this.startStatusPolling();
-                } catch (error) {
-                    this.events.onError('Ошибка сервера. Пожалуйста, попробуйте снова.');
+        const savedUploadId = localStorage.getItem(storageKey);
+        if (!savedUploadId) {
+            return create();
+        }
+        
+        return this.requestJson('GET', `${this.config.uploadsEndpoint}/${savedUploadId}`).catch(() => {
+            localStorage.removeItem(storageKey);
+            return create();
+        });
+    }
+    
+    /**
+     * Отправляет недостающие части несколькими параллельными потоками
+     * @param {File} file - Загружаемый файл
+     * @param {Object} upload - Состояние загрузки от сервера
+     */
+    sendMissingChunks(file, upload) {
+        const pending = upload.missing_chunks.slice();
+        const inFlight = {};
+        const chunkLength = index => Math.min(upload.chunk_size, file.size - index * upload.chunk_size);
+        let completedBytes = file.size - pending.reduce((total, index) => total + chunkLength(index), 0);
+        
+        const updateProgress = () => {
+            let loaded = completedBytes;
+            Object.keys(inFlight).forEach(index => { loaded += inFlight[index]; });
+            this.events.onUploadProgress(Math.round((loaded / file.size) * 100));
+        };
+        
+        const sendWithRetry = (index, attempt) => this.sendChunk(file, upload, index, chunkLength(index), loaded => {
+            inFlight[index] = loaded;
+            updateProgress();
+        }).catch(error => {
+            // Ошибки клиента (4xx) повторять бессмысленно
+            if (attempt >= this.config.chunkRetries || (error.status && error.status < 500)) {
+                throw error;
+            }
+            inFlight[index] = 0;
+            return new Promise(resolve => setTimeout(resolve, 1000 * attempt))
+                .then(() => sendWithRetry(index, attempt + 1));
+        });
+        
+        const nextChunk = () => {
+            const index = pending.shift();
+            if (index === undefined) {
+                return Promise.resolve();
+            }
+            return sendWithRetry(index, 1).then(() => {
+                delete inFlight[index];
+                completedBytes += chunkLength(index);
+                updateProgress();
+                return nextChunk();
+            });
+        };
+        
+        updateProgress();
+        return Promise.all(Array.from({ length: this.config.parallelChunks }, nextChunk));
+    }
+    
+    /**
+     * Отправляет одну часть файла
+     * @param {File} file - Загружаемый файл
+     * @param {Object} upload - Состояние загрузки
+     * @param {number} index - Номер части
+     * @param {number} length - Размер части
+     * @param {Function} onProgress - Обработчик прогресса отправки части
+     */
+    sendChunk(file, upload, index, length, onProgress) {
+        const start = index * upload.chunk_size;
+        const end = start + length;
+        
+        return this.sendBody('PUT', `${this.config.uploadsEndpoint}/${upload.upload_id}`, {
+            'Content-Range': `bytes ${start}-${end - 1}/${file.size}`
+        }, file.slice(start, end), onProgress);
+    }
+    
+    /**
+     * Отправляет файл одним запросом: потоковый контейнер конвертируется
+     * на сервере во время загрузки
+     * @param {File} file - Загружаемый файл
+     * @param {string} probeId - Идентификатор предварительной проверки
+     */
+    uploadStreamed(file, probeId) {
+        const url = `${this.config.uploadEndpoint}?filename=${encodeURIComponent(file.name)}` +
+            `&probe_id=${encodeURIComponent(probeId)}`;
+        return this.sendBody('POST', url, { 'Content-Type': 'application/octet-stream' }, file, loaded => {
+            this.events.onUploadProgress(Math.round((loaded / file.size) * 100));
+        });
+    }
+    
+    /**
+     * Отправляет тело запроса с отслеживанием прогресса
+     * @param {string} method - HTTP-метод
+     * @param {string} url - Адрес запроса
+     * @param {Object} headers - Заголовки запроса
+     * @param {Blob} body - Тело запроса
+     * @param {Function} onProgress - Обработчик прогресса отправки
+     */
+    sendBody(method, url, headers, body, onProgress) {
+        return new Promise((resolve, reject) => {
+            const xhr = new XMLHttpRequest();
+            
+            xhr.upload.addEventListener('progress', (e) => onProgress(e.loaded));
+            
+            xhr.addEventListener('load', () => {
+                if (xhr.status >= 200 && xhr.status < 300) {
+                    try {
+                        resolve(JSON.parse(xhr.responseText));
+                    } catch (error) {
+                        resolve({});
+                    }
+                    return;
                 }
-            } else {
+                let message = 'Ошибка загрузки. Пожалуйста, попробуйте снова.';
                 try {
-                    const response = JSON.parse(xhr.responseText);
-                    this.events.onError(response.error || 'Ошибка загрузки. Пожалуйста, попробуйте снова.');
+                    message = JSON.parse(xhr.responseText).error || message;
                 } catch (error) {
-                    this.events.onError('Ошибка загрузки. Пожалуйста, попробуйте снова.');
+                    // Оставляем сообщение по умолчанию
                 }
-            }
+                const error = new Error(message);
+                error.status = xhr.status;
+                reject(error);
+            });
+            
+            // Обработка ошибок сети
+            xhr.addEventListener('error', () => {
+                reject(new Error('Ошибка сети. Проверьте соединение и попробуйте снова.'));
+            });
+            
+            // Обработка прерывания запроса
+            xhr.addEventListener('abort', () => {
+                reject(new Error('Загрузка прервана. Пожалуйста, попробуйте снова.'));
+            });
+            
+            xhr.open(method, url, true);
+            Object.keys(headers).forEach(name => xhr.setRequestHeader(name, headers[name]));
+            xhr.send(body);
         });
+    }
+    
+    /**
+     * Начинает отслеживание статуса через SSE-поток сервера.
+     * Если браузер не поддерживает EventSource или поток закрыт, переходит на опрос
+     */
+    startStatusTracking() {
+        this.stopStatusPolling();
         
-        // Обработка ошибок сети
-        xhr.addEventListener('error', () => {
-            this.events.onError('Ошибка сети. Проверьте соединение и попробуйте снова.');
-        });
+        if (!window.EventSource) {
+            this.startStatusPolling();
+            return;
+        }
         
-        // Обработка прерывания запроса
-        xhr.addEventListener('abort', () => {
-            this.events.onError('Загрузка прервана. Пожалуйста, попробуйте снова.');
-        });
+        const url = `${this.config.statusEndpoint}${this.state.jobId}${this.config.statusStreamSuffix}`;
+        this.state.statusSource = new EventSource(url);
         
-        // Отправляем запрос
-        xhr.open('POST', this.config.uploadEndpoint, true);
-        xhr.send(formData);
+        this.state.statusSource.onmessage = (event) => {
+            this.handleStatus(JSON.parse(event.data));
+        };
+        
+        this.state.statusSource.onerror = () => {
+            // При обрыве браузер переподключается сам
+            const source = this.state.statusSource;
+            if (source && source.readyState === EventSource.CLOSED) {
+                this.state.statusSource = null;
+                this.startStatusPolling();
+            }
+        };
     }
     
     /**
@@ -164,39 +394,7 @@ class VideoProcessor {
                 }
                 return response.json();
             })
-            .then(data => {
-                // Обрабатываем различные статусы
-                switch (data.status) {
-                    case 'uploaded':
-                    case 'processing':
-                        // Продолжаем опрос
-                        break;
-                        
-                    case 'completed':
-                        // Останавливаем опрос
-                        this.stopStatusPolling();
-                        
-                        // Сохраняем URL для скачивания
-                        this.state.downloadUrl = data.download_url;
-                        
-                        // Оповещаем о завершении обработки
-                        this.events.onProcessingComplete(data.download_url);
-                        break;
-                        
-                    case 'error':
-                        // Останавливаем опрос
-                        this.stopStatusPolling();
-                        
-                        // Оповещаем об ошибке
-                        this.events.onError(data.error || 'Ошибка конвертации. Пожалуйста, попробуйте другой файл.');
-                        break;
-                        
-                    default:
-                        // Неизвестный статус
-                        this.stopStatusPolling();
-                        this.events.onError('Неизвестный статус. Пожалуйста, попробуйте снова.');
-                }
-            })
+            .then(data => this.handleStatus(data))
             .catch(error => {
                 this.stopStatusPolling();
                 this.events.onError('Ошибка проверки статуса. Пожалуйста, попробуйте снова.');
@@ -204,9 +402,60 @@ class VideoProcessor {
     }
     
     /**
-     * Останавливает опрос статуса
+     * Обрабатывает очередное состояние задачи
+     * @param {Object} data - Статус задачи от сервера
+     */
+    handleStatus(data) {
+        // Обрабатываем различные статусы
+        switch (data.status) {
+            case 'queued':
+                // Задача ожидает свободного обработчика
+                this.events.onQueued(data.queue_position);
+                break;
+                
+            case 'uploaded':
+            case 'processing':
+                // Передаем прогресс FFmpeg, если он уже есть
+                if (data.progress) {
+                    this.events.onProcessingProgress(data.progress);
+                }
+                break;
+                
+            case 'completed':
+                // Останавливаем отслеживание
+                this.stopStatusPolling();
+                
+                // Сохраняем URL для скачивания
+                this.state.downloadUrl = data.download_url;
+                
+                // Оповещаем о завершении обработки
+                this.events.onProcessingComplete(data.download_url);
+                break;
+                
+            case 'cancelled':
+            case 'error':
+                // Останавливаем отслеживание
+                this.stopStatusPolling();
+                
+                // Оповещаем об ошибке
+                this.events.onError(data.error || 'Ошибка конвертации. Пожалуйста, попробуйте другой файл.');
+                break;
+                
+            default:
+                // Неизвестный статус
+                this.stopStatusPolling();
+                this.events.onError('Неизвестный статус. Пожалуйста, попробуйте снова.');
+        }
+    }
+    
+    /**
+     * Останавливает отслеживание статуса (SSE-поток и опрос)
      */
     stopStatusPolling() {
+        if (this.state.statusSource) {
+            this.state.statusSource.close();
+            this.state.statusSource = null;
+        }
         if (this.state.pollingInterval) {
             clearInterval(this.state.pollingInterval);
             this.state.pollingInterval = null;
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+import os
+import time
+import shutil
+import threading
+from typing import Callable, Iterable, List, Optional, Tuple
+import logging
+
+from database import SQLiteDatabase
+
+logger = logging.getLogger(__name__)
+
+
+def path_size(path: str) -> int:
+    """Размер файла или суммарный размер файлов директории"""
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(
+        os.path.getsize(os.path.join(directory, name))
+        for directory, _, names in os.walk(path)
+        for name in names
+    )
+
+
+def path_mtime(path: str) -> float:
+    """Время последнего изменения файла или самого свежего файла директории"""
+    mtime = os.path.getmtime(path)
+    if os.path.isdir(path):
+        for directory, _, names in os.walk(path):
+            for name in names:
+                try:
+                    mtime = max(mtime, os.path.getmtime(os.path.join(directory, name)))
+                except OSError:
+                    continue
+    return mtime
+
+
+def remove_path(path: str) -> bool:
+    """Удаляет файл или директорию; возвращает True, если что-то удалено"""
+    try:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+    except OSError as e:
+        logger.error(f"Не удалось удалить {path}: {e}")
+        return False
+
+
+class OutputStorage:
+    """
+    Учет результатов в Render/: уникальные имена, срок хранения и квота.
+
+    Результаты записываются в индекс SQLite с размером и временем создания,
+    а суммарный объем хранится отдельным счетчиком. Поэтому вытеснение по
+    сроку и по квоте выбирает самые старые записи по индексу created и не
+    сканирует директорию. Для каждой основы имени хранится следующий
+    свободный номер: резервирование имени - одна транзакция без перебора
+    _1, _2, ... и без гонки между задачами в разных процессах.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS output_files (
+            name TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            created REAL NOT NULL,
+            job_id TEXT
+        );
+        CREATE INDEX IF NOT EXISTS output_files_created ON output_files (created);
+
+        CREATE TABLE IF NOT EXISTS output_names (
+            stem TEXT PRIMARY KEY,
+            next_suffix INTEGER NOT NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS output_totals (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+    """
+
+    def __init__(self, render_dir: str, db_path: str):
+        """
+        Инициализирует учет результатов.
+
+        Args:
+            render_dir: Директория результатов
+            db_path: Путь к базе данных SQLite с индексом
+        """
+        self.render_dir = render_dir
+        os.makedirs(render_dir, exist_ok=True)
+        self.db = SQLiteDatabase(db_path)
+        self.db.executescript(self.SCHEMA)
+
+    def reserve_name(self, stem: str, extension: str = '') -> Tuple[str, str]:
+        """
+        Резервирует уникальное имя результата.
+
+        Первое имя - stem + extension, следующие - stem_1, stem_2, ... Номер
+        выдается атомарно; файлы, созданные до появления индекса, пропускаются.
+
+        Returns:
+            Кортеж (относительное_имя, полный_путь)
+        """
+        with self.db.transaction() as connection:
+            row = connection.execute(
+                'SELECT next_suffix FROM output_names WHERE stem = ?', (stem,)
+            ).fetchone()
+            suffix = row['next_suffix'] if row else 0
+            while True:
+                name = f"{stem}_{suffix}{extension}" if suffix else f"{stem}{extension}"
+                path = os.path.join(self.render_dir, name)
+                if not os.path.exists(path):
+                    break
+                suffix += 1
+            connection.execute(
+                'INSERT INTO output_names (stem, next_suffix) VALUES (?, ?) '
+                'ON CONFLICT (stem) DO UPDATE SET next_suffix = excluded.next_suffix',
+                (stem, suffix + 1)
+            )
+        return name, path
+
+    def _add(self, connection, name: str, size: int, created: float, job_id: Optional[str]):
+        """Добавляет или обновляет запись индекса и суммарный объем"""
+        row = connection.execute('SELECT size FROM output_files WHERE name = ?', (name,)).fetchone()
+        delta = size - (row['size'] if row else 0)
+        connection.execute(
+            'INSERT INTO output_files (name, size, created, job_id) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (name) DO UPDATE SET size = excluded.size, '
+            'job_id = COALESCE(excluded.job_id, output_files.job_id)',
+            (name, size, created, job_id)
+        )
+        connection.execute(
+            "INSERT INTO output_totals (key, value) VALUES ('bytes', ?) "
+            'ON CONFLICT (key) DO UPDATE SET value = value + excluded.value',
+            (delta,)
+        )
+
+    def register(self, name: str, job_id: Optional[str] = None):
+        """Учитывает готовый результат (файл или директорию в render_dir)"""
+        path = os.path.join(self.render_dir, name)
+        try:
+            size = path_size(path)
+        except OSError as e:
+            logger.error(f"Не удалось учесть результат {name}: {e}")
+            return
+        with self.db.transaction() as connection:
+            self._add(connection, name, size, time.time(), job_id)
+
+    def total_bytes(self) -> int:
+        """Суммарный объем учтенных результатов"""
+        row = self.db.connection().execute(
+            "SELECT value FROM output_totals WHERE key = 'bytes'"
+        ).fetchone()
+        return row['value'] if row else 0
+
+    def _pop_oldest(self, limit: int, created_before: Optional[float] = None) -> List[Tuple[str, Optional[str]]]:
+        """Удаляет из индекса самые старые записи и возвращает их (имя, job_id)"""
+        with self.db.transaction() as connection:
+            if created_before is None:
+                rows = connection.execute(
+                    'SELECT name, size, job_id FROM output_files ORDER BY created LIMIT ?', (limit,)
+                ).fetchall()
+            else:
+                rows = connection.execute(
+                    'SELECT name, size, job_id FROM output_files WHERE created < ? ORDER BY created LIMIT ?',
+                    (created_before, limit)
+                ).fetchall()
+            for row in rows:
+                connection.execute('DELETE FROM output_files WHERE name = ?', (row['name'],))
+            connection.execute(
+                "UPDATE output_totals SET value = value - ? WHERE key = 'bytes'",
+                (sum(row['size'] for row in rows),)
+            )
+        return [(row['name'], row['job_id']) for row in rows]
+
+    def evict(self, max_age: Optional[float], max_bytes: Optional[int],
+              batch_size: int = 100) -> List[Tuple[str, Optional[str]]]:
+        """
+        Удаляет результаты старше max_age и самые старые сверх квоты max_bytes.
+
+        Записи сначала удаляются из индекса, затем с диска, поэтому один
+        результат не удалят одновременно несколько процессов.
+
+        Returns:
+            Список (имя, job_id) удаленных результатов
+        """
+        evicted = []
+        if max_age:
+            cutoff = time.time() - max_age
+            while True:
+                rows = self._pop_oldest(batch_size, cutoff)
+                evicted.extend(rows)
+                if len(rows) < batch_size:
+                    break
+        if max_bytes is not None:
+            while self.total_bytes() > max_bytes:
+                rows = self._pop_oldest(1)
+                if not rows:
+                    break
+                evicted.extend(rows)
+
+        for name, _ in evicted:
+            remove_path(os.path.join(self.render_dir, name))
+        if evicted:
+            logger.info(f"Удалено результатов: {len(evicted)}, занято {self.total_bytes() / (1024 * 1024):.1f} МБ")
+        return evicted
+
+    def adopt_unindexed(self, min_age: float = 0) -> int:
+        """
+        Учитывает результаты, которых нет в индексе.
+
+        Это файлы, созданные до появления индекса, и недописанные результаты
+        аварийно завершившихся задач. Время создания берется из mtime, поэтому
+        они удаляются по сроку хранения как обычные результаты.
+
+        Недавно измененные записи пропускаются: их может дописывать задача,
+        которая еще выполняется (в том числе в другом процессе); по
+        завершении она сама добавит результат в индекс (register).
+
+        Args:
+            min_age: Минимальное время с последнего изменения в секундах
+
+        Returns:
+            Количество добавленных записей
+        """
+        names = os.listdir(self.render_dir)
+        connection = self.db.connection()
+        known = {row['name'] for row in connection.execute('SELECT name FROM output_files').fetchall()}
+        cutoff = time.time() - min_age
+        adopted = 0
+        with self.db.transaction() as connection:
+            for name in names:
+                if name in known:
+                    continue
+                path = os.path.join(self.render_dir, name)
+                try:
+                    created = path_mtime(path)
+                    if created >= cutoff:
+                        continue
+                    size = path_size(path)
+                except OSError:
+                    continue
+                self._add(connection, name, size, created, None)
+                adopted += 1
+        if adopted:
+            logger.info(f"Добавлено в учет результатов без записи в индексе: {adopted}")
+        return adopted
+
+    def stats(self) -> dict:
+        """Возвращает количество и объем учтенных результатов"""
+        count = self.db.connection().execute('SELECT COUNT(*) FROM output_files').fetchone()[0]
+        return {'files': count, 'bytes': self.total_bytes()}
+
+
+def reclaim_upload_orphans(upload_dir: str, referenced: Iterable[str], min_age: float) -> int:
+    """
+    Удаляет из upload_dir файлы и директории, на которые не ссылается ни одна задача.
+
+    Так убираются загрузки и временные директории сегментов, оставшиеся
+    после аварийного завершения процесса. Недавно измененные записи не
+    трогаются: их может дописывать загрузка, еще не поставленная в очередь.
+
+    Args:
+        upload_dir: Директория загрузок
+        referenced: Пути, которые еще нужны (ожидающие задачи, загрузки частями)
+        min_age: Минимальное время с последнего изменения в секундах
+
+    Returns:
+        Количество удаленных записей
+    """
+    keep = {os.path.abspath(path) for path in referenced}
+    cutoff = time.time() - min_age
+    removed = 0
+    with os.scandir(upload_dir) as entries:
+        for entry in entries:
+            path = os.path.abspath(entry.path)
+            try:
+                if path in keep or entry.stat().st_mtime >= cutoff:
+                    continue
+            except OSError:
+                continue
+            if remove_path(path):
+                removed += 1
+    if removed:
+        logger.info(f"Удалено потерянных загрузок: {removed}")
+    return removed
+
+
+class Janitor:
+    """
+    Фоновый поток обслуживания диска и базы.
+
+    Задачи запуска выполняются один раз, периодические - каждые interval
+    секунд. Ошибка одной задачи записывается в журнал и не останавливает
+    остальные.
+    """
+
+    def __init__(self, interval: float, tasks: List[Callable[[], object]],
+                 startup_tasks: Optional[List[Callable[[], object]]] = None):
+        """
+        Инициализирует поток обслуживания.
+
+        Args:
+            interval: Период запуска задач в секундах
+            tasks: Периодические задачи
+            startup_tasks: Задачи, выполняемые один раз перед первым циклом
+        """
+        self.interval = interval
+        self.tasks = tasks
+        self.startup_tasks = startup_tasks or []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Запускает поток (повторный вызов ничего не делает)"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name='janitor', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Останавливает поток после текущей задачи"""
+        self._stop.set()
+
+    def _run(self, tasks: List[Callable[[], object]]):
+        """Выполняет задачи, не прерываясь на ошибках"""
+        for task in tasks:
+            try:
+                task()
+            except Exception as e:
+                logger.error(f"Ошибка обслуживания ({getattr(task, '__name__', task)}): {e}")
+
+    def _loop(self):
+        """Основной цикл потока"""
+        self._run(self.startup_tasks)
+        while not self._stop.is_set():
+            self._run(self.tasks)
+            self._stop.wait(self.interval)
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Тесты очереди задач (job_queue.py) на временной базе SQLite.
+
+Запуск: python -m pytest -q test_job_queue.py
+"""
+import time
+
+import pytest
+
+import job_queue
+from job_queue import QueueFullError, SQLiteJobQueue
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    """Путь к временной базе очереди"""
+    return str(tmp_path / 'queue.db')
+
+
+@pytest.fixture
+def queue(db_path):
+    """Очередь без задержки повторов и без старения приоритета"""
+    return SQLiteJobQueue(db_path, lease_seconds=60, max_attempts=3, retry_delay=0, aging_rate=0)
+
+
+def expiring_queue(db_path, max_attempts=3):
+    """Та же база, но аренда истекает сразу после выдачи (обработчик 'упал')"""
+    return SQLiteJobQueue(db_path, lease_seconds=-1, max_attempts=max_attempts, retry_delay=0, aging_rate=0)
+
+
+def test_lease_returns_payload_and_counts_attempts(queue):
+    queue.enqueue('a', {'input_path': 'a.mp4'})
+
+    lease = queue.lease('w1')
+
+    assert lease.job_id == 'a'
+    assert lease.payload == {'input_path': 'a.mp4'}
+    assert lease.attempts == 1
+    assert not lease.final_attempt
+    assert queue.lease('w2') is None
+
+
+def test_complete_removes_job(queue):
+    queue.enqueue('a', {})
+    lease = queue.lease('w1')
+
+    queue.complete(lease)
+
+    assert queue.lease('w1') is None
+    assert queue.stats()['queued_jobs'] == 0
+    assert queue.stats()['active_jobs'] == 0
+
+
+def test_expired_lease_is_reclaimed_by_another_worker(db_path, queue):
+    queue.enqueue('a', {})
+    crashed = expiring_queue(db_path).lease('w1')
+
+    lease = queue.lease('w2')
+
+    assert lease.job_id == 'a'
+    assert lease.attempts == crashed.attempts + 1
+    # Первый обработчик больше не владеет задачей
+    assert not queue.heartbeat(crashed)
+    assert crashed.lost
+    assert queue.heartbeat(lease)
+
+
+def test_heartbeat_keeps_lease_from_being_reclaimed(queue):
+    queue.enqueue('a', {})
+    lease = queue.lease('w1')
+
+    assert queue.heartbeat(lease)
+    assert queue.lease('w2') is None
+
+
+def test_reap_expired_dead_letters_after_last_attempt(db_path, queue):
+    queue.enqueue('a', {'input_path': 'a.mp4'})
+    crashing = expiring_queue(db_path, max_attempts=2)
+    crashing.lease('w1')
+    crashing.lease('w1')
+
+    # Попытки исчерпаны: задача не выдается повторно, а уходит в dead-letter
+    assert crashing.lease('w2') is None
+    assert crashing.reap_expired() == [('a', {'input_path': 'a.mp4'})]
+    assert crashing.reap_expired() == []
+    assert queue.stats()['dead_jobs'] == 1
+
+
+def test_reap_expired_ignores_live_leases(queue):
+    queue.enqueue('a', {})
+    queue.lease('w1')
+
+    assert queue.reap_expired() == []
+
+
+def test_fail_retries_until_max_attempts(queue):
+    queue.enqueue('a', {})
+
+    for attempt in (1, 2):
+        lease = queue.lease('w1')
+        assert lease.attempts == attempt
+        assert queue.fail(lease, 'FFmpeg завершился с ошибкой') is False
+
+    lease = queue.lease('w1')
+    assert lease.final_attempt
+    assert queue.fail(lease, 'FFmpeg завершился с ошибкой') is True
+    assert queue.lease('w1') is None
+    assert queue.stats()['dead_jobs'] == 1
+
+
+def test_fail_delays_retry(db_path):
+    queue = SQLiteJobQueue(db_path, retry_delay=60, aging_rate=0)
+    queue.enqueue('a', {})
+    queue.fail(queue.lease('w1'), 'ошибка')
+
+    assert queue.lease('w1') is None
+    # Задача ждет повтора и не считается впереди других
+    queue.enqueue('b', {})
+    assert queue.position('b') == 1
+
+
+def test_fail_without_retry_dead_letters_immediately(queue):
+    queue.enqueue('a', {})
+    lease = queue.lease('w1')
+    lease.retryable = False
+
+    assert lease.final_attempt
+    assert queue.fail(lease, 'Видеопоток не найден в файле') is True
+    assert queue.lease('w1') is None
+    assert queue.stats()['dead_jobs'] == 1
+
+
+def test_fail_after_lost_lease_is_ignored(db_path, queue):
+    queue.enqueue('a', {})
+    crashed = expiring_queue(db_path).lease('w1')
+    lease = queue.lease('w2')
+
+    assert queue.fail(crashed, 'ошибка') is False
+    assert crashed.lost
+    # Задача осталась у нового обработчика
+    assert queue.heartbeat(lease)
+
+
+def test_cancel_removes_waiting_job(queue):
+    queue.enqueue('a', {'input_path': 'a.mp4'})
+
+    assert queue.cancel('a') == {'input_path': 'a.mp4'}
+    assert queue.cancel('a') is None
+    assert queue.lease('w1') is None
+
+
+def test_cancel_does_not_touch_running_job(queue):
+    queue.enqueue('a', {})
+    queue.lease('w1')
+
+    assert queue.cancel('a') is None
+    assert queue.stats()['active_jobs'] == 1
+
+
+def test_request_cancel_reaches_worker_on_heartbeat(queue):
+    queue.enqueue('a', {})
+    queue.enqueue('b', {})
+    lease = queue.lease('w1')
+
+    # Ожидающую задачу отменяет cancel, а не request_cancel
+    assert queue.request_cancel('b') is False
+    assert queue.request_cancel('a') is True
+    assert not lease.cancel_requested
+
+    assert queue.heartbeat(lease)
+    assert lease.cancel_requested
+
+
+def test_shorter_jobs_are_leased_first(queue):
+    queue.enqueue_many([('long', {}, 600), ('short', {}, 10), ('medium', {}, 60)])
+
+    assert [queue.lease('w1').job_id for _ in range(3)] == ['short', 'medium', 'long']
+
+
+def test_equal_cost_jobs_keep_arrival_order(db_path, monkeypatch):
+    queue = SQLiteJobQueue(db_path, aging_rate=1.0)
+    now = [1000.0]
+    monkeypatch.setattr(job_queue.time, 'time', lambda: now[0])
+    for job_id in ('first', 'second', 'third'):
+        queue.enqueue(job_id, {}, 30)
+        now[0] += 1
+
+    assert [queue.lease('w1').job_id for _ in range(3)] == ['first', 'second', 'third']
+
+
+def test_aging_lets_long_job_overtake_newer_short_jobs(db_path, monkeypatch):
+    queue = SQLiteJobQueue(db_path, aging_rate=1.0)
+    now = [1000.0]
+    monkeypatch.setattr(job_queue.time, 'time', lambda: now[0])
+    queue.enqueue('long', {}, 300)
+
+    # Короткая задача, пришедшая сразу, выполняется раньше
+    now[0] += 100
+    queue.enqueue('early_short', {}, 10)
+    # Короткая задача, пришедшая позже, чем через оценку длинной, - уже нет
+    now[0] += 250
+    queue.enqueue('late_short', {}, 10)
+
+    assert [queue.lease('w1').job_id for _ in range(3)] == ['early_short', 'long', 'late_short']
+
+
+def test_position_follows_priority(queue):
+    queue.enqueue_many([('long', {}, 600), ('short', {}, 10)])
+
+    assert queue.position('short') == 1
+    assert queue.position('long') == 2
+    assert queue.position('missing') is None
+
+
+def test_forecast_ignores_jobs_waiting_for_retry(db_path):
+    queue = SQLiteJobQueue(db_path, retry_delay=600, aging_rate=0)
+    queue.register_worker('w1')
+    queue.enqueue('delayed', {}, 100)
+    queue.fail(queue.lease('w1'), 'ошибка')
+    queue.enqueue('next', {}, 200)
+
+    now = time.time()
+    delayed = queue.forecast('delayed')
+    upcoming = queue.forecast('next')
+
+    # Ожидающая повтора задача не задерживает остальные, а сама начнется не раньше повтора
+    assert upcoming['predicted_start'] < now + 5
+    assert delayed['predicted_start'] >= now + 590
+    assert queue.position('next') == 1
+
+
+def test_enqueue_many_is_all_or_nothing(db_path):
+    queue = SQLiteJobQueue(db_path, max_size=2)
+    queue.enqueue('a', {})
+
+    with pytest.raises(QueueFullError) as error:
+        queue.enqueue_many([('b', {}, 0), ('c', {}, 0)])
+
+    assert error.value.retry_after > 0
+    assert queue.stats()['queued_jobs'] == 1
+    assert queue.cancel('b') is None
+
+
+def test_reenqueue_of_dead_job_resets_attempts(queue):
+    queue.enqueue('a', {})
+    lease = queue.lease('w1')
+    lease.retryable = False
+    queue.fail(lease, 'ошибка')
+
+    queue.enqueue('a', {'retry': True})
+    lease = queue.lease('w1')
+
+    assert lease.attempts == 1
+    assert lease.payload == {'retry': True}
+
+
+def test_queue_is_shared_between_instances(db_path, queue):
+    other = SQLiteJobQueue(db_path, aging_rate=0)
+    queue.enqueue('a', {})
+
+    lease = other.lease('w1')
+
+    assert lease.job_id == 'a'
+    assert queue.lease('w2') is None
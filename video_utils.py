@@ -1,17 +1,118 @@
 #!/usr/bin/env python3
 import os
 import json
+import math
+import time
+import hashlib
 import subprocess
 import re
 import shlex
-from typing import Dict, Tuple, Optional, Any, List
+import shutil
+import tempfile
+import threading
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Tuple, Optional, Any, List
 import logging
 
+import metrics
+from cpu_partition import CPUPartitioner
+from encoder_profiles import DEFAULT_PROFILE, PROFILES, build_profile_args, ffmpeg_capabilities
+from ffmpeg_supervisor import FFmpegAbortedError, FFmpegSupervisor, StderrTail
+from media_probe import MediaProbe, NoVideoStreamError
+from storage_manager import OutputStorage, path_size
+
 # Настройка логирования
 logging.basicConfig(level=logging.INFO, 
                     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Расширения видеофайлов, принимаемых для конвертации
+VIDEO_EXTENSIONS = {
+    'mp4', 'avi', 'mov', 'wmv', 'mkv', 'flv', 'webm', '3gp', 'ts', 'mpg', 'mpeg', 'm4v', 'mts', 'm2ts'
+}
+
+class FFmpegProgressParser:
+    """
+    Разбирает вывод FFmpeg с ключом -progress.
+
+    FFmpeg периодически печатает блок строк вида key=value, который
+    завершается строкой progress=continue или progress=end.
+    """
+
+    def __init__(self, duration: float):
+        """
+        Args:
+            duration: Длительность исходного видео в секундах (для расчета процента)
+        """
+        self.duration = duration
+        self._values = {}
+
+    @staticmethod
+    def _parse_out_time(values: Dict[str, str]) -> float:
+        """Извлекает обработанное время в секундах"""
+        # out_time_ms, несмотря на название, тоже содержит микросекунды
+        for key in ('out_time_us', 'out_time_ms'):
+            value = values.get(key, '')
+            if value.lstrip('-').isdigit():
+                return max(int(value), 0) / 1000000
+        match = re.match(r'(\d+):(\d+):(\d+(?:\.\d+)?)', values.get('out_time', ''))
+        if match:
+            hours, minutes, seconds = match.groups()
+            return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+        return 0.0
+
+    def feed(self, line: str) -> Optional[Dict[str, Any]]:
+        """
+        Обрабатывает очередную строку вывода.
+
+        Args:
+            line: Строка из stdout FFmpeg
+
+        Returns:
+            Снимок прогресса, если строка завершила блок, иначе None
+        """
+        key, sep, value = line.strip().partition('=')
+        if not sep:
+            return None
+        self._values[key] = value.strip()
+        if key != 'progress':
+            return None
+
+        values, self._values = self._values, {}
+
+        out_time = self._parse_out_time(values)
+
+        try:
+            fps = float(values.get('fps', 0))
+        except ValueError:
+            fps = 0.0
+
+        # Скорость приходит в виде "1.52x" или "N/A"
+        try:
+            speed = float(values.get('speed', '').rstrip('x'))
+        except ValueError:
+            speed = 0.0
+
+        finished = value.strip() == 'end'
+        percent = 0.0
+        eta = None
+        if self.duration > 0:
+            percent = min(out_time / self.duration * 100, 100.0)
+            if speed > 0:
+                eta = max(self.duration - out_time, 0) / speed
+        if finished:
+            percent = 100.0
+            eta = 0.0
+
+        return {
+            'out_time': round(out_time, 2),
+            'fps': fps,
+            'speed': speed,
+            'percent': round(percent, 1),
+            'eta': round(eta, 1) if eta is not None else None
+        }
+
 class VideoProcessor:
     """
     Класс для обработки видео с использованием FFmpeg.
@@ -19,136 +120,249 @@ class VideoProcessor:
     конвертации в MP4 и обработки вертикальных видео.
     """
     
-    def __init__(self, render_dir: str = 'Render', temp_dir: str = 'uploads'):
+    # Параметры выходного файла. Любое изменение меняет отпечаток
+    # conversion_params_key(), и ранее закешированные результаты не используются
+    OUTPUT_SPEC = {
+        'container': 'mp4',
+        'video_codec': 'libx264',
+        'fps': 25,
+        'vertical_max_height': 1080,
+        'min_video_bitrate': 1000000,
+        'audio_codec': 'aac',
+        'default_audio_bitrate': '128k',
+        # moov в начале файла: браузер начинает воспроизведение и перемотку до полной загрузки
+        'faststart': True
+    }
+    
+    # Условия, при которых видеопоток переносится в MP4 без перекодирования
+    REMUX_H264_PROFILES = {'Constrained Baseline', 'Baseline', 'Main', 'High'}
+    REMUX_PIX_FMTS = {'yuv420p', 'yuvj420p'}
+    REMUX_CONTAINERS = {'mov', 'mp4', 'matroska', 'webm', 'mpegts', 'flv'}
+    
+    # Контейнеры, которые FFmpeg читает последовательно без перемотки
+    STREAMABLE_CONTAINERS = {'mpegts', 'matroska', 'webm', 'flv'}
+    
+    # Лестница качеств для адаптивного вывода (HLS): высота кадра и битрейт видео
+    HLS_LADDER = [
+        {'name': '1080p', 'height': 1080, 'bitrate': 5000000},
+        {'name': '720p', 'height': 720, 'bitrate': 2800000},
+        {'name': '480p', 'height': 480, 'bitrate': 1400000}
+    ]
+    
+    # Длительность сегмента HLS; ключевые кадры всех качеств ставятся на границах сегментов
+    HLS_SEGMENT_SECONDS = 4
+    
+    # Превью рядом с MP4: постер, листы миниатюр для перемотки (с индексом WebVTT)
+    # и облегченная копия. Создаются ветками фильтра того же процесса FFmpeg
+    PREVIEW_SPEC = {
+        'poster_position': 0.1,  # Момент постера как доля длительности
+        'poster_height': 720,
+        'thumbnail_interval': 10,  # Секунд между миниатюрами
+        'thumbnail_height': 90,
+        'sprite_columns': 10,
+        'sprite_rows': 10,
+        'jpeg_quality': 4,  # -q:v для JPEG (2 - лучшее)
+        'proxy_height': 360,
+        'proxy_video_bitrate': 500000,
+        'proxy_audio_bitrate': '64k'
+    }
+    
+    def __init__(self, render_dir: str = 'Render', temp_dir: str = 'uploads',
+                 segment_threshold: float = 600, segment_workers: Optional[int] = None,
+                 min_segment_duration: float = 60, remux_enabled: bool = True,
+                 stall_timeout: float = 120, max_job_duration: Optional[float] = None,
+                 output_storage: Optional[OutputStorage] = None, previews: bool = False,
+                 probe_cache_size: int = 1024, cpu_partitioner: Optional[CPUPartitioner] = None):
         """
         Инициализирует процессор видео.
         
         Args:
             render_dir: Директория для сохранения готовых файлов
             temp_dir: Директория для временных файлов
+            segment_threshold: Длительность (в секундах), начиная с которой видео
+                кодируется параллельно по сегментам; 0 отключает режим
+            segment_workers: Максимальное количество параллельно кодируемых сегментов
+            min_segment_duration: Минимальная длительность одного сегмента в секундах
+            remux_enabled: Копировать видеопоток без перекодирования, если он уже
+                соответствует выходным параметрам
+            stall_timeout: Через сколько секунд без прогресса FFmpeg считается зависшим
+            max_job_duration: Лимит времени обработки одной задачи в секундах
+            output_storage: Учет результатов в render_dir; если задан, имена
+                результатов резервируются атомарно через индекс
+            previews: Создавать превью (PREVIEW_SPEC) вместе с MP4
+            probe_cache_size: Количество результатов ffprobe в кеше (0 - без кеша)
+            cpu_partitioner: Разделение процессоров между задачами; процессы FFmpeg
+                задачи привязываются к ее набору процессоров (None - без привязки)
         """
         self.render_dir = render_dir
         self.temp_dir = temp_dir
+        self.segment_threshold = segment_threshold
+        # Каждый процесс libx264 сам использует несколько потоков
+        self.segment_workers = segment_workers or max(2, (os.cpu_count() or 1) // 4)
+        self.min_segment_duration = min_segment_duration
+        self.remux_enabled = remux_enabled
+        self.supervisor = FFmpegSupervisor(stall_timeout, max_job_duration)
+        self.output_storage = output_storage
+        self.previews = previews
+        self.probe = MediaProbe(probe_cache_size)
+        self.cpu_partitioner = cpu_partitioner
         
         # Создаем директории, если они не существуют
         os.makedirs(render_dir, exist_ok=True)
         os.makedirs(temp_dir, exist_ok=True)
     
-    def get_video_info(self, input_path: str) -> Dict[str, Any]:
+    def cpu_slot(self, job_id: Optional[str]):
+        """Выделяет задаче набор процессоров на время обработки (см. CPUPartitioner.job)"""
+        if self.cpu_partitioner is None:
+            return nullcontext()
+        return self.cpu_partitioner.job(job_id)
+    
+    def cancel_job(self, job_id: str):
+        """Отменяет обработку задачи: процессы FFmpeg завершаются, новые не запускаются"""
+        self.supervisor.cancel(job_id)
+    
+    def conversion_params_key(self, encoder_profile: Optional[str] = None) -> str:
+        """
+        Возвращает отпечаток параметров конвертации.
+
+        Используется как часть ключа кеша: одинаковый исходный файл с
+        одинаковыми параметрами дает одинаковый результат.
+        
+        Args:
+            encoder_profile: Профиль, которым кодировался видеопоток; None -
+                видеопоток скопирован без перекодирования (профиль не влияет)
+        """
+        spec = dict(self.OUTPUT_SPEC)
+        if self.previews:
+            spec['previews'] = self.PREVIEW_SPEC
+        if encoder_profile is not None:
+            profile = PROFILES[encoder_profile]
+            spec['encoder'] = {
+                'args': build_profile_args(profile),
+                'vertical_crf': profile['vertical_crf'],
+                'bitrate_factor': profile['bitrate_factor']
+            }
+        spec = json.dumps(spec, sort_keys=True)
+        return hashlib.sha256(spec.encode()).hexdigest()[:16]
+    
+    def get_video_info(self, input_path: str, cache: bool = True) -> Dict[str, Any]:
         """
         Извлекает подробную информацию о видеофайле.
         
+        Результат кешируется по пути, размеру и времени изменения файла
+        (MediaProbe), поэтому повторные вызовы для того же файла не
+        запускают ffprobe.
+        
         Args:
             input_path: Путь к видеофайлу
+            cache: Использовать кеш (False - для одноразовых файлов)
             
         Returns:
             Словарь с информацией о видео (разрешение, битрейт, fps и т.д.)
         """
-        try:
-            # Используем ffprobe для получения данных в формате JSON
-            cmd = [
-                'ffprobe',
-                '-v', 'quiet',
-                '-print_format', 'json',
-                '-show_format',
-                '-show_streams',
-                input_path
-            ]
-            
-            result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-            data = json.loads(result.stdout)
-            
-            # Извлекаем параметры видеопотока
-            video_stream = None
-            audio_stream = None
-            
-            for stream in data.get('streams', []):
-                if stream.get('codec_type') == 'video' and not video_stream:
-                    video_stream = stream
-                elif stream.get('codec_type') == 'audio' and not audio_stream:
-                    audio_stream = stream
-            
-            if not video_stream:
-                raise ValueError("Видеопоток не найден в файле")
-            
-            # Извлекаем и обрабатываем информацию о видео
-            width = int(video_stream.get('width', 0))
-            height = int(video_stream.get('height', 0))
-            
-            # Получаем FPS
-            fps = 0
-            fps_str = video_stream.get('r_frame_rate', '0/1')
-            if '/' in fps_str:
-                num, den = map(int, fps_str.split('/'))
-                if den != 0:
-                    fps = round(num / den, 2)
-            
-            # Получаем общую информацию о формате
-            format_info = data.get('format', {})
-            
-            # Длительность в секундах
-            duration = float(format_info.get('duration', 0))
-            
-            # Общий битрейт
-            bitrate = int(format_info.get('bit_rate', 0))
-            
-            # Битрейт видео (если доступен)
-            video_bitrate = int(video_stream.get('bit_rate', 0))
-            if video_bitrate == 0 and audio_stream:
-                # Если битрейт видео не указан, попробуем рассчитать
-                audio_bitrate = int(audio_stream.get('bit_rate', 0))
-                if audio_bitrate > 0 and bitrate > audio_bitrate:
-                    video_bitrate = bitrate - audio_bitrate
-                else:
-                    # Если ничего не помогло, используем общий битрейт
-                    video_bitrate = bitrate
-            
-            # Аудио битрейт
-            audio_bitrate = 0
-            if audio_stream:
-                audio_bitrate = int(audio_stream.get('bit_rate', 0))
-                # Если битрейт аудио не указан, используем стандартный
-                if audio_bitrate == 0:
-                    audio_bitrate = 128000  # 128 кбит/с
-            
-            # Количество аудиоканалов
-            audio_channels = 0
-            if audio_stream:
-                audio_channels = int(audio_stream.get('channels', 0))
-            
-            # Кодеки
-            video_codec = video_stream.get('codec_name', '')
-            audio_codec = ''
-            if audio_stream:
-                audio_codec = audio_stream.get('codec_name', '')
-            
-            # Собираем всю информацию
-            info = {
-                'width': width,
-                'height': height,
-                'is_vertical': height > width,
-                'fps': fps,
-                'duration': duration,
-                'bitrate': bitrate,
-                'video_bitrate': video_bitrate,
-                'audio_bitrate': audio_bitrate,
-                'audio_channels': audio_channels,
-                'video_codec': video_codec,
-                'audio_codec': audio_codec,
-                'has_audio': audio_stream is not None
-            }
+        return self.probe.probe(input_path, cache)
+    
+    def probe_many(self, paths: Iterable[str]) -> Dict[str, Any]:
+        """
+        Анализирует несколько файлов параллельно и заполняет кеш.
+
+        Returns:
+            Словарь путь -> информация о видео или исключение анализа
+        """
+        return self.probe.probe_many(paths)
+    
+    def is_streamable(self, video_info: Dict[str, Any], head: bytes) -> bool:
+        """
+        Проверяет, можно ли читать файл последовательно, без перемотки.
+
+        MPEG-TS, Matroska/WebM и FLV читаются потоком всегда, MP4/MOV - только
+        если атом moov записан до данных (mdat).
+        
+        Args:
+            video_info: Информация о видео
+            head: Начало файла
             
-            return info
+        Returns:
+            True если файл можно передавать FFmpeg через stdin
+        """
+        formats = set(video_info.get('format_name', '').split(','))
+        if formats & self.STREAMABLE_CONTAINERS:
+            return True
+        if formats & {'mov', 'mp4'}:
+            return self._mp4_moov_first(head)
+        return False
+    
+    @staticmethod
+    def _mp4_moov_first(head: bytes) -> bool:
+        """Проверяет по атомам верхнего уровня, что moov идет раньше mdat"""
+        offset = 0
+        while offset + 8 <= len(head):
+            size = int.from_bytes(head[offset:offset + 4], 'big')
+            box_type = head[offset + 4:offset + 8]
+            if box_type == b'moov':
+                return True
+            if box_type == b'mdat':
+                return False
+            if size == 1 and offset + 16 <= len(head):
+                # 64-битный размер атома
+                size = int.from_bytes(head[offset + 8:offset + 16], 'big')
+            if size < 8:
+                break
+            offset += size
+        return False
+    
+    def plan_conversion(self, video_info: Dict[str, Any]) -> Dict[str, str]:
+        """
+        Выбирает способ обработки каждого потока.
+
+        Видео копируется без перекодирования, если исходник уже соответствует
+        выходным параметрам: H.264 в совместимом профиле и формате пикселей,
+        постоянные 25 FPS, горизонтальный кадр без поворота и контейнер,
+        из которого поток корректно переносится в MP4. Аудио копируется,
+        если оно уже в AAC, иначе перекодируется.
+        
+        Args:
+            video_info: Информация о видео
             
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Ошибка при получении информации о видео: {e}")
-            raise ValueError(f"Не удалось получить информацию о видео: {e}")
-        except json.JSONDecodeError as e:
-            logger.error(f"Ошибка при обработке JSON: {e}")
-            raise ValueError(f"Ошибка при обработке JSON: {e}")
-        except Exception as e:
-            logger.error(f"Непредвиденная ошибка: {e}")
-            raise ValueError(f"Ошибка при обработке видео: {e}")
+        Returns:
+            Словарь с ключами 'video' ('copy' или 'encode'), 'audio'
+            ('copy', 'encode' или 'none') и 'mode' ('remux', 'audio_transcode'
+            или 'full')
+        """
+        fps = self.OUTPUT_SPEC['fps']
+        containers = set(video_info.get('format_name', '').split(','))
+        
+        video_copy = (
+            self.remux_enabled
+            and video_info['video_codec'] == 'h264'
+            and video_info.get('profile', '') in self.REMUX_H264_PROFILES
+            and video_info.get('pix_fmt', '') in self.REMUX_PIX_FMTS
+            and video_info['fps'] == fps
+            and video_info.get('avg_fps', 0) == fps
+            and not video_info['is_vertical']
+            and video_info.get('rotation', 0) == 0
+            and bool(containers & self.REMUX_CONTAINERS)
+        )
+        
+        if not video_info['has_audio']:
+            audio = 'none'
+        elif video_info['audio_codec'] == 'aac':
+            audio = 'copy'
+        else:
+            audio = 'encode'
+        
+        if not video_copy:
+            mode = 'full'
+        elif audio == 'encode':
+            mode = 'audio_transcode'
+        else:
+            mode = 'remux'
+        
+        return {
+            'video': 'copy' if video_copy else 'encode',
+            'audio': audio,
+            'mode': mode
+        }
     
     def generate_output_filename(self, input_filename: str) -> Tuple[str, str]:
         """
@@ -163,6 +377,10 @@ class VideoProcessor:
         # Получаем базовое имя без расширения
         base_name = os.path.splitext(os.path.basename(input_filename))[0]
         
+        # Следующий свободный номер выдает индекс результатов, без перебора существующих файлов
+        if self.output_storage is not None:
+            return self.output_storage.reserve_name(f"{base_name}_convert", '.mp4')
+        
         # Формируем имя для выходного файла
         output_name = f"{base_name}_convert.mp4"
         output_path = os.path.join(self.render_dir, output_name)
@@ -176,132 +394,1353 @@ class VideoProcessor:
         
         return output_name, output_path
     
-    def convert_video(self, input_path: str, output_path: str, video_info: Dict[str, Any]) -> bool:
+    def run_ffmpeg(self, cmd: List[str], duration: float = 0,
+                   progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+                   input_chunks: Optional[Iterable[bytes]] = None,
+                   stage: str = 'encode', job_id: Optional[str] = None, parallel: int = 1) -> Tuple[int, str]:
+        """
+        Запускает FFmpeg под надзором и построчно разбирает вывод прогресса.
+
+        К команде добавляются ключи -progress pipe:1 -nostats, поэтому
+        прогресс приходит в stdout, а stderr содержит только сообщения FFmpeg.
+        Из stderr сохраняется только конец (StderrTail), поэтому память не
+        растет при многочасовом кодировании.
+        
+        Args:
+            cmd: Команда FFmpeg, начинающаяся с 'ffmpeg'
+            duration: Длительность исходного видео для расчета процента
+            progress_callback: Функция, получающая снимки прогресса
+            input_chunks: Данные для stdin FFmpeg (для входа 'pipe:0'); если при
+                их получении возникает ошибка, процесс FFmpeg завершается
+            stage: Этап обработки для метрик процессорного времени и памяти FFmpeg
+            job_id: Задача, к которой относится процесс (для отмены, лимита времени
+                и набора процессоров)
+            parallel: Сколько процессов задачи работают одновременно; они делят
+                между собой потоки набора процессоров задачи
+            
+        Returns:
+            Кортеж (код_возврата, конец_stderr)
+            
+        Raises:
+            FFmpegAbortedError: Если задача отменена, FFmpeg завис или превышен лимит времени
+        """
+        self.supervisor.raise_if_cancelled(job_id)
+        cmd = cmd[:1] + ['-progress', 'pipe:1', '-nostats'] + cmd[1:]
+        if self.cpu_partitioner is not None:
+            # Привязка к процессорам и приоритеты задаются обертками taskset, nice и ionice
+            cmd = self.cpu_partitioner.command_prefix(job_id) + self.cpu_partitioner.ffmpeg_args(cmd, job_id, parallel)
+
+        # Логируем команду
+        logger.info(f"Выполняем команду: {' '.join(map(shlex.quote, cmd))}")
+
+        process = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE if input_chunks is not None else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True
+        )
+
+        watched = self.supervisor.watch(process, job_id)
+
+        # stderr читаем в отдельном потоке, чтобы FFmpeg не заблокировался на заполненном канале
+        stderr_tail = StderrTail()
+        stderr_reader = threading.Thread(
+            target=lambda: [stderr_tail.feed(line) for line in process.stderr], daemon=True
+        )
+        stderr_reader.start()
+
+        if input_chunks is not None:
+            stdin_writer = threading.Thread(
+                target=self._feed_stdin, args=(process, input_chunks, watched.touch), daemon=True
+            )
+            stdin_writer.start()
+
+        try:
+            parser = FFmpegProgressParser(duration)
+            for line in process.stdout:
+                watched.touch()
+                progress = parser.feed(line)
+                if progress and progress_callback:
+                    try:
+                        progress_callback(progress)
+                    except Exception as e:
+                        logger.warning(f"Ошибка в обработчике прогресса: {e}")
+
+            metrics.observe_rusage(stage, self._wait_process(process))
+            stderr_reader.join()
+        finally:
+            self.supervisor.release(watched)
+        return process.returncode, stderr_tail.text()
+    
+    @staticmethod
+    def _wait_process(process: subprocess.Popen):
+        """
+        Ожидает завершения процесса и возвращает израсходованные им ресурсы.
+
+        Returns:
+            resource.struct_rusage или None, если os.wait4 недоступен
+        """
+        if not hasattr(os, 'wait4'):
+            process.wait()
+            return None
+        try:
+            _, status, rusage = os.wait4(process.pid, 0)
+        except ChildProcessError:
+            # Процесс уже завершен и собран
+            process.wait()
+            return None
+        # Код возврата выставляем сами, чтобы Popen не пытался собрать процесс повторно
+        process.returncode = os.waitstatus_to_exitcode(status)
+        return rusage
+    
+    @staticmethod
+    def _feed_stdin(process: subprocess.Popen, input_chunks: Iterable[bytes],
+                    on_write: Optional[Callable[[], None]] = None):
+        """Передает данные в stdin FFmpeg, а при ошибке источника завершает процесс"""
+        try:
+            for chunk in input_chunks:
+                process.stdin.buffer.write(chunk)
+                # Поступление данных - тоже активность: FFmpeg может ждать медленную загрузку
+                if on_write:
+                    on_write()
+        except BrokenPipeError:
+            # FFmpeg завершился раньше, чем прочитал весь вход
+            pass
+        except Exception as e:
+            logger.error(f"Ошибка источника данных FFmpeg: {e}")
+            process.kill()
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+    
+    def build_scale_filter(self, video_info: Dict[str, Any], width: int, height: int) -> str:
+        """
+        Формирует фильтр, приводящий кадр к размеру width x height.
+
+        Вертикальное видео вписывается в кадр с черными полосами по бокам.
+        """
+        if video_info['is_vertical']:
+            return (f"scale=w={width}:h={height}:force_original_aspect_ratio=decrease,"
+                    f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2:color=black")
+        return f"scale={width}:{height}"
+    
+    def frame_size(self, video_info: Dict[str, Any], height: int) -> Tuple[int, int]:
+        """
+        Размер кадра заданной высоты с пропорциями результата.
+
+        Вертикальное видео вписывается в горизонтальный кадр 16:9, как в
+        convert_video. Обе стороны округляются до четных.
+        """
+        height -= height % 2
+        if video_info['is_vertical']:
+            width = int(height * 16 / 9)
+        else:
+            width = int(video_info['width'] * height / video_info['height'])
+        return width - width % 2, height
+    
+    def output_height(self, video_info: Dict[str, Any]) -> int:
+        """Высота кадра результата без масштабирования"""
+        if video_info['is_vertical']:
+            return min(video_info['height'], self.OUTPUT_SPEC['vertical_max_height'])
+        return video_info['height']
+    
+    def build_video_args(self, video_info: Dict[str, Any], encoder_profile: Optional[str] = None,
+                         video_filter: bool = True) -> List[str]:
+        """
+        Формирует параметры FFmpeg для видеопотока.
+        
+        Args:
+            video_info: Информация о видео
+            encoder_profile: Имя профиля кодирования из encoder_profiles.PROFILES
+            video_filter: Добавлять -vf; False, если фильтр видео входит в
+                filter_complex (build_video_filter)
+            
+        Returns:
+            Список аргументов FFmpeg (кодек, профиль, частота кадров, фильтр, битрейт/CRF)
+        """
+        profile = PROFILES[encoder_profile or DEFAULT_PROFILE]
+        
+        # Настраиваем параметры видеопотока
+        args = ['-c:v', self.OUTPUT_SPEC['video_codec']]
+        args.extend(build_profile_args(profile))
+        
+        # Устанавливаем частоту кадров 25 FPS
+        args.extend(['-r', str(self.OUTPUT_SPEC['fps'])])
+        
+        # Если видео вертикальное, применяем специальную обработку
+        if video_info['is_vertical']:
+            # Обрабатываем вертикальное видео - добавляем черные полосы по бокам
+            if video_filter:
+                args.extend(['-vf', self.build_video_filter(video_info)])
+            
+            # Используем CRF (Constant Rate Factor) для контроля качества
+            args.extend(['-crf', str(profile['vertical_crf'])])
+        else:
+            # Для горизонтального видео сохраняем оригинальный битрейт с поправкой профиля
+            video_bitrate = video_info['video_bitrate'] * profile['bitrate_factor']
+            video_bitrate = max(video_bitrate, self.OUTPUT_SPEC['min_video_bitrate'])  # Минимум 1 Мбит/с
+            
+            # Конвертируем битрейт в килобиты
+            video_bitrate_kb = int(video_bitrate / 1000)
+            args.extend(['-b:v', f"{video_bitrate_kb}k"])
+        
+        return args
+    
+    def build_video_filter(self, video_info: Dict[str, Any]) -> Optional[str]:
+        """
+        Формирует фильтр видео для convert_video.
+        
+        Returns:
+            Фильтр вписывания вертикального видео в горизонтальный кадр 16:9
+            или None, если фильтр не нужен
+        """
+        if not video_info['is_vertical']:
+            return None
+        # Определяем размер выходного видео (16:9)
+        target_height = self.output_height(video_info)
+        target_width = int(target_height * 16 / 9)
+        return self.build_scale_filter(video_info, target_width, target_height)
+    
+    def build_container_args(self) -> List[str]:
+        """
+        Формирует параметры выходного контейнера MP4.
+        
+        Returns:
+            Список аргументов FFmpeg (перенос moov в начало файла)
+        """
+        if self.OUTPUT_SPEC['faststart']:
+            return ['-movflags', '+faststart']
+        return []
+    
+    def build_audio_args(self, video_info: Dict[str, Any]) -> List[str]:
+        """
+        Формирует параметры FFmpeg для аудиопотока.
+        
+        Args:
+            video_info: Информация о видео
+            
+        Returns:
+            Список аргументов FFmpeg для аудио
+        """
+        # Если аудио нет, удаляем все аудиопотоки
+        if not video_info['has_audio']:
+            return ['-an']
+        
+        # Если аудио уже в AAC, просто копируем
+        if video_info['audio_codec'] == 'aac':
+            return ['-c:a', 'copy']
+        
+        # Иначе конвертируем в AAC
+        args = ['-c:a', self.OUTPUT_SPEC['audio_codec']]
+        
+        # Устанавливаем битрейт аудио
+        if video_info['audio_bitrate'] > 0:
+            # Используем оригинальный битрейт, округленный до ближайших 16 кбит/с
+            audio_bitrate_kb = int(video_info['audio_bitrate'] / 1000)
+            audio_bitrate_kb = round(audio_bitrate_kb / 16) * 16
+            args.extend(['-b:a', f"{audio_bitrate_kb}k"])
+        else:
+            # Используем стандартный битрейт, если оригинальный не определен
+            args.extend(['-b:a', self.OUTPUT_SPEC['default_audio_bitrate']])
+        
+        return args
+    
+    def plan_previews(self, video_info: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Рассчитывает параметры превью для видео.
+        
+        Args:
+            video_info: Информация о видео
+            
+        Returns:
+            Словарь с моментом постера (poster_time), размерами кадров постера,
+            миниатюр и облегченной копии и количеством миниатюр и листов
+        """
+        spec = self.PREVIEW_SPEC
+        duration = video_info['duration']
+        source_height = self.output_height(video_info)
+        thumbnail_count = max(1, math.ceil(duration / spec['thumbnail_interval']))
+        per_sheet = spec['sprite_columns'] * spec['sprite_rows']
+        return {
+            'poster_time': duration * spec['poster_position'],
+            'poster_size': self.frame_size(video_info, min(spec['poster_height'], source_height)),
+            'thumbnail_size': self.frame_size(video_info, spec['thumbnail_height']),
+            'thumbnail_count': thumbnail_count,
+            'sprite_count': math.ceil(thumbnail_count / per_sheet),
+            'proxy_size': self.frame_size(video_info, min(spec['proxy_height'], source_height))
+        }
+    
+    def generate_preview_dirname(self, output_filename: str) -> Tuple[str, str]:
+        """
+        Возвращает директорию превью для результата.
+
+        Имя производится от уникального имени MP4, поэтому отдельное
+        резервирование не нужно.
+        
+        Returns:
+            Кортеж (относительное_имя, полный_путь)
+        """
+        preview_name = f"{os.path.splitext(output_filename)[0]}_preview"
+        preview_path = os.path.join(self.render_dir, preview_name)
+        os.makedirs(preview_path, exist_ok=True)
+        return preview_name, preview_path
+    
+    def build_preview_outputs(self, video_info: Dict[str, Any], source: str, paths: Dict[str, str],
+                              offset: float = 0.0, end: Optional[float] = None,
+                              audio: bool = True) -> Tuple[List[str], List[str]]:
+        """
+        Формирует ветки filter_complex и выходы FFmpeg для превью.
+
+        Кадры берутся из того же декодированного потока, что и для основного
+        результата, поэтому превью не требуют повторного чтения и
+        декодирования исходника. Моменты постера и миниатюр отсчитываются в
+        абсолютном времени исходника, так что фрагменты при кодировании по
+        сегментам дают те же кадры, что и обработка целиком.
+        
+        Args:
+            video_info: Информация о видео
+            source: Метка декодированного видеопотока в filter_complex, например '[preview]'
+            paths: Пути выходов: 'poster', 'proxy' и либо 'sprites' (шаблон листов
+                миниатюр), либо 'thumbnails' (шаблон отдельных миниатюр, которые
+                затем собирает assemble_sprites)
+            offset: Время начала фрагмента в исходнике в секундах
+            end: Время конца фрагмента (None - до конца видео)
+            audio: Добавить аудио в облегченную копию
+            
+        Returns:
+            Кортеж (цепочки filter_complex, аргументы выходов)
+        """
+        spec = self.PREVIEW_SPEC
+        plan = self.plan_previews(video_info)
+        interval = spec['thumbnail_interval']
+        quality = str(spec['jpeg_quality'])
+        
+        branches = ['thumbnails', 'proxy']
+        if offset <= plan['poster_time'] and (end is None or plan['poster_time'] < end):
+            branches.append('poster')
+        head = source
+        if end is not None:
+            # Фрагмент читается дальше своего конца; ветки превью завершаются на границе
+            head += f"trim=duration={end - offset:.6f},"
+        chains = [f"{head}split={len(branches)}" + ''.join(f"[preview_{name}]" for name in branches)]
+        args = []
+        
+        # Первый кадр каждого интервала миниатюр. setpts делает метки выбранных
+        # кадров последовательными, иначе вывод с постоянной частотой дублирует кадры
+        first_index = math.ceil(round(offset / interval, 6))
+        on_boundary = int(first_index * interval - offset < 1e-3)
+        select = (f"select='if(isnan(prev_t),{on_boundary},"
+                  f"gt(floor((t+{offset:.6f})/{interval}),floor((prev_t+{offset:.6f})/{interval})))'")
+        width, height = plan['thumbnail_size']
+        chain = f"[preview_thumbnails]{select},setpts=N/TB,{self.build_scale_filter(video_info, width, height)}"
+        if 'sprites' in paths:
+            columns, rows = spec['sprite_columns'], spec['sprite_rows']
+            chains.append(f"{chain},tile={columns}x{rows}[thumbnails]")
+            args.extend(['-map', '[thumbnails]', '-r', f"1/{columns * rows}", '-q:v', quality, paths['sprites']])
+        else:
+            chains.append(f"{chain}[thumbnails]")
+            args.extend([
+                '-map', '[thumbnails]', '-r', '1', '-start_number', str(first_index), '-q:v', quality,
+                paths['thumbnails']
+            ])
+        
+        width, height = plan['proxy_size']
+        chains.append(f"[preview_proxy]{self.build_scale_filter(video_info, width, height)}[proxy]")
+        bitrate_kb = int(spec['proxy_video_bitrate'] / 1000)
+        args.extend([
+            '-map', '[proxy]',
+            '-c:v', self.OUTPUT_SPEC['video_codec'], '-preset', 'veryfast',
+            '-b:v', f"{bitrate_kb}k", '-maxrate', f"{bitrate_kb}k", '-bufsize', f"{bitrate_kb * 2}k",
+            '-r', str(self.OUTPUT_SPEC['fps'])
+        ])
+        if audio and video_info['has_audio']:
+            args.extend([
+                '-map', '0:a:0', '-c:a', self.OUTPUT_SPEC['audio_codec'], '-b:a', spec['proxy_audio_bitrate']
+            ])
+        else:
+            args.append('-an')
+        args.extend(self.build_container_args())
+        args.append(paths['proxy'])
+        
+        if 'poster' in branches:
+            width, height = plan['poster_size']
+            chains.append(
+                f"[preview_poster]select='gte(t+{offset:.6f},{plan['poster_time']:.6f})',setpts=N/TB,"
+                f"{self.build_scale_filter(video_info, width, height)}[poster]"
+            )
+            args.extend(['-map', '[poster]', '-frames:v', '1', '-update', '1', '-q:v', '2', paths['poster']])
+        
+        return chains, args
+    
+    def build_encode_graph(self, video_info: Dict[str, Any], paths: Dict[str, str],
+                           offset: float = 0.0, end: Optional[float] = None,
+                           audio: bool = True) -> Tuple[List[str], List[str]]:
+        """
+        Формирует filter_complex, раздающий декодированный поток на кодирование и превью.
+
+        Фильтр видео (build_video_filter) переносится в граф, поэтому
+        параметры видео нужно брать из build_video_args(video_filter=False).
+        Аргументы те же, что у build_preview_outputs.
+        
+        Returns:
+            Кортеж (аргументы графа и выбора видеопотока для основного выхода,
+            аргументы выходов превью)
+        """
+        chains = ['[0:v]split=2[main][preview]']
+        main = '[main]'
+        video_filter = self.build_video_filter(video_info)
+        if video_filter:
+            chains.append(f"[main]{video_filter}[video]")
+            main = '[video]'
+        preview_chains, preview_args = self.build_preview_outputs(video_info, '[preview]', paths, offset, end, audio)
+        return ['-filter_complex', ';'.join(chains + preview_chains), '-map', main], preview_args
+    
+    @staticmethod
+    def preview_paths(preview_dir: str) -> Dict[str, str]:
+        """Пути выходов превью для обработки одним процессом FFmpeg"""
+        return {
+            'poster': os.path.join(preview_dir, 'poster.jpg'),
+            'sprites': os.path.join(preview_dir, 'sprite_%03d.jpg'),
+            'proxy': os.path.join(preview_dir, 'proxy.mp4')
+        }
+    
+    def assemble_sprites(self, thumbnails_pattern: str, preview_dir: str, job_id: Optional[str] = None) -> bool:
+        """
+        Собирает листы миниатюр из отдельных кадров (после кодирования по сегментам).
+
+        Читаются только маленькие JPEG миниатюр, исходник повторно не декодируется.
+        
+        Returns:
+            True если листы собраны, иначе False
+        """
+        columns, rows = self.PREVIEW_SPEC['sprite_columns'], self.PREVIEW_SPEC['sprite_rows']
+        cmd = [
+            'ffmpeg', '-y', '-framerate', '1', '-start_number', '0', '-i', thumbnails_pattern,
+            '-vf', f"tile={columns}x{rows}", '-q:v', str(self.PREVIEW_SPEC['jpeg_quality']),
+            os.path.join(preview_dir, 'sprite_%03d.jpg')
+        ]
+        returncode, stderr = self.run_ffmpeg(cmd, stage='sprites', job_id=job_id)
+        if returncode != 0:
+            logger.error(f"Ошибка FFmpeg при сборке листов миниатюр: {stderr}")
+            return False
+        return True
+    
+    def finish_segmented_previews(self, work_dir: str, preview_dir: str, proxy_paths: List[str],
+                                  audio_path: Optional[str], job_id: Optional[str] = None) -> bool:
+        """
+        Собирает превью из частей, созданных процессами сегментов.
+
+        Листы миниатюр собираются из отдельных кадров, части облегченной
+        копии склеиваются без перекодирования вместе с аудио всего видео.
+        
+        Returns:
+            True если превью собраны, иначе False
+        """
+        if not self.assemble_sprites(os.path.join(work_dir, 'thumbnail_%05d.jpg'), preview_dir, job_id):
+            return False
+        
+        list_path = os.path.join(work_dir, 'proxy_segments.txt')
+        self.write_concat_list(list_path, proxy_paths)
+        
+        cmd = ['ffmpeg', '-y', '-f', 'concat', '-safe', '0', '-i', list_path]
+        if audio_path:
+            cmd.extend(['-i', audio_path, '-map', '0:v:0', '-map', '1:a:0'])
+        cmd.extend(['-c', 'copy'])
+        cmd.extend(self.build_container_args())
+        cmd.append(os.path.join(preview_dir, 'proxy.mp4'))
+        
+        returncode, stderr = self.run_ffmpeg(cmd, stage='concat', job_id=job_id)
+        if returncode != 0:
+            logger.error(f"Ошибка FFmpeg при склейке облегченной копии: {stderr}")
+            return False
+        return True
+    
+    def write_thumbnail_index(self, video_info: Dict[str, Any], preview_dir: str) -> str:
+        """
+        Записывает индекс миниатюр WebVTT для перемотки.
+
+        Каждая реплика покрывает интервал миниатюры и ссылается на ее
+        область в листе (медиафрагмент #xywh), как ожидают веб-плееры.
+        
+        Returns:
+            Имя файла индекса
+        """
+        spec = self.PREVIEW_SPEC
+        plan = self.plan_previews(video_info)
+        interval = spec['thumbnail_interval']
+        columns, rows = spec['sprite_columns'], spec['sprite_rows']
+        width, height = plan['thumbnail_size']
+        
+        def timestamp(seconds):
+            hours, rest = divmod(seconds, 3600)
+            minutes, seconds = divmod(rest, 60)
+            return f"{int(hours):02d}:{int(minutes):02d}:{seconds:06.3f}"
+        
+        lines = ['WEBVTT', '']
+        for index in range(plan['thumbnail_count']):
+            sheet, position = divmod(index, columns * rows)
+            row, column = divmod(position, columns)
+            start = index * interval
+            end = min(start + interval, video_info['duration']) if video_info['duration'] > 0 else interval
+            lines.append(f"{timestamp(start)} --> {timestamp(end)}")
+            lines.append(f"sprite_{sheet + 1:03d}.jpg#xywh={column * width},{row * height},{width},{height}")
+            lines.append('')
+        
+        with open(os.path.join(preview_dir, 'thumbnails.vtt'), 'w') as index_file:
+            index_file.write('\n'.join(lines))
+        return 'thumbnails.vtt'
+    
+    def preview_result(self, video_info: Dict[str, Any], preview_dirname: str, preview_path: str) -> Dict[str, Any]:
+        """
+        Записывает индекс миниатюр и формирует описание превью для результата задачи.
+        
+        Returns:
+            Словарь с директорией превью (dir) и именами файлов в ней: poster,
+            sprites, thumbnails (индекс WebVTT) и proxy
+        """
+        plan = self.plan_previews(video_info)
+        result = {
+            'dir': preview_dirname,
+            'sprites': [f"sprite_{index + 1:03d}.jpg" for index in range(plan['sprite_count'])],
+            'thumbnails': self.write_thumbnail_index(video_info, preview_path),
+            'proxy': 'proxy.mp4'
+        }
+        # Постера нет, если кадра в выбранный момент не оказалось (длительность в заголовке завышена)
+        if os.path.exists(os.path.join(preview_path, 'poster.jpg')):
+            result['poster'] = 'poster.jpg'
+        return result
+    
+    def convert_video(self, input_path: str, output_path: str, video_info: Dict[str, Any],
+                      progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+                      input_chunks: Optional[Iterable[bytes]] = None,
+                      encoder_profile: Optional[str] = None, job_id: Optional[str] = None,
+                      preview_dir: Optional[str] = None) -> bool:
         """
         Конвертирует видео в формат MP4 с заданными параметрами.
+
+        Если задан preview_dir, тот же процесс FFmpeg создает превью:
+        декодированный поток раздается фильтром split на кодирование и на
+        ветки постера, листов миниатюр и облегченной копии.
         
         Args:
-            input_path: Путь к исходному видео
+            input_path: Путь к исходному видео ('pipe:0' при чтении из input_chunks)
             output_path: Путь для сохранения результата
             video_info: Информация о видео
+            progress_callback: Функция, получающая снимки прогресса конвертации
+            input_chunks: Данные исходного видео, передаваемые в stdin FFmpeg
+            encoder_profile: Имя профиля кодирования
+            job_id: Задача, к которой относится конвертация
+            preview_dir: Директория превью (None - без превью)
             
         Returns:
             True если конвертация успешна, иначе False
+            
+        Raises:
+            FFmpegAbortedError: Если FFmpeg остановлен надзором
         """
         try:
             # Формируем базовые параметры FFmpeg
             cmd = ['ffmpeg', '-y', '-i', input_path]
+            preview_args = []
+            if preview_dir:
+                graph_args, preview_args = self.build_encode_graph(video_info, self.preview_paths(preview_dir))
+                cmd.extend(graph_args)
+                if video_info['has_audio']:
+                    cmd.extend(['-map', '0:a:0'])
+                cmd.extend(self.build_video_args(video_info, encoder_profile, video_filter=False))
+            else:
+                cmd.extend(self.build_video_args(video_info, encoder_profile))
+            cmd.extend(self.build_audio_args(video_info))
+            cmd.extend(self.build_container_args())
             
-            # Настраиваем параметры видеопотока
-            cmd.extend(['-c:v', 'libx264'])
+            # Добавляем путь выходного файла
+            cmd.append(output_path)
+            cmd.extend(preview_args)
             
-            # Устанавливаем частоту кадров 25 FPS
-            cmd.extend(['-r', '25'])
+            # Запускаем процесс конвертации
+            returncode, stderr = self.run_ffmpeg(
+                cmd, video_info['duration'], progress_callback, input_chunks, job_id=job_id
+            )
             
-            # Если видео вертикальное, применяем специальную обработку
-            if video_info['is_vertical']:
-                # Обрабатываем вертикальное видео - добавляем черные полосы по бокам
-                # Определяем размер выходного видео (16:9)
-                target_height = min(video_info['height'], 1080)
-                target_width = int(target_height * 16 / 9)
-                
-                # Формируем фильтр для вписывания вертикального видео в горизонтальный кадр
-                vf = f"scale=w={target_width}:h={target_height}:force_original_aspect_ratio=decrease,"
-                vf += f"pad={target_width}:{target_height}:(ow-iw)/2:(oh-ih)/2:color=black"
-                
-                # Используем CRF (Constant Rate Factor) для контроля качества
-                cmd.extend(['-vf', vf, '-crf', '23'])
-            else:
-                # Для горизонтального видео сохраняем оригинальный битрейт
-                video_bitrate = max(video_info['video_bitrate'], 1000000)  # Минимум 1 Мбит/с
+            # Проверяем результат
+            if returncode != 0:
+                logger.error(f"Ошибка FFmpeg: {stderr}")
+                return False
+            
+            logger.info(f"Конвертация завершена успешно: {output_path}")
+            return True
+            
+        except FFmpegAbortedError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка при конвертации видео: {e}")
+            return False
+    
+    def remux_video(self, input_path: str, output_path: str, video_info: Dict[str, Any],
+                    progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+                    input_chunks: Optional[Iterable[bytes]] = None, job_id: Optional[str] = None,
+                    preview_dir: Optional[str] = None) -> bool:
+        """
+        Переносит видеопоток в MP4 без перекодирования.
+
+        Аудио при этом копируется или перекодируется в AAC так же,
+        как при полной конвертации. Для превью видеопоток дополнительно
+        декодируется в том же процессе; кодируется только облегченная копия.
+        
+        Args:
+            input_path: Путь к исходному видео ('pipe:0' при чтении из input_chunks)
+            output_path: Путь для сохранения результата
+            video_info: Информация о видео
+            progress_callback: Функция, получающая снимки прогресса
+            input_chunks: Данные исходного видео, передаваемые в stdin FFmpeg
+            job_id: Задача, к которой относится перенос
+            preview_dir: Директория превью (None - без превью)
+            
+        Returns:
+            True если перенос успешен, иначе False
+            
+        Raises:
+            FFmpegAbortedError: Если FFmpeg остановлен надзором
+        """
+        try:
+            cmd = ['ffmpeg', '-y', '-i', input_path]
+            preview_args = []
+            if preview_dir:
+                preview_chains, preview_args = self.build_preview_outputs(
+                    video_info, '[0:v]', self.preview_paths(preview_dir)
+                )
+                cmd.extend(['-filter_complex', ';'.join(preview_chains), '-map', '0:v:0'])
+                if video_info['has_audio']:
+                    cmd.extend(['-map', '0:a:0'])
+            cmd.extend(['-c:v', 'copy'])
+            cmd.extend(self.build_audio_args(video_info))
+            cmd.extend(self.build_container_args())
+            cmd.append(output_path)
+            cmd.extend(preview_args)
+            
+            returncode, stderr = self.run_ffmpeg(
+                cmd, video_info['duration'], progress_callback, input_chunks, stage='remux', job_id=job_id
+            )
+            if returncode != 0:
+                logger.error(f"Ошибка FFmpeg при копировании потоков: {stderr}")
+                return False
+            
+            logger.info(f"Видео перенесено без перекодирования: {output_path}")
+            return True
+            
+        except FFmpegAbortedError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка при копировании потоков: {e}")
+            return False
+    
+    def find_keyframes(self, input_path: str, targets: List[float], start_time: float = 0,
+                       window: float = 10) -> List[float]:
+        """
+        Находит ближайшие ключевые кадры после заданных моментов времени.
+
+        ffprobe читает только пакеты небольших окон вокруг каждой точки
+        (-read_intervals), поэтому поиск не требует прохода по всему файлу.
+        
+        Args:
+            input_path: Путь к видеофайлу
+            targets: Желаемые моменты разреза в секундах от начала файла
+            start_time: Время начала файла (метки пакетов отсчитываются от него)
+            window: Ширина окна поиска после каждой точки в секундах
+            
+        Returns:
+            Отсортированный список найденных моментов ключевых кадров (без повторов)
+        """
+        if not targets:
+            return []
+        
+        intervals = ','.join(f"{start_time + target:.3f}%+{window}" for target in targets)
+        cmd = [
+            'ffprobe',
+            '-v', 'error',
+            '-select_streams', 'v:0',
+            '-read_intervals', intervals,
+            '-show_entries', 'packet=pts_time,flags',
+            '-of', 'json',
+            input_path
+        ]
+        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+        keyframes = sorted(
+            float(packet['pts_time']) - start_time
+            for packet in json.loads(result.stdout).get('packets', [])
+            if 'K' in packet.get('flags', '') and packet.get('pts_time', 'N/A') != 'N/A'
+        )
+        
+        boundaries = []
+        for target in targets:
+            # Первый ключевой кадр не раньше точки разреза и в пределах окна
+            candidate = next((time for time in keyframes if target <= time <= target + window), None)
+            if candidate is not None and candidate not in boundaries:
+                boundaries.append(candidate)
+        
+        return sorted(boundaries)
+    
+    @staticmethod
+    def write_concat_list(list_path: str, paths: List[str]):
+        """Записывает список файлов для concat demuxer"""
+        with open(list_path, 'w') as list_file:
+            for path in paths:
+                # Одинарные кавычки в пути экранируются по правилам concat demuxer
+                escaped_path = os.path.abspath(path).replace("'", "'\\''")
+                list_file.write(f"file '{escaped_path}'\n")
+    
+    def plan_segments(self, video_info: Dict[str, Any]) -> int:
+        """
+        Определяет, на сколько сегментов делить видео для параллельного кодирования.
+        
+        Returns:
+            Количество сегментов; 1 означает обычное кодирование одним процессом
+        """
+        duration = video_info['duration']
+        if not self.segment_threshold or duration < self.segment_threshold:
+            return 1
+        return max(1, min(self.segment_workers, int(duration // self.min_segment_duration)))
+    
+    def convert_video_segmented(self, input_path: str, output_path: str, video_info: Dict[str, Any],
+                                segment_count: int,
+                                progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+                                encoder_profile: Optional[str] = None, job_id: Optional[str] = None,
+                                preview_dir: Optional[str] = None) -> bool:
+        """
+        Конвертирует длинное видео параллельно по сегментам.
+
+        Видео разрезается по ключевым кадрам на segment_count частей, части
+        кодируются одновременно отдельными процессами FFmpeg с одинаковыми
+        параметрами, а затем склеиваются без перекодирования (concat demuxer).
+        Аудио кодируется один раз целиком, поэтому на стыках сегментов нет щелчков.
+        Превью каждый процесс создает для своего сегмента: миниатюры затем
+        собираются в листы, а части облегченной копии склеиваются с аудио.
+        
+        Args:
+            input_path: Путь к исходному видео
+            output_path: Путь для сохранения результата
+            video_info: Информация о видео
+            segment_count: Желаемое количество сегментов
+            progress_callback: Функция, получающая снимки прогресса конвертации
+            encoder_profile: Имя профиля кодирования (общий для всех сегментов)
+            job_id: Задача, к которой относится конвертация; при отмене
+                завершаются все процессы сегментов
+            preview_dir: Директория превью (None - без превью)
+            
+        Returns:
+            True если конвертация успешна, иначе False
+            
+        Raises:
+            FFmpegAbortedError: Если FFmpeg остановлен надзором
+        """
+        work_dir = tempfile.mkdtemp(prefix='segments_', dir=self.temp_dir)
+        try:
+            duration = video_info['duration']
+            step = duration / segment_count
+            cuts = self.find_keyframes(
+                input_path,
+                [step * index for index in range(1, segment_count)],
+                video_info.get('start_time', 0)
+            )
+            bounds = [0.0] + cuts + [None]
+            segments = list(zip(bounds[:-1], bounds[1:]))
+            
+            logger.info(f"Параллельное кодирование {len(segments)} сегментов: {input_path}")
+            
+            video_args = self.build_video_args(video_info, encoder_profile, video_filter=not preview_dir)
+            jobs = []
+            segment_paths = []
+            proxy_paths = []
+            for index, (start, end) in enumerate(segments):
+                segment_path = os.path.join(work_dir, f"segment_{index:04d}.mp4")
+                segment_paths.append(segment_path)
                 
-                # Конвертируем битрейт в килобиты
-                video_bitrate_kb = int(video_bitrate / 1000)
-                cmd.extend(['-b:v', f"{video_bitrate_kb}k"])
+                # -ss перед -i: быстрый переход к ключевому кадру без декодирования начала файла
+                cmd = ['ffmpeg', '-y', '-ss', f"{start:.6f}", '-i', input_path]
+                preview_args = []
+                if preview_dir:
+                    proxy_paths.append(os.path.join(work_dir, f"proxy_{index:04d}.mp4"))
+                    graph_args, preview_args = self.build_encode_graph(
+                        video_info,
+                        {
+                            'poster': os.path.join(preview_dir, 'poster.jpg'),
+                            'thumbnails': os.path.join(work_dir, 'thumbnail_%05d.jpg'),
+                            'proxy': proxy_paths[-1]
+                        },
+                        start, end, audio=False
+                    )
+                    cmd.extend(graph_args)
+                segment_duration = (end if end is not None else duration) - start
+                if end is not None:
+                    cmd.extend(['-t', f"{segment_duration:.6f}"])
+                cmd.extend(video_args)
+                cmd.extend(['-an', segment_path])
+                cmd.extend(preview_args)
+                jobs.append((cmd, segment_duration, 'segment'))
             
-            # Настраиваем аудиопоток
+            audio_path = None
             if video_info['has_audio']:
-                if video_info['audio_codec'] == 'aac':
-                    # Если аудио уже в AAC, просто копируем
-                    cmd.extend(['-c:a', 'copy'])
-                else:
-                    # Иначе конвертируем в AAC
-                    cmd.extend(['-c:a', 'aac'])
-                    
-                    # Устанавливаем битрейт аудио
-                    if video_info['audio_bitrate'] > 0:
-                        # Используем оригинальный битрейт, округленный до ближайших 16 кбит/с
-                        audio_bitrate_kb = int(video_info['audio_bitrate'] / 1000)
-                        audio_bitrate_kb = round(audio_bitrate_kb / 16) * 16
-                        cmd.extend(['-b:a', f"{audio_bitrate_kb}k"])
-                    else:
-                        # Используем стандартный битрейт, если оригинальный не определен
-                        cmd.extend(['-b:a', '128k'])
-            else:
-                # Если аудио нет, удаляем все аудиопотоки
-                cmd.extend(['-an'])
+                audio_path = os.path.join(work_dir, 'audio.m4a')
+                cmd = ['ffmpeg', '-y', '-i', input_path, '-vn']
+                cmd.extend(self.build_audio_args(video_info))
+                cmd.append(audio_path)
+                jobs.append((cmd, duration, 'audio'))
             
-            # Добавляем путь выходного файла
-            cmd.append(output_path)
+            # Прогресс считаем по суммарному закодированному времени всех сегментов
+            encoded = [0.0] * len(segments)
+            started = time.monotonic()
+            lock = threading.Lock()
             
-            # Логируем команду
-            logger.info(f"Выполняем команду: {' '.join(map(shlex.quote, cmd))}")
+            def segment_progress(index):
+                def on_progress(progress):
+                    if progress_callback is None or index >= len(segments):
+                        return
+                    with lock:
+                        encoded[index] = progress['out_time']
+                        done = min(sum(encoded), duration)
+                    elapsed = time.monotonic() - started
+                    percent = done / duration * 100 if duration > 0 else 0.0
+                    progress_callback({
+                        'out_time': round(done, 2),
+                        'fps': progress['fps'],
+                        'speed': round(done / elapsed, 2) if elapsed > 0 else 0.0,
+                        'percent': round(min(percent, 100.0), 1),
+                        'eta': round(elapsed * (duration - done) / done, 1) if done > 0 else None,
+                        'segments': len(segments)
+                    })
+                return on_progress
             
-            # Запускаем процесс конвертации
-            process = subprocess.run(cmd, capture_output=True, text=True)
+            parallel = min(len(jobs), self.segment_workers + 1)
+            with ThreadPoolExecutor(max_workers=parallel) as executor:
+                futures = [
+                    executor.submit(
+                        self.run_ffmpeg, cmd, job_duration, segment_progress(index), stage=stage, job_id=job_id,
+                        parallel=parallel
+                    )
+                    for index, (cmd, job_duration, stage) in enumerate(jobs)
+                ]
+                results = [future.result() for future in futures]
             
-            # Проверяем результат
-            if process.returncode != 0:
-                logger.error(f"Ошибка FFmpeg: {process.stderr}")
+            for returncode, stderr in results:
+                if returncode != 0:
+                    logger.error(f"Ошибка FFmpeg при кодировании сегмента: {stderr}")
+                    return False
+            
+            # Склеиваем сегменты без перекодирования
+            list_path = os.path.join(work_dir, 'segments.txt')
+            self.write_concat_list(list_path, segment_paths)
+            
+            cmd = ['ffmpeg', '-y', '-f', 'concat', '-safe', '0', '-i', list_path]
+            if audio_path:
+                cmd.extend(['-i', audio_path, '-map', '0:v:0', '-map', '1:a:0'])
+            cmd.extend(['-c', 'copy'])
+            cmd.extend(self.build_container_args())
+            cmd.append(output_path)
+            
+            returncode, stderr = self.run_ffmpeg(cmd, stage='concat', job_id=job_id)
+            if returncode != 0:
+                logger.error(f"Ошибка FFmpeg при склейке сегментов: {stderr}")
+                return False
+            
+            if preview_dir and not self.finish_segmented_previews(
+                work_dir, preview_dir, proxy_paths, audio_path, job_id
+            ):
                 return False
             
+            if progress_callback:
+                progress_callback({
+                    'out_time': round(duration, 2),
+                    'fps': 0.0,
+                    'speed': 0.0,
+                    'percent': 100.0,
+                    'eta': 0.0,
+                    'segments': len(segments)
+                })
+            
             logger.info(f"Конвертация завершена успешно: {output_path}")
             return True
             
+        except FFmpegAbortedError:
+            raise
         except Exception as e:
-            logger.error(f"Ошибка при конвертации видео: {e}")
+            logger.error(f"Ошибка при сегментной конвертации видео: {e}")
             return False
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
     
-    def process_video(self, input_path: str, original_filename: str) -> Dict[str, Any]:
+    def hls_renditions(self, video_info: Dict[str, Any]) -> List[Dict[str, Any]]:
         """
-        Обрабатывает видео - извлекает информацию, конвертирует и возвращает результат.
+        Выбирает качества адаптивного вывода для видео.
+
+        Качества выше исходного кадра не создаются. Вертикальное видео
+        вписывается в горизонтальный кадр 16:9 так же, как в convert_video.
+        
+        Args:
+            video_info: Информация о видео
+            
+        Returns:
+            Список качеств с ключами name, width, height и bitrate (от большего к меньшему)
+        """
+        source_height = self.output_height(video_info)
+        
+        ladder = [rung for rung in self.HLS_LADDER if rung['height'] <= source_height]
+        if not ladder:
+            # Исходник меньше нижней ступени - одно качество в исходном размере
+            smallest = self.HLS_LADDER[-1]
+            ladder = [dict(smallest, name=f"{source_height}p", height=source_height - source_height % 2)]
+        
+        renditions = []
+        for rung in ladder:
+            width, height = self.frame_size(video_info, rung['height'])
+            renditions.append({
+                'name': rung['name'],
+                'width': width,
+                'height': height,
+                'bitrate': rung['bitrate']
+            })
+        return renditions
+    
+    def build_hls_filter(self, video_info: Dict[str, Any], renditions: List[Dict[str, Any]]) -> str:
+        """
+        Формирует filter_complex, который раздает один декодированный поток на все качества.
+        
+        Выходы фильтра называются [v0], [v1], ... в порядке renditions.
+        """
+        fps = self.OUTPUT_SPEC['fps']
+        outputs = ''.join(f"[s{index}]" for index in range(len(renditions)))
+        chains = [f"[0:v]fps={fps},split={len(renditions)}{outputs}"]
+        for index, rendition in enumerate(renditions):
+            scale = self.build_scale_filter(video_info, rendition['width'], rendition['height'])
+            chains.append(f"[s{index}]{scale}[v{index}]")
+        return ';'.join(chains)
+    
+    def generate_output_dirname(self, input_filename: str) -> Tuple[str, str]:
+        """
+        Генерирует уникальное имя директории для адаптивного вывода.
+        
+        Returns:
+            Кортеж (относительное_имя, полный_путь)
+        """
+        base_name = os.path.splitext(os.path.basename(input_filename))[0]
+        if self.output_storage is not None:
+            return self.output_storage.reserve_name(f"{base_name}_hls")
+        
+        output_name = f"{base_name}_hls"
+        output_path = os.path.join(self.render_dir, output_name)
+        
+        counter = 1
+        while os.path.exists(output_path):
+            output_name = f"{base_name}_hls_{counter}"
+            output_path = os.path.join(self.render_dir, output_name)
+            counter += 1
+        
+        return output_name, output_path
+    
+    def convert_hls(self, input_path: str, output_dir: str, video_info: Dict[str, Any],
+                    renditions: List[Dict[str, Any]],
+                    progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+                    encoder_profile: Optional[str] = None, job_id: Optional[str] = None) -> bool:
+        """
+        Кодирует видео в несколько качеств HLS (сегменты fMP4) за один проход.
+
+        Источник декодируется один раз, фильтр split раздает кадры на
+        масштабирование для каждого качества, и все качества кодируются
+        libx264 в одном процессе FFmpeg. Ключевые кадры ставятся через
+        равные интервалы без учета смены сцен, поэтому границы сегментов
+        совпадают во всех качествах. Результат: master.m3u8 и по
+        поддиректории с плейлистом и сегментами на каждое качество.
         
         Args:
             input_path: Путь к исходному видео
-            original_filename: Исходное имя файла
+            output_dir: Директория результата
+            video_info: Информация о видео
+            renditions: Качества из hls_renditions
+            progress_callback: Функция, получающая снимки прогресса конвертации
+            encoder_profile: Имя профиля кодирования (общий для всех качеств)
+            job_id: Задача, к которой относится конвертация
             
         Returns:
-            Словарь с результатами обработки
+            True если конвертация успешна, иначе False
+            
+        Raises:
+            FFmpegAbortedError: Если FFmpeg остановлен надзором
         """
         try:
-            # Получаем информацию о видео
-            video_info = self.get_video_info(input_path)
+            profile = PROFILES[encoder_profile or DEFAULT_PROFILE]
+            gop = self.OUTPUT_SPEC['fps'] * self.HLS_SEGMENT_SECONDS
             
-            # Генерируем имя для выходного файла
-            output_filename, output_path = self.generate_output_filename(original_filename)
+            cmd = ['ffmpeg', '-y', '-i', input_path, '-filter_complex', self.build_hls_filter(video_info, renditions)]
+            for index in range(len(renditions)):
+                cmd.extend(['-map', f"[v{index}]"])
+            if video_info['has_audio']:
+                # Аудио кодируется один раз на каждое качество, но из одного декодированного потока
+                for _ in renditions:
+                    cmd.extend(['-map', '0:a:0'])
             
-            # Конвертируем видео
-            success = self.convert_video(input_path, output_path, video_info)
+            cmd.extend(['-c:v', self.OUTPUT_SPEC['video_codec']])
+            cmd.extend(build_profile_args(profile))
+            cmd.extend(['-g', str(gop), '-keyint_min', str(gop), '-sc_threshold', '0'])
+            for index, rendition in enumerate(renditions):
+                bitrate_kb = int(rendition['bitrate'] * profile['bitrate_factor'] / 1000)
+                cmd.extend([
+                    f"-b:v:{index}", f"{bitrate_kb}k",
+                    f"-maxrate:v:{index}", f"{bitrate_kb}k",
+                    f"-bufsize:v:{index}", f"{bitrate_kb * 2}k"
+                ])
+            cmd.extend(self.build_audio_args(video_info))
             
-            if not success:
+            if video_info['has_audio']:
+                stream_map = [f"v:{index},a:{index},name:{r['name']}" for index, r in enumerate(renditions)]
+            else:
+                stream_map = [f"v:{index},name:{r['name']}" for index, r in enumerate(renditions)]
+            
+            cmd.extend([
+                '-f', 'hls',
+                '-hls_time', str(self.HLS_SEGMENT_SECONDS),
+                '-hls_playlist_type', 'vod',
+                '-hls_segment_type', 'fmp4',
+                '-hls_flags', 'independent_segments',
+                '-hls_fmp4_init_filename', 'init.mp4',
+                '-hls_segment_filename', os.path.join(output_dir, '%v', 'segment_%05d.m4s'),
+                '-master_pl_name', 'master.m3u8',
+                '-var_stream_map', ' '.join(stream_map),
+                os.path.join(output_dir, '%v', 'playlist.m3u8')
+            ])
+            
+            for rendition in renditions:
+                os.makedirs(os.path.join(output_dir, rendition['name']), exist_ok=True)
+            
+            returncode, stderr = self.run_ffmpeg(
+                cmd, video_info['duration'], progress_callback, stage='encode_hls', job_id=job_id
+            )
+            if returncode != 0:
+                logger.error(f"Ошибка FFmpeg при кодировании HLS: {stderr}")
+                return False
+            
+            logger.info(f"Адаптивный вывод готов ({len(renditions)} качеств): {output_dir}")
+            return True
+            
+        except FFmpegAbortedError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка при кодировании HLS: {e}")
+            return False
+    
+    def process_video(self, input_path: str, original_filename: str,
+                      progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+                      video_info: Optional[Dict[str, Any]] = None,
+                      encoder_profile: Optional[str] = None,
+                      job_id: Optional[str] = None,
+                      output_filename: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Обрабатывает видео - извлекает информацию, конвертирует и возвращает результат.
+        
+        Args:
+            input_path: Путь к исходному видео
+            original_filename: Исходное имя файла
+            progress_callback: Функция, получающая снимки прогресса конвертации
+            video_info: Уже известная информация о видео (например, из предварительной
+                проверки); если не задана, файл анализируется ffprobe
+            encoder_profile: Имя профиля кодирования (по умолчанию DEFAULT_PROFILE)
+            job_id: Идентификатор задачи для отмены (cancel_job) и лимита времени
+            output_filename: Путь результата относительно render_dir; по умолчанию
+                уникальное имя по original_filename
+            
+        Returns:
+            Словарь с результатами обработки; status - 'completed', 'error'
+            или 'cancelled'. При включенных превью результат содержит previews
+            (preview_result). Ошибка, которую повтор не исправит (файл не
+            удалось проанализировать), помечена retryable=False
+        """
+        started = time.monotonic()
+        encoder_profile = encoder_profile or DEFAULT_PROFILE
+        output_path = None
+        preview_path = None
+        with self.supervisor.job(job_id), self.cpu_slot(job_id):
+            try:
+                # Получаем информацию о видео
+                if video_info is None:
+                    video_info = self.get_video_info(input_path)
+                
+                # Генерируем имя для выходного файла
+                if output_filename is None:
+                    output_filename, output_path = self.generate_output_filename(original_filename)
+                else:
+                    output_path = os.path.join(self.render_dir, output_filename)
+                    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                if self.previews:
+                    preview_dirname, preview_path = self.generate_preview_dirname(output_filename)
+                
+                # Выбираем способ обработки потоков
+                plan = self.plan_conversion(video_info)
+                
+                segment_count = 1
+                success = False
+                if plan['video'] == 'copy':
+                    with metrics.timed('remux'):
+                        success = self.remux_video(
+                            input_path, output_path, video_info, progress_callback, job_id=job_id,
+                            preview_dir=preview_path
+                        )
+                    if not success:
+                        # Копирование не удалось (например, из-за меток времени) - кодируем заново
+                        logger.warning(f"Копирование потоков не удалось, выполняется полная конвертация: {input_path}")
+                        plan = dict(plan, video='encode', mode='full')
+                
+                if plan['video'] == 'encode':
+                    # Длинные видео кодируем параллельно по сегментам
+                    segment_count = self.plan_segments(video_info)
+                    if segment_count > 1:
+                        with metrics.timed('encode_segmented'):
+                            success = self.convert_video_segmented(
+                                input_path, output_path, video_info, segment_count, progress_callback,
+                                encoder_profile, job_id, preview_path
+                            )
+                    else:
+                        with metrics.timed('encode'):
+                            success = self.convert_video(
+                                input_path, output_path, video_info, progress_callback,
+                                encoder_profile=encoder_profile, job_id=job_id, preview_dir=preview_path
+                            )
+                
+                if not success:
+                    # Недописанный файл не остается под зарезервированным именем: повтор получит новое
+                    self.cleanup_temp_file(output_path)
+                    self._discard_previews(preview_path)
+                    return {
+                        'status': 'error',
+                        'error': 'Ошибка при конвертации видео'
+                    }
+                
+                self._observe_result(output_path, video_info, plan, time.monotonic() - started)
+                
+                # Возвращаем результат
+                result = {
+                    'status': 'completed',
+                    'output_filename': output_filename,
+                    'video_info': video_info,
+                    'encode_segments': segment_count,
+                    'conversion_path': plan,
+                    # Профиль имеет значение только при перекодировании видеопотока
+                    'encoder_profile': encoder_profile if plan['video'] == 'encode' else None
+                }
+                if preview_path:
+                    result['previews'] = self.preview_result(video_info, preview_dirname, preview_path)
+                return result
+                
+            except FFmpegAbortedError as e:
+                self._discard_previews(preview_path)
+                return self._aborted_result(e, output_path)
+            except ValueError as e:
+                self._discard_previews(preview_path)
+                return self._invalid_input_result(e, output_path)
+            except Exception as e:
+                logger.error(f"Ошибка при обработке видео: {e}")
+                if output_path:
+                    self.cleanup_temp_file(output_path)
+                self._discard_previews(preview_path)
                 return {
                     'status': 'error',
-                    'error': 'Ошибка при конвертации видео'
+                    'error': str(e)
                 }
+    
+    def process_hls(self, input_path: str, original_filename: str,
+                    progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+                    video_info: Optional[Dict[str, Any]] = None,
+                    encoder_profile: Optional[str] = None,
+                    job_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Обрабатывает видео в режиме адаптивного вывода (HLS с несколькими качествами).
+        
+        Аргументы те же, что у process_video. Результат содержит
+        output_dir (директория в render_dir), playlist (имя главного
+        плейлиста) и renditions вместо output_filename.
+        
+        Returns:
+            Словарь с результатами обработки; status - 'completed', 'error'
+            или 'cancelled'
+        """
+        started = time.monotonic()
+        encoder_profile = encoder_profile or DEFAULT_PROFILE
+        output_path = None
+        with self.supervisor.job(job_id), self.cpu_slot(job_id):
+            try:
+                if video_info is None:
+                    video_info = self.get_video_info(input_path)
+                
+                output_dirname, output_path = self.generate_output_dirname(original_filename)
+                renditions = self.hls_renditions(video_info)
+                
+                with metrics.timed('encode_hls'):
+                    success = self.convert_hls(
+                        input_path, output_path, video_info, renditions, progress_callback, encoder_profile, job_id
+                    )
+                
+                if not success:
+                    shutil.rmtree(output_path, ignore_errors=True)
+                    return {
+                        'status': 'error',
+                        'error': 'Ошибка при конвертации видео'
+                    }
+                
+                plan = {
+                    'video': 'encode',
+                    'audio': self.plan_conversion(video_info)['audio'],
+                    'mode': 'hls'
+                }
+                self._observe_result(output_path, video_info, plan, time.monotonic() - started)
+                
+                return {
+                    'status': 'completed',
+                    'output_format': 'hls',
+                    'output_dir': output_dirname,
+                    'playlist': 'master.m3u8',
+                    'renditions': renditions,
+                    'video_info': video_info,
+                    'encode_segments': 1,
+                    'conversion_path': plan,
+                    'encoder_profile': encoder_profile
+                }
+                
+            except FFmpegAbortedError as e:
+                result = self._aborted_result(e, None)
+                if output_path:
+                    shutil.rmtree(output_path, ignore_errors=True)
+                return result
+            except ValueError as e:
+                result = self._invalid_input_result(e, None)
+                if output_path:
+                    shutil.rmtree(output_path, ignore_errors=True)
+                return result
+            except Exception as e:
+                logger.error(f"Ошибка при обработке видео: {e}")
+                if output_path:
+                    shutil.rmtree(output_path, ignore_errors=True)
+                return {
+                    'status': 'error',
+                    'error': str(e)
+                }
+    
+    def process_stream(self, input_chunks: Iterable[bytes], original_filename: str,
+                       video_info: Dict[str, Any],
+                       progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+                       encoder_profile: Optional[str] = None,
+                       job_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Обрабатывает видео, поступающее потоком в stdin FFmpeg.
+
+        Используется, пока файл еще загружается. Поток нельзя перечитать,
+        поэтому нет ни деления на сегменты, ни повторной попытки после
+        неудачного копирования потоков - при ошибке задачу нужно повторить
+        обычным способом по полностью загруженному файлу.
+        
+        Args:
+            input_chunks: Данные исходного видео по мере поступления
+            original_filename: Исходное имя файла
+            video_info: Информация о видео из предварительной проверки
+            progress_callback: Функция, получающая снимки прогресса конвертации
+            encoder_profile: Имя профиля кодирования (по умолчанию DEFAULT_PROFILE)
+            job_id: Идентификатор задачи для отмены (cancel_job) и лимита времени
             
-            # Возвращаем результат
-            return {
-                'status': 'completed',
-                'output_filename': output_filename,
-                'video_info': video_info
-            }
-            
-        except Exception as e:
-            logger.error(f"Ошибка при обработке видео: {e}")
+        Returns:
+            Словарь с результатами обработки
+        """
+        encoder_profile = encoder_profile or DEFAULT_PROFILE
+        output_filename, output_path = self.generate_output_filename(original_filename)
+        preview_path = None
+        if self.previews:
+            preview_dirname, preview_path = self.generate_preview_dirname(output_filename)
+        plan = self.plan_conversion(video_info)
+        
+        with self.supervisor.job(job_id), self.cpu_slot(job_id), metrics.timed('encode_stream'):
+            try:
+                if plan['video'] == 'copy':
+                    success = self.remux_video(
+                        'pipe:0', output_path, video_info, progress_callback, input_chunks, job_id, preview_path
+                    )
+                else:
+                    success = self.convert_video(
+                        'pipe:0', output_path, video_info, progress_callback, input_chunks, encoder_profile,
+                        job_id, preview_path
+                    )
+            except FFmpegAbortedError as e:
+                self._discard_previews(preview_path)
+                return self._aborted_result(e, output_path)
+        
+        if not success:
+            self.cleanup_temp_file(output_path)
+            self._discard_previews(preview_path)
             return {
                 'status': 'error',
-                'error': str(e)
+                'error': 'Ошибка при потоковой конвертации видео'
             }
+        
+        # Скорость потоковой конвертации ограничена загрузкой, поэтому учитываем только размер
+        metrics.OUTPUT_BYTES.inc(os.path.getsize(output_path), format='mp4')
+        
+        result = {
+            'status': 'completed',
+            'output_filename': output_filename,
+            'video_info': video_info,
+            'encode_segments': 1,
+            'conversion_path': plan,
+            'encoder_profile': encoder_profile if plan['video'] == 'encode' else None
+        }
+        if preview_path:
+            result['previews'] = self.preview_result(video_info, preview_dirname, preview_path)
+        return result
+    
+    def _aborted_result(self, error: FFmpegAbortedError, output_path: Optional[str]) -> Dict[str, Any]:
+        """Удаляет недописанный результат и формирует ответ для остановленной обработки"""
+        logger.warning(f"Обработка остановлена ({error.reason}): {error}")
+        if output_path:
+            self.cleanup_temp_file(output_path)
+        return {
+            'status': 'cancelled' if error.reason == 'cancelled' else 'error',
+            'error': str(error)
+        }
+    
+    def _invalid_input_result(self, error: ValueError, output_path: Optional[str]) -> Dict[str, Any]:
+        """
+        Формирует ответ для файла, который не удалось проанализировать.
+
+        Ошибки анализа и формата (нет видеопотока, ffprobe не читает файл)
+        не исправляются повтором, поэтому результат помечен retryable=False.
+        """
+        logger.error(f"Файл не удалось проанализировать: {error}")
+        if output_path:
+            self.cleanup_temp_file(output_path)
+        return {
+            'status': 'error',
+            'error': str(error),
+            'retryable': False
+        }
+    
+    @staticmethod
+    def _discard_previews(preview_path: Optional[str]):
+        """Удаляет превью неудавшейся или остановленной обработки"""
+        if preview_path:
+            shutil.rmtree(preview_path, ignore_errors=True)
+    
+    @staticmethod
+    def output_size(output_path: str) -> int:
+        """Размер результата в байтах: файла или всех файлов директории адаптивного вывода"""
+        return path_size(output_path)
+    
+    @classmethod
+    def _observe_result(cls, output_path: str, video_info: Dict[str, Any], plan: Dict[str, str], elapsed: float):
+        """Учитывает в метриках размер результата и скорость обработки"""
+        try:
+            metrics.OUTPUT_BYTES.inc(
+                cls.output_size(output_path), format='hls' if plan['mode'] == 'hls' else 'mp4'
+            )
+        except OSError:
+            pass
+        if elapsed > 0 and video_info['duration'] > 0:
+            metrics.REALTIME_FACTOR.observe(video_info['duration'] / elapsed, conversion_path=plan['mode'])
     
     def cleanup_temp_file(self, filepath: str) -> bool:
         """
@@ -315,10 +1754,12 @@ class VideoProcessor:
         """
         try:
             if os.path.exists(filepath):
-                os.remove(filepath)
+                with metrics.timed('cleanup'):
+                    os.remove(filepath)
                 logger.info(f"Удален временный файл: {filepath}")
                 return True
             return False
         except Exception as e:
             logger.error(f"Ошибка при удалении временного файла {filepath}: {e}")
-            return False
\ No newline at end of file
+            return False
+
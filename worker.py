@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+"""
+Обработчик очереди конвертации.
+
+Модуль выполняет задачи из долговременной очереди (job_queue.py). Те же
+функции используют потоки-обработчики веб-процесса, а запуск модуля как
+программы дает отдельный процесс, который не зависит от веб-сервера:
+перезапуск Flask не прерывает конвертации, а число обработчиков
+масштабируется отдельно от веб-процессов. Несколько процессов на одном
+сервере или на серверах с общим хранилищем разбирают одну очередь, если
+им доступны одни и те же база данных, uploads/, Render/ и cache/.
+
+Примеры:
+    python worker.py
+    python worker.py --workers 2 --database /srv/video/video_converter.db
+    python worker.py --metrics-port 9101
+"""
+import os
+import sys
+import time
+import signal
+import argparse
+from typing import Any, Dict, List, Optional
+import logging
+
+from video_utils import VideoProcessor
+from job_queue import Lease, QueueWorker, SQLiteJobQueue
+from job_store import JobStore, create_job_store
+from conversion_cache import ConversionCache
+from cost_model import CostModel
+from storage_manager import OutputStorage
+from cpu_partition import CPUPartitioner, available_cpus, default_worker_count
+from encoder_profiles import PROFILES, EncoderProfileSelector, ffmpeg_capabilities
+from media_probe import status_video_info
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ConversionJobRunner:
+    """
+    Выполняет задачи конвертации из очереди и сохраняет их результаты.
+
+    Данные задачи в очереди: input_path, original_filename, content_hash,
+    video_info (результат предварительной проверки или анализа при
+    постановке в очередь, None - если анализ не удался), requested_profile,
+    output_format ('mp4' или 'hls') и keep_input (исходник - файл сервера
+    из пакетной конвертации, а не загрузка: он никогда не удаляется).
+    """
+
+    def __init__(self, job_store: JobStore, job_queue: SQLiteJobQueue, video_processor: VideoProcessor,
+                 profile_selector: EncoderProfileSelector, cost_model: CostModel,
+                 conversion_cache: Optional[ConversionCache] = None,
+                 cleanup_temp_files: bool = True, progress_interval: float = 1.0):
+        """
+        Инициализирует обработчик задач.
+
+        Args:
+            job_store: Хранилище статусов задач
+            job_queue: Очередь задач
+            video_processor: Процессор видео
+            profile_selector: Выбор профиля кодирования по нагрузке
+            cost_model: Оценка времени обработки для порядка очереди
+            conversion_cache: Кеш результатов (None - не сохранять результаты)
+            cleanup_temp_files: Удалять загруженный файл после обработки
+            progress_interval: Как часто сохранять прогресс FFmpeg (в секундах)
+        """
+        self.job_store = job_store
+        self.job_queue = job_queue
+        self.video_processor = video_processor
+        self.profile_selector = profile_selector
+        self.cost_model = cost_model
+        self.conversion_cache = conversion_cache
+        self.cleanup_temp_files = cleanup_temp_files
+        self.progress_interval = progress_interval
+
+    def select_encoder_profile(self, requested_profile: Optional[str] = None) -> str:
+        """Выбирает профиль кодирования с учетом текущей загрузки очереди"""
+        queue_stats = self.job_queue.stats()
+        return self.profile_selector.select(queue_stats['queued_jobs'], queue_stats['workers'], requested_profile)
+
+    def cost_key(self, video_info: Dict[str, Any], output_format: str = 'mp4',
+                 encoder_profile: Optional[str] = None) -> str:
+        """Ключ модели стоимости для способа и профиля, которыми будет обработано видео"""
+        if output_format == 'hls':
+            return CostModel.cost_key({'video': 'encode', 'mode': 'hls'}, 1, encoder_profile)
+        plan = self.video_processor.plan_conversion(video_info)
+        segments = self.video_processor.plan_segments(video_info) if plan['video'] == 'encode' else 1
+        return CostModel.cost_key(plan, segments, encoder_profile)
+
+    def estimate_cost(self, video_info: Optional[Dict[str, Any]], output_format: str = 'mp4',
+                      requested_profile: Optional[str] = None) -> float:
+        """
+        Оценивает время обработки задачи в секундах (для неизвестного видео - по умолчанию).
+
+        Профиль выбирается окончательно в начале обработки; для оценки берется
+        профиль, который выбор по нагрузке дал бы сейчас.
+        """
+        if not video_info:
+            return self.cost_model.estimate(None, '')
+        encoder_profile = self.select_encoder_profile(requested_profile)
+        return self.cost_model.estimate(video_info, self.cost_key(video_info, output_format, encoder_profile))
+
+    def output_path(self, result: Dict[str, Any]) -> str:
+        """Путь к результату задачи: файлу MP4 или директории адаптивного вывода"""
+        return os.path.join(self.video_processor.render_dir, result.get('output_filename') or result['output_dir'])
+
+    def make_progress_callback(self, job_id: str):
+        """
+        Создает обработчик прогресса FFmpeg для задачи.
+
+        Прогресс сохраняется в хранилище не чаще progress_interval,
+        чтобы не нагружать базу записью на каждый блок вывода FFmpeg.
+        """
+        last_update = [0.0]
+
+        def on_progress(progress):
+            now = time.monotonic()
+            if progress['percent'] < 100 and now - last_update[0] < self.progress_interval:
+                return
+            last_update[0] = now
+            self.job_store.update(job_id, {'progress': progress})
+
+        return on_progress
+
+    def handle(self, lease: Lease) -> Optional[str]:
+        """
+        Выполняет задачу, выданную из очереди.
+
+        Returns:
+            None, если задача завершена (или отменена), иначе сообщение
+            об ошибке - очередь повторит задачу или переведет ее в dead-letter
+        """
+        job_id = lease.job_id
+        payload = lease.payload
+
+        # Профиль выбирается в момент начала обработки, по нагрузке на это время
+        encoder_profile = self.select_encoder_profile(payload.get('requested_profile'))
+        self.job_store.update(job_id, {
+            'status': 'processing',
+            'start_time': time.time(),
+            'encoder_profile': encoder_profile,
+            'attempts': lease.attempts,
+            'progress': None
+        })
+        metrics.JOBS_IN_FLIGHT.inc()
+
+        # Адаптивный вывод (несколько качеств HLS) кодируется за один проход
+        if payload.get('output_format') == 'hls':
+            process = self.video_processor.process_hls
+        else:
+            process = self.video_processor.process_video
+
+        try:
+            result = process(
+                payload['input_path'],
+                payload['original_filename'],
+                progress_callback=self.make_progress_callback(job_id),
+                video_info=payload.get('video_info'),
+                encoder_profile=encoder_profile,
+                job_id=job_id
+            )
+        finally:
+            metrics.JOBS_IN_FLIGHT.dec()
+
+        # Аренду забрал другой обработчик: результат этой попытки не сохраняем
+        if lease.lost:
+            return None
+
+        if result['status'] == 'error':
+            # Ошибки анализа и формата файла повтор не исправит: сразу в dead-letter.
+            # Повторяются аварийные завершения FFmpeg и остановленные (зависшие) попытки
+            if not result.get('retryable', True):
+                lease.retryable = False
+            if not lease.final_attempt:
+                self.job_store.update(job_id, {'status': 'queued', 'progress': None, 'error': result['error']})
+            return result['error']
+
+        self.finish_job(
+            job_id, payload['input_path'], result, payload.get('content_hash'), payload.get('keep_input', False)
+        )
+        return None
+
+    def finish_job(self, job_id: str, input_path: str, result: Dict[str, Any], content_hash: Optional[str],
+                   keep_input: bool = False):
+        """
+        Сохраняет результат конвертации.
+
+        Args:
+            job_id: Идентификатор задачи
+            input_path: Путь к исходному видео
+            result: Результат VideoProcessor.process_video
+            content_hash: Хеш исходного файла для сохранения результата в кеш
+            keep_input: Не удалять исходное видео (файл сервера)
+        """
+        # Время обработки сохраняется в записи, из него считается среднее в /stats
+        record = self.job_store.get(job_id) or {}
+        if result['status'] == 'completed' and record.get('start_time'):
+            result = dict(result, processing_time=time.time() - record['start_time'])
+
+            # Уточняем модель стоимости; скорость конвертации во время загрузки ограничена самой загрузкой
+            if not record.get('pipelined') and result.get('video_info'):
+                self.cost_model.observe(
+                    result['video_info'],
+                    CostModel.cost_key(
+                        result['conversion_path'], result.get('encode_segments', 1), result.get('encoder_profile')
+                    ),
+                    result['processing_time']
+                )
+
+            # Размер результата сохраняется в записи для статистики профилей в /stats
+            output_path = self.output_path(result)
+            if os.path.exists(output_path):
+                result['output_size'] = self.video_processor.output_size(output_path)
+
+        # Краткая информация о видео для /status считается один раз, а не при каждом запросе
+        if result.get('video_info'):
+            result = dict(result, video_summary=status_video_info(result['video_info']))
+
+        # Обновляем статус
+        self.job_store.update(job_id, result)
+        metrics.JOBS_FINISHED.inc(status=result['status'])
+
+        # Готовый результат учитывается в сроке хранения и квоте Render/
+        if result['status'] == 'completed' and self.video_processor.output_storage is not None:
+            self.video_processor.output_storage.register(
+                result.get('output_filename') or result['output_dir'], job_id
+            )
+            if result.get('previews'):
+                self.video_processor.output_storage.register(result['previews']['dir'], job_id)
+
+        # Сохраняем результат в кеш для повторных загрузок того же файла (только одиночные MP4)
+        if (self.conversion_cache is not None and content_hash and result['status'] == 'completed'
+                and result.get('output_filename')):
+            cached = {
+                'video_info': result.get('video_info', {}),
+                'encoder_profile': result.get('encoder_profile'),
+                'conversion_path': result.get('conversion_path')
+            }
+            previews_path = None
+            if result.get('previews'):
+                # Имя директории превью задается при выдаче из кеша заново
+                cached['previews'] = {key: value for key, value in result['previews'].items() if key != 'dir'}
+                previews_path = os.path.join(self.video_processor.render_dir, result['previews']['dir'])
+            self.conversion_cache.store(
+                content_hash,
+                self.video_processor.conversion_params_key(result.get('encoder_profile')),
+                os.path.join(self.video_processor.render_dir, result['output_filename']),
+                cached,
+                previews_path
+            )
+
+        # Очищаем временный файл, если требуется; файл отмененной задачи больше не нужен
+        if not keep_input and (self.cleanup_temp_files or result['status'] == 'cancelled'):
+            self.video_processor.cleanup_temp_file(input_path)
+
+    def dead_letter(self, job_id: str, payload: Dict[str, Any], error: str):
+        """Завершает с ошибкой задачу, переведенную в dead-letter, и удаляет ее файл"""
+        self.job_store.update(job_id, {'status': 'error', 'error': error, 'dead_letter': True})
+        metrics.JOBS_FINISHED.inc(status='error')
+        if not payload.get('keep_input'):
+            self.video_processor.cleanup_temp_file(payload['input_path'])
+
+    def cancel(self, job_id: str):
+        """Останавливает обработку задачи в этом процессе"""
+        self.video_processor.cancel_job(job_id)
+
+    def create_worker(self, heartbeat_interval: float = 10, poll_interval: float = 1.0) -> QueueWorker:
+        """Создает обработчики очереди, выполняющие задачи этим объектом"""
+        return QueueWorker(
+            self.job_queue, self.handle, self.dead_letter, self.cancel,
+            heartbeat_interval=heartbeat_interval, poll_interval=poll_interval
+        )
+
+
+def io_priority(value: str) -> Optional[int]:
+    """Разбирает --io-priority: уровень 0-7 или 'none'"""
+    if value.lower() == 'none':
+        return None
+    try:
+        level = int(value)
+    except ValueError:
+        level = -1
+    if not 0 <= level <= 7:
+        raise argparse.ArgumentTypeError("ожидается уровень 0-7 или 'none'")
+    return level
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Обработчик очереди конвертации видео')
+    parser.add_argument('--workers', type=int, default=default_worker_count(),
+                        help='Количество одновременно выполняемых задач')
+    parser.add_argument('--database', default='video_converter.db', help='Общая база задач и очереди')
+    parser.add_argument('--upload-dir', default='uploads', help='Директория загруженных файлов')
+    parser.add_argument('--render-dir', default='Render', help='Директория готовых файлов')
+    parser.add_argument('--cache-dir', default='cache', help='Директория кеша (пусто - без кеша)')
+    parser.add_argument('--cache-max-bytes', type=int, default=20 * 1024 * 1024 * 1024, help='Лимит объема кеша')
+    parser.add_argument('--lease-seconds', type=float, default=60, help='Срок аренды задачи')
+    parser.add_argument('--heartbeat-interval', type=float, default=10, help='Период продления аренды')
+    parser.add_argument('--max-attempts', type=int, default=3, help='Попыток до перевода в dead-letter')
+    parser.add_argument('--retry-delay', type=float, default=30, help='Задержка перед повторной попыткой')
+    parser.add_argument('--segment-threshold', type=float, default=600,
+                        help='Длительность, начиная с которой видео кодируется по сегментам (0 - отключить)')
+    parser.add_argument('--no-remux', action='store_true', help='Всегда перекодировать видеопоток')
+    parser.add_argument('--no-previews', action='store_true', help='Не создавать превью рядом с MP4')
+    parser.add_argument('--stall-timeout', type=float, default=120, help='Тайм-аут FFmpeg без прогресса')
+    parser.add_argument('--job-max-seconds', type=float, default=6 * 60 * 60, help='Лимит времени одной задачи')
+    parser.add_argument('--encoder-profile', default='auto', choices=['auto'] + sorted(PROFILES),
+                        help='Профиль кодирования')
+    parser.add_argument('--keep-temp-files', action='store_true', help='Не удалять загруженные файлы')
+    parser.add_argument('--cpus', help='Процессоры для кодирования в формате cpuset, например 4-15 (по умолчанию все); '
+                                       'процессам обработчиков на одном сервере стоит давать разные')
+    parser.add_argument('--reserved-cpus', type=int, default=1,
+                        help='Процессоров, на которых FFmpeg не запускается (остаются веб-процессам)')
+    parser.add_argument('--nice', type=int, default=10, help='Приращение nice процессов FFmpeg')
+    parser.add_argument('--io-priority', type=io_priority, default=7,
+                        help='Приоритет ввода-вывода FFmpeg: best-effort 0-7, 7 - низший (none - не менять)')
+    parser.add_argument('--no-cpu-partitioning', action='store_true',
+                        help='Не делить процессоры между задачами и не привязывать к ним FFmpeg')
+    parser.add_argument('--metrics-port', type=int,
+                        help='Порт HTTP для метрик Prometheus (/metrics) этого процесса; '
+                             'каждому процессу нужен свой порт и своя цель сбора')
+    parser.add_argument('--metrics-host', default='', help='Адрес для метрик (по умолчанию все интерфейсы)')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    # Очередь и статусы должны быть общими с веб-процессами, поэтому только SQLite
+    job_store = create_job_store('sqlite', args.database)
+    job_queue = SQLiteJobQueue(
+        args.database,
+        lease_seconds=args.lease_seconds,
+        max_attempts=args.max_attempts,
+        retry_delay=args.retry_delay
+    )
+    cpu_partitioner = None
+    if not args.no_cpu_partitioning:
+        cpu_partitioner = CPUPartitioner(
+            available_cpus(args.cpus), args.workers, reserved=args.reserved_cpus, nice=args.nice,
+            io_priority=args.io_priority
+        )
+    video_processor = VideoProcessor(
+        render_dir=args.render_dir,
+        temp_dir=args.upload_dir,
+        segment_threshold=args.segment_threshold,
+        remux_enabled=not args.no_remux,
+        previews=not args.no_previews,
+        stall_timeout=args.stall_timeout,
+        max_job_duration=args.job_max_seconds,
+        output_storage=OutputStorage(args.render_dir, args.database),
+        cpu_partitioner=cpu_partitioner
+    )
+    ffmpeg_capabilities()
+
+    conversion_cache = None
+    if args.cache_dir:
+        conversion_cache = ConversionCache(args.cache_dir, args.database, args.cache_max_bytes)
+
+    runner = ConversionJobRunner(
+        job_store, job_queue, video_processor, EncoderProfileSelector(args.encoder_profile),
+        CostModel(args.database), conversion_cache, cleanup_temp_files=not args.keep_temp_files
+    )
+    worker = runner.create_worker(heartbeat_interval=args.heartbeat_interval)
+
+    # Текущие задачи дорабатываются; повторный сигнал завершает процесс сразу,
+    # и задачи после истечения аренды заберут другие обработчики
+    def on_signal(signum, frame):
+        logger.info('Получен сигнал завершения, обработчики остановятся после текущих задач')
+        signal.signal(signum, signal.SIG_DFL)
+        worker.stop()
+
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
+
+    # Метрики FFmpeg и задач этого процесса не видны веб-процессам: отдаем их сами
+    if args.metrics_port is not None:
+        metrics.serve(args.metrics_port, args.metrics_host)
+
+    worker.start(args.workers)
+    worker.join()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())